@@ -4,13 +4,13 @@ This script launches a lineage editor/viewer using data configured like awatters
 """
 
 from segmentation_viz_workflow import lineage_forest
+import json
 #from segmentation_viz_workflow import images_gizmos
 #from H5Gizmos import serve
-import json
 
 fn = "Combined.json"
-json_ob = json.load(open(fn))
-F = lineage_forest.make_forest_from_haydens_json_graph(json_ob)
+# cached as Combined.json.forest.npz and rebuilt when Combined.json changes.
+F = lineage_forest.load_forest_from_haydens_json_file(fn)
 
 trivialize = False
 
@@ -36,6 +36,13 @@ print()
 print("CHECKING LABELS")
 print()
 
-import cProfile
-
-cProfile.run("F.check_labels()")
+report = F.check_labels(trivial=False)
+print("No volume file for", report["missing_volumes"])
+for ordinal in report["mismatched"]:
+    entry = report["ordinals"][ordinal]
+    print("ts ordinal", ordinal)
+    print("     labels missing in lineage", entry["labels_missing_in_lineage"])
+    print("     labels missing in volume", entry["labels_missing_in_volume"])
+with open("label_report.json", "w") as f:
+    json.dump(report, f, indent=1)
+print("Wrote label_report.json")
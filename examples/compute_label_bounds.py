@@ -0,0 +1,26 @@
+"""
+Precompute per timestamp label bounding boxes for the lineage viewer and save them with the cached forest.
+
+With bounds for every timestamp the viewer crops all timestamps to their union
+and reads only that region from loaders that support regions.
+Run this once after the label volumes change.
+"""
+
+from segmentation_viz_workflow import lineage_forest
+
+fn = "Combined.json"
+# cached as Combined.json.forest.npz and rebuilt when Combined.json changes.
+F = lineage_forest.load_forest_from_haydens_json_file(fn)
+
+label_pattern = "labels/klbOut_Cam_Long_%(ordinal)05d.crop_cp_masks.klb"
+image_pattern = "images/klbOut_Cam_Long_%(ordinal)05d.crop.klb"
+F.load_klb_using_file_patterns(
+        image_pattern=image_pattern,
+        label_pattern=label_pattern,
+    )
+
+print("Scanning", len(F.missing_label_bounds()), "label volumes.")
+F.compute_label_bounds()
+print("Crop region for all timestamps:", F.crop_region())
+F.save(F.saved_path)
+print("Saved bounds with the forest in", repr(F.saved_path))
@@ -6,11 +6,10 @@ This script launches a lineage editor/viewer using data configured like awatters
 from segmentation_viz_workflow import lineage_forest
 from segmentation_viz_workflow import images_gizmos
 from H5Gizmos import serve
-import json
 
 fn = "Combined.json"
-json_ob = json.load(open(fn))
-F = lineage_forest.make_forest_from_haydens_json_graph(json_ob)
+# cached as Combined.json.forest.npz and rebuilt when Combined.json changes.
+F = lineage_forest.load_forest_from_haydens_json_file(fn)
 
 trivialize = False
 
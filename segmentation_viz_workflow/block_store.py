@@ -0,0 +1,218 @@
+"""
+Chunked compressed block stores for volume time series.
+
+A store is a directory holding a JSON manifest (blocks.json) and one data file per timestamp.
+Each data file holds the zlib compressed chunks of the volume in C order followed by a
+chunk table of (offset, length) pairs.  Chunks that are entirely zero are not stored,
+so mostly empty label volumes stay small.
+
+BlockStore.read(ordinal, region) decompresses only the chunks intersecting region,
+so cropped views cost I/O proportional to the region rather than the volume.
+"""
+
+import json
+import os
+import zlib
+import numpy as np
+
+BLOCK_FORMAT = "segmentation_viz_workflow.blocks.v1"
+MANIFEST_NAME = "blocks.json"
+DEFAULT_CHUNK_SHAPE = (64, 64, 64)
+TABLE_DTYPE = np.dtype("<i8")
+
+
+def full_region(shape):
+    "Region (as from operations3d.positive_slicing) covering a whole volume of shape."
+    return np.array([[0, n] for n in shape], dtype=np.int64)
+
+
+def clip_region(region, shape):
+    "region clipped to a volume of shape, as an int array of (start, end) rows."
+    region = np.array(region, dtype=np.int64).reshape((3, 2))
+    upper = np.array(shape, dtype=np.int64)
+    region[:, 0] = np.clip(region[:, 0], 0, upper)
+    region[:, 1] = np.clip(region[:, 1], region[:, 0], upper)
+    return region
+
+
+def chunk_ranges(region, chunk_shape):
+    "range of chunk indices intersecting region along each axis."
+    return [
+        range(start // c, -(-end // c))
+        for ((start, end), c) in zip(region.tolist(), chunk_shape)
+    ]
+
+
+class BlockStore:
+
+    def __init__(self, store_dir, chunk_shape=DEFAULT_CHUNK_SHAPE, level=1):
+        "Open the store in store_dir (creating it if needed; chunk_shape and level only apply to new stores)."
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+            assert self.manifest.get("format") == BLOCK_FORMAT, "not a block store: " + repr(store_dir)
+        else:
+            if not os.path.isdir(store_dir):
+                os.makedirs(store_dir)
+            self.manifest = dict(
+                format=BLOCK_FORMAT,
+                chunk_shape=[int(c) for c in chunk_shape],
+                compression="zlib",
+                level=level,
+                timestamps={},
+            )
+        self.chunk_shape = tuple(self.manifest["chunk_shape"])
+        self.tables = {}  # ordinal -> chunk table, read on first use
+
+    def ordinals(self):
+        return sorted(int(o) for o in self.manifest["timestamps"])
+
+    def entry(self, ordinal):
+        "Manifest entry for ordinal or None if the store has no volume for it."
+        return self.manifest["timestamps"].get(str(ordinal))
+
+    def __contains__(self, ordinal):
+        return self.entry(ordinal) is not None
+
+    def shape(self, ordinal):
+        return tuple(self.entry(ordinal)["shape"])
+
+    def data_path(self, ordinal):
+        return os.path.join(self.store_dir, self.entry(ordinal)["data_file"])
+
+    def write(self, ordinal, volume):
+        "Store volume for ordinal, replacing any previous volume."
+        assert volume.ndim == 3, "only 3d volumes are stored: " + repr(volume.shape)
+        level = self.manifest["level"]
+        chunk_shape = self.chunk_shape
+        data_file = "%05d.blocks" % ordinal
+        path = os.path.join(self.store_dir, data_file)
+        temp_path = path + ".tmp"
+        ranges = chunk_ranges(full_region(volume.shape), chunk_shape)
+        table = np.zeros((len(ranges[0]), len(ranges[1]), len(ranges[2]), 2), dtype=TABLE_DTYPE)
+        offset = 0
+        with open(temp_path, "wb") as f:
+            for ci in ranges[0]:
+                for cj in ranges[1]:
+                    for ck in ranges[2]:
+                        (i, j, k) = (ci * chunk_shape[0], cj * chunk_shape[1], ck * chunk_shape[2])
+                        chunk = volume[i: i + chunk_shape[0], j: j + chunk_shape[1], k: k + chunk_shape[2]]
+                        if not chunk.any():
+                            continue  # zero chunks have length 0.
+                        data = zlib.compress(np.ascontiguousarray(chunk).tobytes(), level)
+                        f.write(data)
+                        table[ci, cj, ck] = (offset, len(data))
+                        offset += len(data)
+            f.write(table.tobytes())
+        os.replace(temp_path, path)
+        self.manifest["timestamps"][str(ordinal)] = dict(
+            shape=list(volume.shape),
+            dtype=volume.dtype.str,
+            data_file=data_file,
+            table_offset=offset,
+        )
+        self.tables.pop(ordinal, None)
+        self.write_manifest()
+
+    def write_manifest(self):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def table(self, ordinal, f):
+        "Chunk table for ordinal (read from the open data file f on first use)."
+        table = self.tables.get(ordinal)
+        if table is None:
+            entry = self.entry(ordinal)
+            counts = [len(r) for r in chunk_ranges(full_region(entry["shape"]), self.chunk_shape)]
+            f.seek(entry["table_offset"])
+            data = f.read(int(np.prod(counts)) * 2 * TABLE_DTYPE.itemsize)
+            table = self.tables[ordinal] = np.frombuffer(data, dtype=TABLE_DTYPE).reshape(counts + [2])
+        return table
+
+    def read(self, ordinal, region=None):
+        """
+        Volume for ordinal (or None if the store has none), or only its region
+        given as (start, end) rows per axis like operations3d.positive_slicing.
+        Only the chunks intersecting the region are read.
+        """
+        entry = self.entry(ordinal)
+        if entry is None:
+            return None
+        shape = entry["shape"]
+        dtype = np.dtype(entry["dtype"])
+        if region is None:
+            region = full_region(shape)
+        region = clip_region(region, shape)
+        origin = region[:, 0]
+        result = np.zeros(tuple(region[:, 1] - origin), dtype=dtype)
+        if result.size == 0:
+            return result
+        chunk_shape = np.array(self.chunk_shape, dtype=np.int64)
+        ranges = chunk_ranges(region, self.chunk_shape)
+        with open(self.data_path(ordinal), "rb") as f:
+            table = self.table(ordinal, f)
+            for ci in ranges[0]:
+                for cj in ranges[1]:
+                    for ck in ranges[2]:
+                        (offset, length) = table[ci, cj, ck]
+                        if length == 0:
+                            continue
+                        f.seek(offset)
+                        chunk_start = np.array([ci, cj, ck]) * chunk_shape
+                        chunk_end = np.minimum(chunk_start + chunk_shape, shape)
+                        chunk = np.frombuffer(zlib.decompress(f.read(length)), dtype=dtype)
+                        chunk = chunk.reshape(tuple(chunk_end - chunk_start))
+                        # intersection of the chunk and the region, in volume coordinates.
+                        low = np.maximum(chunk_start, origin)
+                        high = np.minimum(chunk_end, region[:, 1])
+                        source = tuple(slice(l, h) for (l, h) in zip(low - chunk_start, high - chunk_start))
+                        target = tuple(slice(l, h) for (l, h) in zip(low - origin, high - origin))
+                        result[target] = chunk[source]
+        return result
+
+
+class BlockStoreLoader:
+
+    "Volume loader (ordinal, region=None) -> array or None reading from a BlockStore directory."
+
+    supports_region = True
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.store = None
+
+    def __call__(self, ordinal, region=None):
+        store = self.store
+        if store is None:
+            store = self.store = BlockStore(self.store_dir)
+        return store.read(ordinal, region)
+
+    def __getstate__(self):
+        # worker processes reopen the store.
+        return dict(store_dir=self.store_dir, store=None)
+
+
+def convert_series(loader, ordinals, store_dir, chunk_shape=DEFAULT_CHUNK_SHAPE, level=1, overwrite=False, verbose=True):
+    """
+    Rewrite the volumes loader(ordinal) for ordinals (for example a KLB or TIFF series)
+    into the block store in store_dir.  Ordinals already in the store are skipped unless overwrite,
+    so an interrupted conversion can be resumed.  Ordinals without a volume are skipped.
+    Returns the BlockStore.
+    """
+    store = BlockStore(store_dir, chunk_shape=chunk_shape, level=level)
+    for ordinal in ordinals:
+        if ordinal in store and not overwrite:
+            continue
+        volume = loader(ordinal)
+        if volume is None:
+            if verbose:
+                print("No volume for", ordinal)
+            continue
+        store.write(ordinal, volume)
+        if verbose:
+            print("Stored", ordinal, volume.shape, "in", store_dir)
+    return store
@@ -0,0 +1,144 @@
+"""
+Per stage timing and throughput instrumentation for the surface capture pipeline.
+
+Each record describes one stage for one timestamp:
+timestamp, stage, seconds, bytes_read, voxels and labels.
+Records can be exported as JSON or CSV or passed to a callback as they are made.
+"""
+
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+STAGES = ["decode", "subsample", "dicts", "crop", "surfaces", "serialize"]
+COUNTS = ["bytes_read", "voxels", "labels"]
+FIELDS = ["timestamp", "stage", "seconds"] + COUNTS
+
+
+class CaptureStats:
+
+    def __init__(self, callback=None):
+        "callback(record) is called for each record as it is made."
+        self.callback = callback
+        self.records = []
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+    def record(self, timestamp, stage, seconds=0.0, **counts):
+        record = dict(timestamp=timestamp, stage=stage, seconds=seconds)
+        for name in COUNTS:
+            record[name] = counts.get(name, 0)
+        self.add_record(record)
+        return record
+
+    def add_record(self, record):
+        with self.lock:
+            self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def extend(self, records):
+        "Add records collected elsewhere (for example in a worker process)."
+        for record in records:
+            self.add_record(record)
+
+    @contextmanager
+    def stage(self, timestamp, stage):
+        "Time the enclosed block.  The block may fill in the yielded counts dictionary."
+        counts = {}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.record(timestamp, stage, time.perf_counter() - start, **counts)
+
+    def per_timestamp(self):
+        "One summary row per timestamp with seconds per stage and summed counts."
+        ts_to_row = {}
+        with self.lock:
+            records = list(self.records)
+        for record in records:
+            ts = record["timestamp"]
+            row = ts_to_row.get(ts)
+            if row is None:
+                row = ts_to_row[ts] = dict(timestamp=ts, seconds=0.0)
+                for name in STAGES:
+                    row[name + "_seconds"] = 0.0
+                for name in COUNTS:
+                    row[name] = 0
+            row["seconds"] += record["seconds"]
+            key = record["stage"] + "_seconds"
+            row[key] = row.get(key, 0.0) + record["seconds"]
+            for name in COUNTS:
+                row[name] += record[name]
+        # whole run stages (timestamp None) sort last.
+        order = sorted(ts_to_row, key=lambda ts: (ts is None, ts if ts is not None else 0))
+        return [ts_to_row[ts] for ts in order]
+
+    def totals(self):
+        "Seconds and counts summed per stage over all timestamps."
+        result = {}
+        with self.lock:
+            records = list(self.records)
+        for record in records:
+            total = result.setdefault(record["stage"], dict(seconds=0.0, bytes_read=0, voxels=0, labels=0))
+            total["seconds"] += record["seconds"]
+            for name in COUNTS:
+                total[name] += record[name]
+        return result
+
+    def json_ob(self):
+        return dict(
+            wall_seconds=time.time() - self.start_time,
+            totals=self.totals(),
+            per_timestamp=self.per_timestamp(),
+            records=list(self.records),
+        )
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.json_ob(), f, indent=1)
+
+    def to_csv(self, path, per_timestamp=True):
+        "Write the per timestamp summary (or the raw records) as CSV."
+        if per_timestamp:
+            rows = self.per_timestamp()
+            fields = ["timestamp", "seconds"] + [name + "_seconds" for name in STAGES] + COUNTS
+        else:
+            rows = list(self.records)
+            fields = FIELDS
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+@contextmanager
+def timed(stats, timestamp, stage):
+    "stats.stage(timestamp, stage), or a no-op if stats is None."
+    if stats is None:
+        yield {}
+    else:
+        with stats.stage(timestamp, stage) as counts:
+            yield counts
+
+
+def record_when_done(stats, result, timestamp, stage, start, **counts):
+    """
+    Record stage for timestamp from start (a time.perf_counter value) until result is ready:
+    now if result is finished, or when it completes if it is a future.
+    Future callbacks run on the executor thread (CaptureStats is thread safe).
+    No-op if stats is None.
+    """
+    if stats is None:
+        return
+
+    def done(*ignored):
+        stats.record(timestamp, stage, time.perf_counter() - start, **counts)
+
+    if hasattr(result, "add_done_callback"):
+        result.add_done_callback(done)
+    else:
+        done()
@@ -0,0 +1,324 @@
+"""
+Headless surface extraction for label volumes using numpy on the CPU.
+
+Produces the same sequence JSON format as feedWebGL2.surfaces_sequence.SurfaceMaker
+(positions, normals and colors quantized by a multiplier) without a browser connection.
+Isosurfaces are extracted by marching tetrahedra over a Kuhn subdivision of each grid cube,
+which needs no 256 case lookup table and gives crack free shared vertices.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.ndimage import gaussian_filter, find_objects
+
+MULTIPLIER = 999
+ISO_LEVEL = 0.5
+
+# The 6 tetrahedra of the Kuhn subdivision of the unit cube, as corner offsets.
+# Every tetrahedron edge is a non negative 0/1 step so edges are shared between cells.
+KUHN_TETRAHEDRA = []
+for (a, b) in [(0, 1), (0, 2), (1, 0), (1, 2), (2, 0), (2, 1)]:
+    ea = np.zeros(3, dtype=np.int64)
+    ea[a] = 1
+    eb = np.zeros(3, dtype=np.int64)
+    eb[b] = 1
+    KUHN_TETRAHEDRA.append(np.array([[0, 0, 0], ea, ea + eb, [1, 1, 1]], dtype=np.int64))
+
+
+def tetrahedron_case_edges():
+    """
+    For each of the 16 inside/outside cases of a tetrahedron list the triangles
+    crossing it, each triangle given as 3 vertex index pairs (edges).
+    """
+    result = []
+    for case in range(16):
+        inside = [v for v in range(4) if case & (1 << v)]
+        outside = [v for v in range(4) if not case & (1 << v)]
+        triangles = []
+        if len(inside) in (1, 3):
+            if len(inside) == 1:
+                [odd] = inside
+                others = outside
+            else:
+                [odd] = outside
+                others = inside
+            triangles.append([(odd, v) for v in others])
+        elif len(inside) == 2:
+            [a, b] = inside
+            [c, d] = outside
+            triangles.append([(a, c), (a, d), (b, d)])
+            triangles.append([(a, c), (b, d), (b, c)])
+        result.append(triangles)
+    return result
+
+CASE_EDGES = tetrahedron_case_edges()
+
+
+def isosurface(field, level=ISO_LEVEL):
+    """
+    Extract the level isosurface of a 3d field with marching tetrahedra.
+    Returns (positions, normals, triangles) as float (n,3), float (n,3) and int (m,3) arrays
+    in array index coordinates.  Normals point toward decreasing field values.
+    """
+    field = np.asarray(field, dtype=np.float32)
+    (I, J, K) = field.shape
+    empty = (np.zeros((0, 3)), np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+    if min(I, J, K) < 2:
+        return empty
+    cells = np.indices((I - 1, J - 1, K - 1)).reshape((3, -1)).T
+    all_keys = []
+    all_low = []
+    all_delta = []
+    for corners in KUHN_TETRAHEDRA:
+        values = np.stack([
+            field[c[0]: c[0] + I - 1, c[1]: c[1] + J - 1, c[2]: c[2] + K - 1].ravel()
+            for c in corners
+        ], axis=1)
+        inside = (values > level)
+        case = (inside * np.array([1, 2, 4, 8])).sum(axis=1)
+        for case_index in range(1, 15):
+            (selected,) = np.nonzero(case == case_index)
+            if len(selected) == 0:
+                continue
+            origins = cells[selected]
+            for triangle in CASE_EDGES[case_index]:
+                for (p, q) in triangle:
+                    (cp, cq) = (corners[p], corners[q])
+                    if (cq - cp).min() < 0:
+                        (cp, cq) = (cq, cp)
+                    low = origins + cp
+                    delta = cq - cp
+                    code = delta[0] * 4 + delta[1] * 2 + delta[2]
+                    linear = (low[:, 0] * J + low[:, 1]) * K + low[:, 2]
+                    all_keys.append(linear * 8 + code)
+                    all_low.append(low)
+                    all_delta.append(np.broadcast_to(delta, low.shape))
+    if not all_keys:
+        return empty
+    keys = np.concatenate(all_keys)
+    low = np.concatenate(all_low)
+    delta = np.concatenate(all_delta)
+    (unique_keys, first, inverse) = np.unique(keys, return_index=True, return_inverse=True)
+    low = low[first]
+    high = low + delta[first]
+    f_low = field[low[:, 0], low[:, 1], low[:, 2]]
+    f_high = field[high[:, 0], high[:, 1], high[:, 2]]
+    diff = f_high - f_low
+    diff[diff == 0] = 1e-12
+    t = ((level - f_low) / diff).clip(0, 1)[:, np.newaxis]
+    positions = low + t * (high - low)
+    gradient = np.stack(np.gradient(field), axis=-1)
+    g = (1 - t) * gradient[low[:, 0], low[:, 1], low[:, 2]] + t * gradient[high[:, 0], high[:, 1], high[:, 2]]
+    normals = -g
+    lengths = np.sqrt((normals * normals).sum(axis=1))
+    lengths[lengths == 0] = 1
+    normals = normals / lengths[:, np.newaxis]
+    # triangles were collected edge by edge: 3 consecutive key blocks per triangle group.
+    triangles = triangles_from_inverse(all_keys, inverse.reshape(-1))
+    # orient triangles so the winding agrees with the outward normals.
+    A = positions[triangles[:, 0]]
+    B = positions[triangles[:, 1]]
+    C = positions[triangles[:, 2]]
+    winding = np.cross(B - A, C - A)
+    outward = normals[triangles].sum(axis=1)
+    flip = (winding * outward).sum(axis=1) < 0
+    triangles[flip] = triangles[flip][:, [0, 2, 1]]
+    return (positions, normals, triangles)
+
+
+def triangles_from_inverse(key_blocks, inverse):
+    "Regroup per edge vertex indices (in the order keys were collected) into (m,3) triangles."
+    result = []
+    cursor = 0
+    for start in range(0, len(key_blocks), 3):
+        n = len(key_blocks[start])
+        block = inverse[cursor: cursor + 3 * n].reshape((3, n)).T
+        result.append(block)
+        cursor += 3 * n
+    return np.concatenate(result).astype(np.int64)
+
+
+def label_surface(labels, label, blur=0.7, box=None):
+    """
+    Surface of the region where labels == label, blurred with a gaussian of sigma blur.
+    box is an optional tuple of slices (as from find_objects) bounding the label.
+    Returns (positions, normals, triangles) in coordinates of the labels array.
+    """
+    shape = labels.shape
+    if box is None:
+        boxes = find_objects((labels == label).astype(np.int32))
+        if not boxes:
+            return None
+        [box] = boxes
+    pad = int(np.ceil(3 * blur)) + 2
+    start = [max(s.start - pad, 0) for s in box]
+    stop = [min(s.stop + pad, n) for (s, n) in zip(box, shape)]
+    crop = labels[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+    mask = np.zeros(np.array(crop.shape) + 2, dtype=np.float32)
+    # zero border closes surfaces touching the array boundary
+    mask[1:-1, 1:-1, 1:-1] = (crop == label)
+    if blur:
+        mask = gaussian_filter(mask, sigma=blur)
+    (positions, normals, triangles) = isosurface(mask)
+    if len(triangles) == 0:
+        return None
+    positions = positions + (np.array(start) - 1)
+    return (positions, normals, triangles)
+
+
+def surface_json(name, color, positions, normals, triangles, multiplier=MULTIPLIER):
+    "JSON compatible description of one quantized surface."
+    qpositions = np.round(positions * multiplier).astype(np.int64)
+    qnormals = np.round(normals * multiplier).astype(np.int64)
+    return dict(
+        name=name,
+        multiplier=multiplier,
+        color=[int(round(c * multiplier)) for c in color],
+        indices=triangles.ravel().tolist(),
+        normals=qnormals.ravel().tolist(),
+        positions=qpositions.ravel().tolist(),
+        max_position=qpositions.max(axis=0).tolist(),
+        min_positions=qpositions.min(axis=0).tolist(),
+    )
+
+
+def timestamp_json(labels_array, label_dict, color_dict, blur=0.7, multiplier=MULTIPLIER, offset=None):
+    """
+    JSON compatible description of surfaces for labels in label_dict (mapping label to name)
+    colored using color_dict (mapping label to rgb in [0,1]).
+    offset optionally shifts the labels array into global coordinates.
+    """
+    labels_array = np.asarray(labels_array)
+    boxes = find_objects(labels_array)
+    surfaces = {}
+    for (label, name) in label_dict.items():
+        label = int(label)
+        if label < 1 or label > len(boxes) or boxes[label - 1] is None:
+            continue
+        surface = label_surface(labels_array, label, blur, box=boxes[label - 1])
+        if surface is None:
+            continue
+        (positions, normals, triangles) = surface
+        if offset is not None:
+            positions = positions + np.asarray(offset)
+        surfaces[name] = surface_json(name, color_dict[label], positions, normals, triangles, multiplier)
+    return timestamp_json_from_surfaces(surfaces, multiplier)
+
+
+def timestamp_json_from_surfaces(surfaces, multiplier=MULTIPLIER):
+    "Wrap a name to surface JSON mapping with the per timestamp extrema."
+    max_position = min_positions = None
+    if surfaces:
+        max_position = np.max([s["max_position"] for s in surfaces.values()], axis=0).tolist()
+        min_positions = np.min([s["min_positions"] for s in surfaces.values()], axis=0).tolist()
+    return dict(
+        surfaces=surfaces,
+        multiplier=multiplier,
+        max_position=max_position,
+        min_positions=min_positions,
+    )
+
+
+def shift_timestamp_json(timestamp_json, offset):
+    "Copy of timestamp JSON with all positions translated by offset (in array index units)."
+    surfaces = {}
+    for (name, surface) in timestamp_json["surfaces"].items():
+        multiplier = surface["multiplier"]
+        shift = np.round(np.asarray(offset, dtype=np.float64) * multiplier).astype(np.int64)
+        positions = (np.array(surface["positions"], dtype=np.int64).reshape((-1, 3)) + shift)
+        shifted = dict(surface)
+        shifted["positions"] = positions.ravel().tolist()
+        shifted["max_position"] = (np.array(surface["max_position"]) + shift).tolist()
+        shifted["min_positions"] = (np.array(surface["min_positions"]) + shift).tolist()
+        surfaces[name] = shifted
+    return timestamp_json_from_surfaces(surfaces, timestamp_json.get("multiplier", MULTIPLIER))
+
+
+def sequence_json(timestamp_jsons, multiplier=MULTIPLIER):
+    "Combine per timestamp JSON objects into the sequence format read by surfaces_sequence viewers."
+    maxima = [t["max_position"] for t in timestamp_jsons if t.get("max_position") is not None]
+    minima = [t["min_positions"] for t in timestamp_jsons if t.get("min_positions") is not None]
+    max_position = min_position = center = None
+    diameter = 0.0
+    if maxima:
+        M = np.max(maxima, axis=0)
+        m = np.min(minima, axis=0)
+        max_position = M.tolist()
+        min_position = m.tolist()
+        center = ((M + m) // 2).tolist()
+        diameter = float(np.linalg.norm(M - m)) / multiplier
+    return dict(
+        diameter=diameter,
+        center=center,
+        sequence=list(timestamp_jsons),
+        multiplier=multiplier,
+        max_position=max_position,
+        min_position=min_position,
+    )
+
+
+class SurfaceSequence:
+
+    "Ordered per timestamp surface JSON (or futures for them) with the sequence json_repr."
+
+    def __init__(self, multiplier=MULTIPLIER):
+        self.multiplier = multiplier
+        self.timestamps = []
+
+    def add(self, timestamp_json_or_future):
+        self.timestamps.append(timestamp_json_or_future)
+
+    def take_last(self):
+        "Remove and return the newest timestamp JSON (or future), so streaming captures hold no finished timestamps."
+        return self.timestamps.pop()
+
+    def timestamp_jsons(self):
+        result = []
+        for t in self.timestamps:
+            if hasattr(t, "result"):
+                t = t.result()
+            result.append(t)
+        self.timestamps = result
+        return result
+
+    def json_repr(self):
+        return sequence_json(self.timestamp_jsons(), self.multiplier)
+
+
+class CPUSurfaceMaker:
+
+    """
+    Drop in replacement for surfaces_sequence.SurfaceMaker which needs no browser.
+    Timestamps are meshed in parallel on a process pool (workers=1 meshes in process).
+    """
+
+    def __init__(self, blur=0.7, workers=None, multiplier=MULTIPLIER):
+        self.blur = blur
+        self.multiplier = multiplier
+        self.sequence = SurfaceSequence(multiplier)
+        self.executor = None
+        self.workers = workers
+        if workers is None or workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+            self.workers = self.executor._max_workers
+        self.pending = []
+
+    async def add_surfaces(self, labels_array, label_dict, color_dict, offset=None):
+        "Mesh labels in label_dict for a timestamp and append the result to the sequence."
+        args = (labels_array, dict(label_dict), dict(color_dict), self.blur, self.multiplier, offset)
+        if self.executor is None:
+            self.sequence.add(timestamp_json(*args))
+            return
+        future = self.executor.submit(timestamp_json, *args)
+        self.sequence.add(future)
+        # limit the number of label arrays in flight.
+        pending = [f for f in self.pending if not f.done()] + [future]
+        while len(pending) > 2 * self.workers:
+            await asyncio.wrap_future(pending.pop(0))
+        self.pending = pending
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
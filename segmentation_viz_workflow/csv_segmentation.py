@@ -1,10 +1,19 @@
 
 import csv
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from mouse_embryo_labeller import color_list, tools
-from feedWebGL2 import surfaces_sequence
+from .strided_tiff import load_strided_tiff_array
+from . import cpu_surfaces
+from . import surface_cache
+from . import surface_writers
+from .capture_stats import CaptureStats, timed, record_when_done
 import numpy as np
+from scipy.ndimage import find_objects
 import os
 import json
+import time
 
 class Segmentation:
 
@@ -13,34 +22,124 @@ class Segmentation:
         csv_file_path,   # like stack_2_tree_cell_association.csv
         label_array_path_template,   # like "./segmentation/%05d_rescaled_low_cp_masks.tif"
         stride=2,   # subsample array stride to save some space
+        columnar=False,   # parse the CSV into typed numpy columns instead of row dicts
         ):
         self.csv_file_path = csv_file_path
         self.label_array_path_template = label_array_path_template
         self.stride = stride
+        self.columnar = columnar
+        # optional capture_stats.CaptureStats instrumentation for captures.
+        self.stats = None
         self.parse_csv()
 
+    def __getstate__(self):
+        # the surface maker (and any browser connection) and instrumentation stay in this process.
+        state = dict(self.__dict__)
+        state.pop("surface_maker", None)
+        state["stats"] = None
+        return state
+
     def parse_csv(self):
+        if self.columnar:
+            return self.parse_csv_columns()
         fn = self.csv_file_path
         self.ts_cell_info_list = list(csv.DictReader(open(fn), skipinitialspace=True))
         self.branches = set(d["Branch"] for d in self.ts_cell_info_list)
         self.timestamps = sorted(set(int(d["Time"]) for d in self.ts_cell_info_list))
         float_colors = np.array(color_list.color_arrays) / 255.0
         self.branch_to_color = {b: float_colors[i] for (i, b) in enumerate(self.branches)}
+        self.index_cells()
+
+    def index_cells(self):
+        "Index (label, branch) pairs by (lineage, time) so lookups do not scan all rows."
+        index = {}
+        for d in self.ts_cell_info_list:
+            key = (int(d["Lineage"]), int(d["Time"]))
+            #ln = d["label_num"] wrong
+            ln = int(d['Cell_Label'])
+            index.setdefault(key, []).append((ln, d["Branch"]))
+        self.lineage_time_index = index
+
+    def parse_csv_columns(self):
+        """
+        Load Time, Lineage, Branch and Cell_Label as typed numpy columns sorted by (time, lineage).
+        Branch names are mapped to integer codes indexing self.branch_names.
+        """
+        fn = self.csv_file_path
+        with open(fn) as f:
+            header = [name.strip() for name in next(csv.reader(f, skipinitialspace=True))]
+        names = ["Time", "Lineage", "Cell_Label", "Branch"]
+        for name in names:
+            assert name in header, "column not found: " + repr([name, header])
+        # one pass over the file for all four columns.
+        table = np.loadtxt(
+            fn, delimiter=",", skiprows=1, usecols=[header.index(name) for name in names], dtype=str, ndmin=2)
+        table = np.char.strip(table)
+        (time, lineage, cell_label) = (table[:, i].astype(np.int64) for i in range(3))
+        branch = table[:, 3]
+        del table
+        (self.branch_names, branch_code) = np.unique(branch, return_inverse=True)
+        del branch
+        order = np.lexsort((lineage, time))
+        self.time = time[order]
+        self.lineage = lineage[order]
+        self.cell_label = cell_label[order]
+        self.branch_code = branch_code.reshape(-1)[order].astype(np.int32)
+        self.ts_cell_info_list = None
+        self.lineage_time_index = None
+        self.branches = set(self.branch_names.tolist())
+        self.timestamps = np.unique(self.time).tolist()
+        float_colors = np.array(color_list.color_arrays) / 255.0
+        self.branch_colors = float_colors[:len(self.branch_names)]
+        self.branch_to_color = {b: self.branch_colors[i] for (i, b) in enumerate(self.branch_names.tolist())}
+
+    def time_slice(self, ts):
+        "Slice of the sorted columns holding rows for timestamp ts."
+        start = np.searchsorted(self.time, ts, side="left")
+        end = np.searchsorted(self.time, ts, side="right")
+        return slice(start, end)
+
+    def cell_columns(self, ts, lineages=None):
+        """
+        Vectorized selection of (labels, branch codes) for cells in any of lineages at timestamp ts.
+        If lineages is None select all cells at the timestamp.  Requires columnar mode.
+        """
+        assert self.columnar, "cell_columns requires columnar=True"
+        s = self.time_slice(int(ts))
+        labels = self.cell_label[s]
+        codes = self.branch_code[s]
+        if lineages is not None:
+            selected = np.isin(self.lineage[s], np.asarray(lineages, dtype=np.int64))
+            labels = labels[selected]
+            codes = codes[selected]
+        return (labels, codes)
+
+    def labels_at(self, ts, lineages=None):
+        "Array of cell labels in any of lineages at timestamp ts."
+        (labels, codes) = self.cell_columns(ts, lineages)
+        return labels
+
+    def lineage_cells(self, ts, lineage):
+        "List of (label, branch) pairs for cells in lineage at a timestamp."
+        if not self.columnar:
+            return self.lineage_time_index.get((int(lineage), int(ts)), [])
+        # lineages are sorted within each timestamp, so search the timestamp slice.
+        s = self.time_slice(int(ts))
+        lineages = self.lineage[s]
+        start = s.start + np.searchsorted(lineages, int(lineage), side="left")
+        end = s.start + np.searchsorted(lineages, int(lineage), side="right")
+        labels = self.cell_label[start:end].tolist()
+        branches = self.branch_names[self.branch_code[start:end]].tolist()
+        return list(zip(labels, branches))
 
     def color_dict(self, ts, lineage, color):
         "Mapping of label to color for timestamp and lineage."
         result = {}
-        ts = int(ts)
-        lineage = int(lineage)
-        for d in self.ts_cell_info_list:
-            if int(d["Lineage"]) == lineage and int(d["Time"]) == ts:
-                b = d["Branch"]
-                #ln = d["label_num"] wrong
-                ln = int(d['Cell_Label'])
-                if color is None:
-                    result[ln] = self.branch_to_color[b].tolist()
-                else:
-                    result[ln] = list(color)
+        for (ln, b) in self.lineage_cells(ts, lineage):
+            if color is None:
+                result[ln] = self.branch_to_color[b].tolist()
+            else:
+                result[ln] = list(color)
         return result
 
     def labels_array(self, ts):
@@ -51,18 +150,26 @@ class Segmentation:
             print ("WARNING: No file found for timestamp %s : %s" % (ts, file_path))
             return None
         s = self.stride
-        A = tools.load_tiff_array(file_path)
-        return A[::s, ::s, ::s]
+        stats = self.stats
+        with timed(stats, ts, "decode") as counts:
+            A = load_strided_tiff_array(file_path, s, counts)
+            strided = A is not None
+            if not strided:
+                # no stride aware reader for this file: read everything and subsample.
+                A = tools.load_tiff_array(file_path)
+                counts["bytes_read"] = os.path.getsize(file_path)
+            counts["voxels"] = A.size
+        if not strided:
+            with timed(stats, ts, "subsample") as counts:
+                A = A[::s, ::s, ::s]
+                counts["voxels"] = A.size
+        return A
 
     def label_dict(self, ts, lineage):
         "Dictionary of labels in lineage at a timestamp."
         result = {}
-        ts = int(ts)
-        lineage = int(lineage)
-        for d in self.ts_cell_info_list:
-            if int(d["Lineage"]) == lineage and int(d["Time"]) == ts:
-                ln = int(d['Cell_Label'])
-                result[ln] = ln
+        for (ln, b) in self.lineage_cells(ts, lineage):
+            result[ln] = ln
         return result
 
     async def capture_surfaces_as_json(
@@ -72,6 +179,13 @@ class Segmentation:
         blur=0.7, 
         exit_when_done=True,
         link=False,
+        prefetch=2,
+        engine="browser",
+        workers=None,
+        cache_dir=None,
+        output_format="json",
+        crop=None,
+        stats=None,
         ):
         """
         Capture surfaces for cells in a single lineage
@@ -82,6 +196,13 @@ class Segmentation:
             blur=blur,
             exit_when_done=exit_when_done,
             link=link,
+            prefetch=prefetch,
+            engine=engine,
+            workers=workers,
+            cache_dir=cache_dir,
+            output_format=output_format,
+            crop=crop,
+            stats=stats,
         )
 
     async def capture_lineages_as_json(
@@ -91,6 +212,14 @@ class Segmentation:
         blur=0.7, 
         exit_when_done=True,
         link=False,
+        prefetch=2,   # number of timestamps to read ahead on background threads (0 to disable)
+        engine="browser",   # "browser" for WebGL surface extraction or "cpu" for headless numpy extraction
+        workers=None,   # processes for the "cpu" engine (None for all cores, 1 for in process)
+        cache_dir=None,   # folder for per timestamp checkpoints reused by later runs
+        output_format="json",   # "json", "stream" (append timestamps as produced) or "binary" (see surface_writers)
+        crop=None,   # mesh only the padded bounding box of the selected labels (default: cpu engine only)
+        timestamps=None,   # capture only these timestamps (default all)
+        stats=None,   # capture_stats.CaptureStats to collect per stage timings
         ):
         # sanity check
         colors = list(c for c in lineage_to_color.values() if c is not None)
@@ -100,38 +229,369 @@ class Segmentation:
             assert colors.max() <= 1, "colors must be between 0 and 1 " + repr(colors)
             (nr, nc) = colors.shape
             assert nc == 3, "colors must be rgb between 0 and 1 " + repr(colors)
-        SM = surfaces_sequence.SurfaceMaker(blur=blur, link=link)
-        self.surface_maker = SM
-        print("Using browser interface for capturing surface geometries.")
-        count = 0
-        for ts in self.timestamps:
-            print()
-            print("processing timestamp", ts)
-            la = self.labels_array(ts)
-            if la is None:
+        if crop is None:
+            # the browser shift assumes its positions are array indices times the multiplier,
+            # which has only been checked against the cpu engine, so the browser does not crop by default.
+            crop = (engine == "cpu")
+        # padding around the selected labels when cropping (None when not cropping).
+        crop_pad = None
+        if crop:
+            crop_pad = int(np.ceil(3 * blur)) + 2
+        # the browser quantizes with its own multiplier.
+        multiplier = cpu_surfaces.MULTIPLIER if engine == "cpu" else None
+        cache = None
+        if cache_dir is not None:
+            cache = surface_cache.SurfaceCache(cache_dir)
+        if timestamps is None:
+            timestamps = self.timestamps
+        self.stats = stats
+        # set if capture stops early at a missing label file.
+        self.capture_stopped = False
+        # plan: label and color dicts and cache keys up to the first missing label file.
+        plan = []
+        for ts in timestamps:
+            file_path = self.label_array_path_template % (int(ts),)
+            if not os.path.isfile(file_path):
+                print ("WARNING: No file found for timestamp %s : %s" % (ts, file_path))
                 print ("    WARNING:::: Stopping because label array was not found for ts", ts)
+                self.capture_stopped = True
                 break
-            print("array", la.shape)
-            all_cd = {}
-            all_ld = {}
-            for (lineage, color) in lineage_to_color.items():
-                print("    lineage", (lineage, color))
-                cd = self.color_dict(ts, lineage, color)
-                all_cd.update(cd)
-                ld = self.label_dict(ts, lineage)
-                all_ld.update(ld)
-            print("    labels", list(all_cd.items()))
-            await SM.add_surfaces(la, all_ld, all_cd)
-            count += 1
-        assert count > 1, "No labels arrays found."
+            with timed(stats, ts, "dicts") as counts:
+                (all_ld, all_cd) = self.timestamp_dicts(ts, lineage_to_color)
+                counts["labels"] = len(all_ld)
+            key = cached = None
+            if cache is not None:
+                key = cache.key(file_path, self.stride, blur, engine, all_ld, all_cd, crop_pad, multiplier)
+                cached = cache.get(key)
+            plan.append((ts, all_ld, all_cd, key, cached))
+        to_compute = [ts for (ts, all_ld, all_cd, key, cached) in plan if cached is None]
+        if cache is not None:
+            print("Reusing", len(plan) - len(to_compute), "cached timestamps from", repr(cache_dir))
+        SM = None
+        if to_compute:
+            SM = self.make_surface_maker(engine, blur=blur, link=link, workers=workers)
+        self.surface_maker = SM
+        writer = surface_writers.sequence_writer(output_format, to_json_path)
+        # per timestamp results waiting to be written in order: JSON or futures for JSON (cpu engine).
+        pending = deque()
+        # without checkpoints, streaming or cropped coordinates to shift
+        # the browser sequence is saved with its own json_repr, as always.
+        native = (engine == "browser") and (cache is None) and (output_format == "json") and not crop
+        browser_timestamps = None
+        if engine == "browser" and SM is not None and not native:
+            browser_timestamps = BrowserTimestamps(SM.sequence)
+        count = 0
+        prefetcher = LabelArrayPrefetcher(self, to_compute, depth=prefetch)
+        try:
+            for (ts, all_ld, all_cd, key, cached) in plan:
+                print()
+                print("processing timestamp", ts)
+                if cached is not None:
+                    print("    using cached surfaces", key)
+                    pending.append((ts, None, cached, None))
+                else:
+                    la = await prefetcher.get(ts)
+                    if la is None:
+                        print ("    WARNING:::: Stopping because label array was not found for ts", ts)
+                        self.capture_stopped = True
+                        break
+                    print("array", la.shape)
+                    print("    labels", list(all_cd.items()))
+                    offset = None
+                    if crop:
+                        with timed(stats, ts, "crop") as counts:
+                            (la, offset) = crop_to_labels(la, list(all_ld.keys()), pad=crop_pad)
+                            counts["voxels"] = la.size
+                        print("    cropped to", la.shape, "at", offset)
+                    if engine == "cpu":
+                        # the cpu engine shifts into global coordinates itself.  Meshing may run on a worker
+                        # process, so surfaces are timed until the result is ready, not just submitted.
+                        start = time.perf_counter()
+                        await SM.add_surfaces(la, all_ld, all_cd, offset=offset)
+                        offset = None
+                        record_when_done(
+                            stats, SM.sequence.timestamps[-1], ts, "surfaces", start,
+                            voxels=la.size, labels=len(all_ld))
+                    else:
+                        with timed(stats, ts, "surfaces") as counts:
+                            counts["voxels"] = la.size
+                            counts["labels"] = len(all_ld)
+                            await SM.add_surfaces(la, all_ld, all_cd)
+                    if not native:
+                        # the pending queue now owns the result, so the sequence does not grow with the capture.
+                        if engine == "cpu":
+                            r = SM.sequence.take_last()
+                        else:
+                            r = browser_timestamps.take_last_json()
+                        pending.append((ts, key, r, offset))
+                count += 1
+                self.write_results(pending, writer, cache)
+        finally:
+            prefetcher.shutdown()
+        if timestamps is self.timestamps:
+            assert count > 1, "No labels arrays found."
+        self.capture_count = count
+        self.write_results(pending, writer, cache, wait=True)
         print()
-        print("Processed", count, "timestamps.  Saving JSON to", to_json_path)
-        f = open(to_json_path, "w")
-        json_ob = SM.sequence.json_repr()
-        json.dump(json_ob, f)
-        f.close()
+        print("Processed", count, "timestamps.  Saving", output_format, "output to", to_json_path)
+        with timed(stats, None, "serialize"):
+            if native and SM is not None:
+                with open(to_json_path, "w") as f:
+                    json.dump(SM.sequence.json_repr(), f)
+            else:
+                writer.close()
         print ("wrote", repr(to_json_path))
-        if exit_when_done:
-            SM.V.shutdown()
+        if SM is not None:
+            if engine == "cpu":
+                SM.shutdown()
+            elif exit_when_done:
+                SM.V.shutdown()
         return SM
 
+    def capture_lineages_sharded(
+        self,
+        lineage_to_color,
+        to_json_path,
+        shards=None,   # number of worker processes (default all cores)
+        blur=0.7,
+        engine="cpu",
+        cache_dir=None,
+        output_format="json",
+        crop=None,
+        keep_partials=False,
+        stats=None,
+        ):
+        """
+        Capture surfaces with the timestamps split into contiguous ranges, each captured
+        by its own process and surface maker into a partial sequence.
+        The partials are merged into output identical to capture_lineages_as_json.
+        """
+        timestamps = list(self.timestamps)
+        if shards is None:
+            shards = os.cpu_count() or 1
+        shards = max(1, min(shards, len(timestamps)))
+        ranges = [r.tolist() for r in np.array_split(np.array(timestamps), shards)]
+        partial_paths = ["%s.shard%03d" % (to_json_path, i) for i in range(shards)]
+        options = dict(blur=blur, engine=engine, cache_dir=cache_dir, crop=crop, collect_stats=(stats is not None))
+        print("Capturing", len(timestamps), "timestamps in", shards, "shards.")
+        with ProcessPoolExecutor(max_workers=shards) as executor:
+            futures = [
+                executor.submit(capture_shard, self, lineage_to_color, shard_timestamps, partial_path, options)
+                for (shard_timestamps, partial_path) in zip(ranges, partial_paths)
+            ]
+            outcomes = [f.result() for f in futures]
+        if stats is not None:
+            for (partial_path, shard_count, stopped, records) in outcomes:
+                stats.extend(records)
+        with timed(stats, None, "serialize"):
+            count = merge_partial_sequences(outcomes, to_json_path, output_format)
+        assert count > 1, "No labels arrays found."
+        if not keep_partials:
+            for partial_path in partial_paths:
+                if os.path.isfile(partial_path):
+                    os.remove(partial_path)
+        print("Merged", count, "timestamps from", shards, "shards into", repr(to_json_path))
+        return count
+
+    def timestamp_dicts(self, ts, lineage_to_color):
+        "Combined (label_dict, color_dict) for all lineages at a timestamp."
+        all_cd = {}
+        all_ld = {}
+        for (lineage, color) in lineage_to_color.items():
+            print("    lineage", (lineage, color))
+            cd = self.color_dict(ts, lineage, color)
+            all_cd.update(cd)
+            ld = self.label_dict(ts, lineage)
+            all_ld.update(ld)
+        return (all_ld, all_cd)
+
+    def write_results(self, pending, writer, cache=None, wait=False):
+        """
+        Pass finished results at the front of the pending (timestamp, cache key, result, offset) queue to the writer
+        in timestamp order, shifting by offset if given and checkpointing to the cache when a key is given.
+        """
+        while pending:
+            (ts, key, r, offset) = pending[0]
+            if r is None:
+                return
+            if hasattr(r, "result"):
+                if not (wait or r.done()):
+                    return
+                r = r.result()
+            pending.popleft()
+            with timed(self.stats, ts, "serialize"):
+                if offset is not None:
+                    r = cpu_surfaces.shift_timestamp_json(r, offset)
+                if cache is not None and key is not None:
+                    cache.put(key, r)
+                writer.add(r)
+
+    def make_surface_maker(self, engine, blur=0.7, link=False, workers=None):
+        "Surface extraction engine with the surfaces_sequence.SurfaceMaker interface."
+        if engine == "browser":
+            from feedWebGL2 import surfaces_sequence
+            print("Using browser interface for capturing surface geometries.")
+            return surfaces_sequence.SurfaceMaker(blur=blur, link=link)
+        assert engine == "cpu", "unknown surface engine: " + repr(engine)
+        print("Using CPU marching tetrahedra for capturing surface geometries.")
+        return cpu_surfaces.CPUSurfaceMaker(blur=blur, workers=workers)
+
+
+
+class BrowserTimestamps:
+
+    """
+    JSON for the newest timestamp of a feedWebGL2 surfaces_sequence sequence without serializing the whole sequence.
+    If the sequence keeps a list of timestamps with their own json_repr, the newest one is serialized alone
+    and removed from the sequence, once that was checked to match the newest entry of the whole sequence json_repr.
+    Otherwise each call falls back to the whole sequence json_repr and the sequence keeps every timestamp.
+    """
+
+    def __init__(self, sequence):
+        self.sequence = sequence
+        # whether the newest timestamp can be serialized alone (None until checked).
+        self.direct = None
+
+    def newest(self):
+        "The newest timestamp object of the sequence, or None if it does not expose one."
+        timestamps = getattr(self.sequence, "timestamps", None)
+        if isinstance(timestamps, list) and timestamps and hasattr(timestamps[-1], "json_repr"):
+            return timestamps[-1]
+        return None
+
+    def take_last_json(self):
+        newest = self.newest()
+        if self.direct and newest is not None:
+            result = newest.json_repr()
+        else:
+            result = self.sequence.json_repr()["sequence"][-1]
+            if self.direct is None:
+                self.direct = newest is not None and same_json(newest.json_repr(), result)
+                if not self.direct:
+                    print("    WARNING: serializing the whole browser sequence for each timestamp.")
+        if self.direct:
+            # the caller owns the JSON now.
+            del self.sequence.timestamps[-1]
+        return result
+
+
+def same_json(a, b):
+    "True if a and b serialize to the same JSON."
+    try:
+        return json.dumps(a, sort_keys=True) == json.dumps(b, sort_keys=True)
+    except (TypeError, ValueError):
+        return False
+
+
+def crop_to_labels(labels_array, labels, pad=0):
+    """
+    Crop labels_array to the bounding box of labels padded by pad voxels.
+    Returns (cropped array, offset of the crop in labels_array).
+    """
+    boxes = find_objects(labels_array)
+    starts = []
+    stops = []
+    for label in labels:
+        label = int(label)
+        if 0 < label <= len(boxes) and boxes[label - 1] is not None:
+            box = boxes[label - 1]
+            starts.append([s.start for s in box])
+            stops.append([s.stop for s in box])
+    if not starts:
+        return (labels_array, None)
+    shape = np.array(labels_array.shape)
+    start = np.maximum(np.min(starts, axis=0) - pad, 0)
+    stop = np.minimum(np.max(stops, axis=0) + pad, shape)
+    cropped = labels_array[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+    return (cropped, start.tolist())
+
+
+def capture_shard(segmentation, lineage_to_color, timestamps, partial_path, options):
+    """
+    Worker process entry point: capture timestamps into a partial streamed sequence.
+    Returns (partial path, timestamps captured, whether capture stopped at a missing file, stats records).
+    """
+    options = dict(options)
+    stats = None
+    if options.pop("collect_stats", False):
+        stats = CaptureStats()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(segmentation.capture_lineages_as_json(
+            lineage_to_color,
+            partial_path,
+            workers=1,
+            output_format="stream",
+            timestamps=timestamps,
+            stats=stats,
+            **options
+        ))
+    finally:
+        loop.close()
+    records = stats.records if stats is not None else []
+    return (partial_path, segmentation.capture_count, segmentation.capture_stopped, records)
+
+
+def merge_partial_sequences(outcomes, to_path, output_format="json"):
+    """
+    Combine ordered capture_shard outcomes into one sequence output.
+    Like a serial capture, stop after the first shard that hit a missing label file.
+    Returns the number of timestamps written.
+    """
+    writer = surface_writers.sequence_writer(output_format, to_path)
+    count = 0
+    for (partial_path, shard_count, stopped, records) in outcomes:
+        if shard_count:
+            with open(partial_path) as f:
+                partial = json.load(f)
+            for timestamp_json in partial["sequence"]:
+                writer.add(timestamp_json)
+                count += 1
+        if stopped:
+            break
+    writer.close()
+    return count
+
+
+class LabelArrayPrefetcher:
+
+    """
+    Read and subsample label arrays for upcoming timestamps on a thread pool
+    so disk I/O overlaps surface extraction for the current timestamp.
+    """
+
+    def __init__(self, segmentation, timestamps, depth=2):
+        self.segmentation = segmentation
+        self.timestamps = list(timestamps)
+        self.depth = depth
+        self.ts_to_future = {}
+        self.executor = None
+        if depth > 0:
+            self.executor = ThreadPoolExecutor(max_workers=depth)
+
+    def schedule(self, ts):
+        "Start reads for ts and up to depth following timestamps."
+        timestamps = self.timestamps
+        start = timestamps.index(ts)
+        t2f = self.ts_to_future
+        for next_ts in timestamps[start: start + self.depth + 1]:
+            if next_ts not in t2f:
+                t2f[next_ts] = self.executor.submit(self.segmentation.labels_array, next_ts)
+
+    async def get(self, ts):
+        "Subsampled label array for ts (or None if no such file)."
+        if self.executor is None:
+            return self.segmentation.labels_array(ts)
+        self.schedule(ts)
+        future = self.ts_to_future.pop(ts)
+        # wait without blocking the event loop used by the surface maker.
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        "Cancel outstanding reads."
+        for future in self.ts_to_future.values():
+            future.cancel()
+        self.ts_to_future = {}
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,483 @@
+"""
+Structure of arrays storage for lineage forests.
+
+Every per node attribute lives in a numpy array indexed by a dense node index.
+The OO classes in lineage_forest are lightweight views over this storage.
+"""
+
+import numpy as np
+
+NO_INDEX = -1
+NO_LABEL = -1
+INDEX_TYPE = np.int32
+
+
+def id_order_rank(ids):
+    "Position of each id in sorted order."
+    order = np.argsort(np.array(ids), kind="stable")
+    rank = np.zeros((len(ids),), dtype=INDEX_TYPE)
+    rank[order] = np.arange(len(ids), dtype=INDEX_TYPE)
+    return rank
+
+
+class NodeArrays:
+
+    "Growable per node arrays for a forest."
+
+    # array name -> (dtype, fill value for new or reset entries)
+    STRUCTURE = dict(
+        ordinal=(np.int32, 0),
+        label=(np.int32, NO_LABEL),
+        parent=(INDEX_TYPE, NO_INDEX),
+        first_child=(INDEX_TYPE, NO_INDEX),
+        next_sibling=(INDEX_TYPE, NO_INDEX),
+        n_children=(np.int32, 0),
+    )
+    # derived layout arrays cleared by reset_derived
+    DERIVED = dict(
+        track=(INDEX_TYPE, NO_INDEX),
+        lineage=(INDEX_TYPE, NO_INDEX),
+        lineage_index=(np.int32, -1),
+        offset=(np.float64, np.nan),
+        isolated=(np.int8, -1),  # -1: not determined
+        color_index=(np.int32, -1),  # argument to color_list.indexed_color, -1 for none
+    )
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self._ids = []
+        self._id_to_index = {}
+        # callable returning an id array for lazily loaded ids (see load).
+        self._ids_loader = None
+        self.capacity = 0
+        for (name, (dtype, fill)) in self.all_arrays():
+            setattr(self, "_" + name, np.zeros((0,), dtype=dtype))
+        self.grow(capacity)
+        # lazily built indices, discarded when the arrays change.
+        self.version = 0
+        self._ordinal_index = None
+        self._id_rank = None
+
+    @property
+    def ids(self):
+        "Node id for each index."
+        if self._ids is None:
+            self._ids = self._ids_loader().tolist()
+        return self._ids
+
+    @property
+    def id_to_index(self):
+        if self._id_to_index is None:
+            self._id_to_index = {node_id: index for (index, node_id) in enumerate(self.ids)}
+        return self._id_to_index
+
+    def save_state(self):
+        "Name to array dictionary for saving (see load_state)."
+        state = {name: getattr(self, name) for (name, unused) in self.all_arrays()}
+        if self._ids is None:
+            state["ids"] = self._ids_loader()
+        else:
+            state["ids"] = np.array(self._ids)
+        return state
+
+    @classmethod
+    def load_state(cls, state):
+        """
+        Arrays from a save_state dictionary or an open npz file.
+        The ids (and the id to index dictionary) are only read when first used.
+        """
+        ordinal = state["ordinal"]
+        result = cls(capacity=len(ordinal))
+        for (name, unused) in result.all_arrays():
+            getattr(result, "_" + name)[:len(ordinal)] = state[name]
+        result.size = len(ordinal)
+        result._ids = result._id_to_index = None
+        result._ids_loader = lambda: state["ids"]
+        return result
+
+    def all_arrays(self):
+        return list(self.STRUCTURE.items()) + list(self.DERIVED.items())
+
+    def grow(self, capacity):
+        if capacity <= self.capacity:
+            return
+        for (name, (dtype, fill)) in self.all_arrays():
+            old = getattr(self, "_" + name)
+            new = np.full((capacity,), fill, dtype=dtype)
+            new[:len(old)] = old
+            setattr(self, "_" + name, new)
+        self.capacity = capacity
+
+    def __getattr__(self, name):
+        # arrays trimmed to the number of nodes, for example self.parent
+        if name in NodeArrays.STRUCTURE or name in NodeArrays.DERIVED:
+            return self.__dict__["_" + name][:self.size]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return self.size
+
+    def changed(self):
+        "Note a change that invalidates lazily built indices."
+        self.version += 1
+        self._ordinal_index = None
+
+    def append(self, node_id, ordinal, label=None):
+        "Add a node and return its index."
+        assert node_id not in self.id_to_index, "duplicate node added: " + repr([node_id, ordinal, label])
+        index = self.size
+        if index >= self.capacity:
+            self.grow(max(1024, 2 * self.capacity))
+        self.size = index + 1
+        self._ordinal[index] = ordinal
+        self._label[index] = NO_LABEL if label is None else label
+        self.ids.append(node_id)
+        self.id_to_index[node_id] = index
+        self._id_rank = None
+        self.changed()
+        return index
+
+    def extend(self, node_ids, ordinals, labels):
+        "Add many nodes at once and return their indices."
+        n = len(node_ids)
+        start = self.size
+        if start + n > self.capacity:
+            self.grow(max(1024, 2 * self.capacity, start + n))
+        i2i = self.id_to_index
+        for (offset, node_id) in enumerate(node_ids):
+            assert node_id not in i2i, "duplicate node added: " + repr(node_id)
+            i2i[node_id] = start + offset
+        self.ids.extend(node_ids)
+        self.size = start + n
+        self._ordinal[start: start + n] = ordinals
+        self._label[start: start + n] = labels
+        self._id_rank = None
+        self.changed()
+        return np.arange(start, start + n, dtype=INDEX_TYPE)
+
+    def index(self, node_id):
+        return self.id_to_index[node_id]
+
+    def link(self, parent, child):
+        "Make child a child of parent, detaching it from any previous parent."
+        self.unlink(child)
+        self._parent[child] = parent
+        self._next_sibling[child] = self._first_child[parent]
+        self._first_child[parent] = child
+        self._n_children[parent] += 1
+        self.changed()
+
+    def unlink(self, child):
+        "Detach child from its parent (if any)."
+        parent = self._parent[child]
+        if parent == NO_INDEX:
+            return
+        previous = NO_INDEX
+        cursor = self._first_child[parent]
+        while cursor != child:
+            previous = cursor
+            cursor = self._next_sibling[cursor]
+        if previous == NO_INDEX:
+            self._first_child[parent] = self._next_sibling[child]
+        else:
+            self._next_sibling[previous] = self._next_sibling[child]
+        self._next_sibling[child] = NO_INDEX
+        self._parent[child] = NO_INDEX
+        self._n_children[parent] -= 1
+        self.changed()
+
+    def link_many(self, parents, children):
+        """
+        Link each child index to the corresponding parent index
+        (for repeated children the last parent wins).
+        """
+        parents = np.asarray(parents, dtype=INDEX_TYPE)
+        children = np.asarray(children, dtype=INDEX_TYPE)
+        (unused, last) = np.unique(children[::-1], return_index=True)
+        keep = len(children) - 1 - last
+        (parents, children) = (parents[keep], children[keep])
+        for child in children[self.parent[children] != NO_INDEX].tolist():
+            self.unlink(child)
+        # prepend each parent's new children to its sibling list.
+        order = np.argsort(parents, kind="stable")
+        (parents, children) = (parents[order], children[order])
+        group_start = np.ones((len(parents),), dtype=bool)
+        group_start[1:] = parents[1:] != parents[:-1]
+        group_end = np.ones((len(parents),), dtype=bool)
+        group_end[:-1] = group_start[1:]
+        next_sibling = np.empty((len(children),), dtype=INDEX_TYPE)
+        next_sibling[:-1] = children[1:]
+        next_sibling[group_end] = self.first_child[parents[group_end]]
+        self.next_sibling[children] = next_sibling
+        self.first_child[parents[group_start]] = children[group_start]
+        np.add.at(self.n_children, parents, 1)
+        self.parent[children] = parents
+        self.changed()
+
+    def children(self, index):
+        "Child indices of node index (unordered)."
+        result = []
+        cursor = self._first_child[index]
+        while cursor != NO_INDEX:
+            result.append(int(cursor))
+            cursor = self._next_sibling[cursor]
+        return result
+
+    def reset_derived(self, indices=None):
+        "Clear derived layout state for all nodes or for the given indices."
+        for (name, (dtype, fill)) in self.DERIVED.items():
+            array = getattr(self, name)
+            if indices is None:
+                array[:] = fill
+            else:
+                array[indices] = fill
+
+    def ordinal_index(self):
+        """
+        (order, ordinals, starts): node indices sorted by (ordinal, label),
+        the distinct ordinals and the start of each ordinal's run in order (with a final end entry).
+        """
+        if self._ordinal_index is None:
+            order = np.lexsort((self.label, self.ordinal)).astype(INDEX_TYPE)
+            sorted_ordinals = self.ordinal[order]
+            (ordinals, starts) = np.unique(sorted_ordinals, return_index=True)
+            starts = np.append(starts, len(order))
+            self._ordinal_index = (order, ordinals, starts)
+        return self._ordinal_index
+
+    def ordinal_members(self, ordinal):
+        "Node indices at ordinal sorted by label."
+        (order, ordinals, starts) = self.ordinal_index()
+        position = np.searchsorted(ordinals, ordinal)
+        if position >= len(ordinals) or ordinals[position] != ordinal:
+            return order[0:0]
+        return order[starts[position]: starts[position + 1]]
+
+    def levels(self):
+        "Node index arrays for each ordinal in increasing order (parents precede children)."
+        (order, ordinals, starts) = self.ordinal_index()
+        return [order[starts[i]: starts[i + 1]] for i in range(len(ordinals))]
+
+    def id_rank(self, indices=None):
+        "Position of each node id (or of the ids of indices) in sorted id order."
+        if indices is not None and len(indices) < self.size:
+            ids = self.ids
+            return id_order_rank([ids[i] for i in np.asarray(indices).tolist()])
+        if self._id_rank is None:
+            self._id_rank = id_order_rank(self.ids)
+        if indices is None:
+            return self._id_rank
+        return self._id_rank[indices]
+
+    def group_members(self, group_array):
+        """
+        Mapping of root index to member indices for a track or lineage array,
+        computed in one sort.
+        """
+        valid = np.nonzero(group_array != NO_INDEX)[0]
+        roots = group_array[valid]
+        order = np.argsort(roots, kind="stable")
+        sorted_roots = roots[order]
+        members = valid[order].astype(INDEX_TYPE)
+        (unique_roots, starts) = np.unique(sorted_roots, return_index=True)
+        ends = np.append(starts[1:], len(members))
+        return {int(r): members[s:e] for (r, s, e) in zip(unique_roots, starts, ends)}
+
+
+# Layout engine: whole forest computations over the parent index array without recursion.
+
+def pointer_jump(jump):
+    "Follow jump (an index array where fixed points are roots) to the roots by repeated squaring."
+    jump = np.array(jump, dtype=INDEX_TYPE)
+    while True:
+        next_jump = jump[jump]
+        if np.array_equal(next_jump, jump):
+            return jump
+        jump = next_jump
+
+
+def track_roots(parent, n_children):
+    """
+    Track root index for every node.
+    A track starts at a node without a parent or whose parent divides.
+    """
+    index = np.arange(len(parent), dtype=INDEX_TYPE)
+    has_parent = (parent != NO_INDEX)
+    starts = ~has_parent
+    starts[has_parent] = n_children[parent[has_parent]] > 1
+    return pointer_jump(np.where(starts, index, parent))
+
+
+def lineage_roots(parent):
+    "Lineage root (top ancestor) index for every node."
+    index = np.arange(len(parent), dtype=INDEX_TYPE)
+    return pointer_jump(np.where(parent == NO_INDEX, index, parent))
+
+
+def track_root(arrays, index):
+    "Track root of one node, walking up the parents and remembering the path."
+    (track, parent, n_children) = (arrays.track, arrays.parent, arrays.n_children)
+    path = []
+    cursor = index
+    while track[cursor] == NO_INDEX:
+        path.append(cursor)
+        up = parent[cursor]
+        if up == NO_INDEX or n_children[up] > 1:
+            root = cursor
+            break
+        cursor = up
+    else:
+        root = track[cursor]
+    track[path] = root
+    return int(root)
+
+
+def lineage_root(arrays, index):
+    "Lineage root of one node, walking up the parents and remembering the path."
+    (lineage, parent) = (arrays.lineage, arrays.parent)
+    path = []
+    cursor = index
+    while lineage[cursor] == NO_INDEX:
+        path.append(cursor)
+        up = parent[cursor]
+        if up == NO_INDEX:
+            root = cursor
+            break
+        cursor = up
+    else:
+        root = lineage[cursor]
+    lineage[path] = root
+    return int(root)
+
+
+def local_parents(arrays, members):
+    """
+    Parent positions within members (sorted node indices), NO_INDEX where the parent
+    is missing or outside members.
+    """
+    if len(members) == len(arrays):
+        # all nodes: positions are node indices
+        return arrays.parent.copy()
+    parent = arrays.parent[members]
+    position = np.searchsorted(members, parent).clip(0, max(len(members) - 1, 0))
+    inside = (parent != NO_INDEX)
+    if len(members):
+        inside &= (members[position] == parent)
+    return np.where(inside, position, NO_INDEX).astype(INDEX_TYPE)
+
+
+def resolve_roots(arrays, members=None):
+    """
+    Set arrays.track and arrays.lineage for all nodes, or only for members
+    (node indices closed under parent and child links, such as whole lineages).
+    """
+    if members is None:
+        arrays.track[:] = track_roots(arrays.parent, arrays.n_children)
+        arrays.lineage[:] = lineage_roots(arrays.parent)
+        return
+    members = np.sort(np.asarray(members, dtype=INDEX_TYPE))
+    parent = local_parents(arrays, members)
+    n_children = arrays.n_children[members]
+    arrays.track[members] = members[track_roots(parent, n_children)]
+    arrays.lineage[members] = members[lineage_roots(parent)]
+
+
+def descendants(arrays, index):
+    "Node indices in the subtree under index (including index)."
+    result = [index]
+    cursor = 0
+    while cursor < len(result):
+        result.extend(arrays.children(result[cursor]))
+        cursor += 1
+    return np.array(result, dtype=INDEX_TYPE)
+
+
+def subtree_members(arrays, roots):
+    "Node indices in the subtrees under roots, found one ordinal level at a time."
+    parent = arrays.parent
+    member = np.zeros((len(arrays),), dtype=bool)
+    member[roots] = True
+    for level in arrays.levels():
+        below = level[~member[level]]
+        up = parent[below]
+        linked = (up != NO_INDEX)
+        member[below[linked]] = member[up[linked]]
+    return np.nonzero(member)[0].astype(INDEX_TYPE)
+
+
+def layout_offsets(arrays, roots, start_at=0, members=None):
+    """
+    Assign arrays.offset for the subtrees under roots, laid out left to right in the given order
+    with children ordered by node id.  members (all node indices in the subtrees) may be given
+    to avoid scanning the whole forest.
+    Leaves take the cursor value; the cursor advances after the first child of each division
+    and between roots.  A parent sits midway between its first and last child.
+    Returns the cursor after the last subtree.
+
+    Parents always have smaller ordinals than their children so the work is done
+    one ordinal level at a time with array operations over the members.
+    """
+    roots = np.asarray(roots, dtype=INDEX_TYPE)
+    if len(roots) == 0:
+        return start_at
+    if members is None:
+        members = subtree_members(arrays, roots)
+    members = np.sort(np.asarray(members, dtype=INDEX_TYPE))
+    m = len(members)
+    local_roots = np.searchsorted(members, roots)
+    is_root = np.zeros((m,), dtype=bool)
+    is_root[local_roots] = True
+    parent = local_parents(arrays, members)
+    parent[is_root] = NO_INDEX
+    # levels of local positions by ordinal
+    ordinal = arrays.ordinal[members]
+    by_ordinal = np.argsort(ordinal, kind="stable")
+    (unused, level_starts) = np.unique(ordinal[by_ordinal], return_index=True)
+    levels = np.split(by_ordinal, level_starts[1:])
+    # subtree sizes, bottom up
+    size = np.ones((m,), dtype=np.int64)
+    for level in reversed(levels):
+        below = level[~is_root[level]]
+        np.add.at(size, parent[below], size[below])
+    # siblings ordered by node id within each parent
+    rank = arrays.id_rank(members)
+    children = np.nonzero(~is_root)[0]
+    children = children[np.lexsort((rank[children], parent[children]))]
+    child_parents = parent[children]
+    group_start = np.ones((len(children),), dtype=bool)
+    group_start[1:] = child_parents[1:] != child_parents[:-1]
+    group_end = np.ones((len(children),), dtype=bool)
+    group_end[:-1] = group_start[1:]
+    starts = np.nonzero(group_start)[0]
+    child_sizes = size[children]
+    cumulative = np.cumsum(child_sizes) - child_sizes
+    group_id = np.cumsum(group_start) - 1
+    before = np.zeros((m,), dtype=np.int64)
+    before[children] = cumulative - cumulative[starts][group_id]
+    first_child = np.full((m,), NO_INDEX, dtype=INDEX_TYPE)
+    last_child = np.full((m,), NO_INDEX, dtype=INDEX_TYPE)
+    first_child[child_parents[group_start]] = children[group_start]
+    last_child[child_parents[group_end]] = children[group_end]
+    # preorder positions, top down
+    position = np.zeros((m,), dtype=np.int64)
+    root_sizes = size[local_roots]
+    position[local_roots] = np.cumsum(root_sizes) - root_sizes
+    for level in levels:
+        below = level[~is_root[level]]
+        position[below] = position[parent[below]] + 1 + before[below]
+    # cursor advance events: before each root after the first and before the second child of a division.
+    events = np.zeros((m,), dtype=np.int64)
+    events[position[local_roots[1:]]] = 1
+    second = np.zeros((len(children),), dtype=bool)
+    second[1:] = group_start[:-1] & ~group_start[1:]
+    events[position[children[second]]] = 1
+    cursor = start_at + np.cumsum(events)
+    # leaves take the cursor, parents the midpoint of their first and last child, bottom up.
+    offset = np.zeros((m,), dtype=np.float64)
+    leaves = (first_child == NO_INDEX)
+    offset[leaves] = cursor[position[leaves]]
+    for level in reversed(levels):
+        inner = level[first_child[level] != NO_INDEX]
+        offset[inner] = 0.5 * (offset[first_child[inner]] + offset[last_child[inner]])
+    arrays.offset[members] = offset
+    return int(cursor[-1])
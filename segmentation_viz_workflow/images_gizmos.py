@@ -3,22 +3,210 @@
 Displays for labels and images
 """
 
+import asyncio
+import os
+import threading
+import weakref
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from H5Gizmos import Stack, Slider, Image, Shelf, Button, Text, RangeSlider, do
 from array_gizmos import colorizers, operations3d
 from scipy.ndimage import gaussian_filter
 from . import lineage_gizmo
+from . import volume_cache
+from . import pyramids
 
 ENHANCE_CONTRAST = True
+IMAGE_DOWNSAMPLE = "max"  # or "mean": how image pyramid levels combine voxels
+PREVIEW_LEVELS = 1  # previews while dragging project this many pyramid levels coarser
+SETTLE_SECONDS = 0.25  # render full quality once the sliders are still this long
+ENHANCED_MAX = 10000  # enhanced intensities range over 0..ENHANCED_MAX, stored as uint16
 dummy_image = np.zeros((2,2), dtype=np.int)
 
+# shared by all CompareTimeStamps widgets: runs the parent display pipeline while the caller runs the child's.
+display_pool = None
+display_pool_lock = threading.Lock()
+
+def get_display_pool():
+    global display_pool
+    with display_pool_lock:
+        if display_pool is None:
+            display_pool = ThreadPoolExecutor(max_workers=2)
+        return display_pool
+
+def enhance_image(image_volume, sigma=1):
+    """
+    Gaussian smoothed image_volume rescaled to 0..ENHANCED_MAX as uint16.
+    Computed in float32 (colorizers.scaleN would make a float64 copy).
+    """
+    im = gaussian_filter(image_volume.astype(np.float32), sigma=sigma)
+    m = im.min()
+    D = max(float(im.max() - m), 1e-11)
+    im -= m
+    im *= ENHANCED_MAX / D
+    #im = colorizers.enhance_contrast(im,cutoff=0.01)
+    return im.astype(np.uint16)
+
+class EnhancedVolumes:
+
+    """
+    Contrast enhanced image volumes keyed by timestamp ordinal and crop slicing.
+    In memory the enhanced volume is owned by the prepared entry of the forest volume cache
+    (see load_prepared_volumes), which counts it against that budget once.
+    If directory is given volumes are also saved there as .npy files, so a timestamp evicted from memory
+    or seen in a later session is loaded instead of filtered again.
+    The directory should be specific to one image series.
+    """
+
+    def __init__(self, directory=None, sigma=1):
+        self.directory = directory
+        self.sigma = sigma
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, ordinal, slicing):
+        bounds = "_".join(str(int(b)) for b in np.asarray(slicing).ravel())
+        return os.path.join(self.directory, "enhanced_%05d_%s_s%g.npy" % (ordinal, bounds, self.sigma))
+
+    def get(self, ordinal, slicing, image_volume):
+        "Enhanced image_volume, the image for ordinal cropped by slicing."
+        if self.directory is None:
+            return enhance_image(image_volume, self.sigma)
+        path = self.path(ordinal, slicing)
+        if os.path.isfile(path):
+            return np.load(path)
+        result = enhance_image(image_volume, self.sigma)
+        temp_path = path + ".tmp.npy"
+        np.save(temp_path, result)
+        os.replace(temp_path, path)
+        return result
+
+def prepare_volumes(label_volume, image_volume, ordinal=None, enhanced=None, slicing=None):
+    """
+    Crop label and image volumes to the labelled region, enhance the image contrast and build pyramids.
+    If slicing is given the volumes were already cropped by it (see Forest.crop_region);
+    otherwise they are cropped to operations3d.positive_slicing of the labels, which scans the whole volume.
+    Enhanced images come from the EnhancedVolumes enhanced (if given) for timestamp ordinal.
+    Returns (label_levels, image_levels, unenhanced_image_volume) where the levels start at full resolution.
+    """
+    l_s = label_volume.shape
+    i_s = image_volume.shape
+    assert l_s == i_s, "volume shapes don't match: " + repr([l_s, i_s])
+    if slicing is None:
+        slicing = operations3d.positive_slicing(label_volume)
+        label_volume = operations3d.slice3(label_volume, slicing)
+        image_volume = operations3d.slice3(image_volume, slicing)
+    unenhanced_image_volume = image_volume
+    # image enhancement
+    if ENHANCE_CONTRAST:
+        if enhanced is not None:
+            assert ordinal is not None, "ordinal is required to use enhanced volumes."
+            image_volume = enhanced.get(ordinal, slicing, image_volume)
+        else:
+            image_volume = enhance_image(image_volume)
+    label_levels = pyramids.build_pyramid(label_volume, pyramids.mode_downsample)
+    image_levels = pyramids.build_pyramid(
+        image_volume, lambda volume: pyramids.reduce_downsample(volume, IMAGE_DOWNSAMPLE))
+    return (label_levels, image_levels, unenhanced_image_volume)
+
+def load_prepared_volumes(forest, ordinal, enhanced=None):
+    """
+    (label_levels, image_levels, unenhanced_image_volume) for ordinal from prepare_volumes,
+    kept in the forest volume cache if there is one.
+    If label bounds were precomputed for every timestamp (Forest.compute_label_bounds, for example by
+    examples/compute_label_bounds.py) every timestamp is cropped to the forest crop region, so all timestamps
+    share one coordinate frame (loaders that support regions read only the region).
+    Otherwise each timestamp is cropped to its own labels.
+    The image entries are None if either volume is missing and label_levels is None if the labels are missing.
+    """
+    def compute():
+        region = forest.crop_region()
+        label_volume = forest.load_labels_for_timestamp(ordinal, region=region)
+        if label_volume is None:
+            return (None, None, None)
+        image_volume = forest.load_image_for_timestamp(ordinal, region=region)
+        if image_volume is None:
+            return ([label_volume], None, None)
+        return prepare_volumes(label_volume, image_volume, ordinal, enhanced, slicing=region)
+    cache = forest.volume_cache
+    if cache is None:
+        return compute()
+    return cache.get(("prepared", ordinal), compute)
+
+class VolumePrefetcher:
+
+    """
+    Load and prepare the volumes of timestamps within depth of the displayed timestamp on worker threads,
+    so stepping through time finds them in the forest volume cache.
+    """
+
+    def __init__(self, forest, depth=2, workers=2, enhanced=None):
+        self.forest = forest
+        self.depth = depth
+        self.enhanced = enhanced
+        self.center = None
+        self.futures = {}  # ordinal -> future
+        self.executor = None
+        if depth > 0 and forest.volume_cache is not None:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def near(self, ordinal):
+        center = self.center
+        return center is not None and abs(ordinal - center) <= self.depth
+
+    def prefetch_around(self, ordinal):
+        "Prefetch neighbors of ordinal, nearest first, cancelling prefetches that are no longer near."
+        if self.executor is None:
+            return
+        self.center = ordinal
+        for (other, future) in list(self.futures.items()):
+            if future.done() or not self.near(other):
+                future.cancel()
+                del self.futures[other]
+        o2t = self.forest.ordinal_to_timestamp
+        for distance in range(1, self.depth + 1):
+            for other in (ordinal + distance, ordinal - distance):
+                if other in o2t and other not in self.futures:
+                    self.futures[other] = self.executor.submit(self.prepare, other)
+
+    def prepare(self, ordinal):
+        if not self.near(ordinal):
+            # stale: the viewer has moved away since this was scheduled.
+            return
+        load_prepared_volumes(self.forest, ordinal, self.enhanced)
+
+    def shutdown(self):
+        "Cancel queued prefetches and let the worker threads exit once any running prefetch finishes."
+        if self.executor is not None:
+            for future in self.futures.values():
+                future.cancel()
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            self.futures = {}
+
 class LineageViewer:
 
-    def __init__(self, forest, side, title="Lineage Viewer", colorize="tracks"):
+    def __init__(
+        self,
+        forest,
+        side,
+        title="Lineage Viewer",
+        colorize="tracks",
+        cache_bytes=volume_cache.DEFAULT_BUDGET,
+        prefetch_depth=2,  # prefetch timestamps up to this far from the displayed one (0 for none)
+        enhanced_dir=None,  # directory to keep contrast enhanced volumes across sessions
+        ):
         self.forest = forest
+        if forest.volume_cache is None and forest.label_volume_loader is not None and forest.image_volume_loader is not None:
+            # stepping through time revisits each timestamp as child and then parent.
+            forest.use_volume_cache(cache_bytes)
+        self.enhanced = EnhancedVolumes(enhanced_dir)
+        self.prefetcher = VolumePrefetcher(forest, depth=prefetch_depth, enhanced=self.enhanced)
+        # stop prefetching when the viewer is discarded (or at exit) even if shutdown is never called.
+        weakref.finalize(self, self.prefetcher.shutdown)
         self.side = side
         self.title = title
-        self.compare = CompareTimeStamps(forest, side, title)
+        self.compare = CompareTimeStamps(forest, side, title, enhanced=self.enhanced)
         self.lineage = lineage_gizmo.LineageDisplay(2.5 * side, 2 * side, colorize=colorize)
         self.detail = lineage_gizmo.TimeSliceDetail(height=side * 0.3, width=5*side)
         self.info_area = Text("Data not yet loaded.")
@@ -31,6 +219,11 @@ class LineageViewer:
     def info(self, text):
         self.info_area.text(text)
 
+    def shutdown(self):
+        "Stop prefetching and cancel pending renders, for example before replacing the viewer."
+        self.prefetcher.shutdown()
+        self.compare.shutdown()
+
     def configure_gizmo(self):
         self.lineage.configure_canvas(self.ts_select_callback)
         self.lineage.load_forest(self.forest)
@@ -54,6 +247,7 @@ class LineageViewer:
                 self.compare.set_parent_timestamp(ordinal - 1)
             self.compare.project2d()
             self.compare.display_images()
+            self.prefetcher.prefetch_around(ordinal)
 
     def update_label_selection(self, *ignored):
         compare = self.compare
@@ -78,13 +272,77 @@ class LineageViewer:
         compare.display_images()
         self.detail.update_selections(cid, pid)
 
+def running_loop():
+    "The running asyncio event loop or None (asyncio.get_running_loop needs python 3.7)."
+    try:
+        if hasattr(asyncio, "get_running_loop"):
+            return asyncio.get_running_loop()
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        return None
+    if not loop.is_running():
+        return None
+    return loop
+
+class RenderScheduler:
+
+    """
+    Coalesce render requests from slider events: only the latest request is rendered.
+    While requests arrive preview() renders a fast frame; render() draws full quality
+    once no request arrived for settle_seconds.
+    preview() returns True if its frame was already full quality, so the settled render is skipped.
+    """
+
+    def __init__(self, preview, render, settle_seconds=SETTLE_SECONDS):
+        self.preview = preview
+        self.render = render
+        self.settle_seconds = settle_seconds
+        self.generation = 0
+        self.preview_pending = False
+        self.settle_handle = None
+        self.final_generation = None  # generation already rendered at full quality
+
+    def request(self, *ignored):
+        loop = running_loop()
+        if loop is None:
+            # no event loop (for example scripted use): render now.
+            self.render()
+            return
+        self.generation += 1
+        if self.settle_handle is not None:
+            self.settle_handle.cancel()
+        self.settle_handle = loop.call_later(self.settle_seconds, self.settle, self.generation)
+        if not self.preview_pending:
+            # events queued before the preview runs are covered by it.
+            self.preview_pending = True
+            loop.call_soon(self.run_preview)
+
+    def run_preview(self):
+        self.preview_pending = False
+        generation = self.generation
+        if self.preview():
+            self.final_generation = generation
+
+    def cancel(self):
+        "Drop any pending settled render."
+        if self.settle_handle is not None:
+            self.settle_handle.cancel()
+            self.settle_handle = None
+
+    def settle(self, generation):
+        self.settle_handle = None
+        if generation == self.generation and generation != self.final_generation:
+            self.render()
+            self.final_generation = generation
+
 class CompareTimeStamps:
     """
     Show image and labels for 2 time stamps.
     """
 
-    def __init__(self, forest, side, title="Timeslices"):
+    def __init__(self, forest, side, title="Timeslices", enhanced=None):
         self.forest = forest
+        self.enhanced = enhanced
         self.side = side
         self.title = title
         # gizmo scaffolding
@@ -94,6 +352,7 @@ class CompareTimeStamps:
         self.info_area.resize(width=side * 2)
         self.parent_display = ImageAndLabels2d(side, None, title="Parent images")
         self.child_display = ImageAndLabels2d(side, None, title="Child images")
+        self.scheduler = RenderScheduler(self.preview_and_display, self.project_and_display)
         self.displays = Stack([ 
             self.title_area,
             self.parent_display.gizmo,
@@ -107,6 +366,8 @@ class CompareTimeStamps:
         ])
         # array shape (maxima)
         self.slicing = None
+        # pyramid level projected by rotate_image
+        self.level = 0
         self.theta = 0
         self.phi = 0
         self.label_select_callback = None
@@ -120,7 +381,7 @@ class CompareTimeStamps:
             minimum=-limit, 
             maximum=+limit, 
             step=0.02, 
-            on_change=self.project_and_display)
+            on_change=self.scheduler.request)
         self.theta_slider.resize(height=side)
         self.phi_slider = Slider(
             title="theta", 
@@ -129,7 +390,7 @@ class CompareTimeStamps:
             minimum=-limit, 
             maximum=+limit, 
             step=0.02, 
-            on_change=self.project_and_display)
+            on_change=self.scheduler.request)
         self.phi_slider.resize(height=side)
         # dummy values for now
         I = 100
@@ -141,7 +402,7 @@ class CompareTimeStamps:
             high_value=I,
             step=1,
             title="I slider",
-            on_change=self.project_and_display,
+            on_change=self.scheduler.request,
         )
         self.I_slider.resize(height=side)
         self.J_slider = RangeSlider(
@@ -152,7 +413,7 @@ class CompareTimeStamps:
             high_value=I,
             step=1,
             title="K slider",
-            on_change=self.project_and_display,
+            on_change=self.scheduler.request,
         )
         self.J_slider.resize(height=side)
         self.K_slider = RangeSlider(
@@ -163,7 +424,7 @@ class CompareTimeStamps:
             high_value=I,
             step=1,
             title="K slider",
-            on_change=self.project_and_display,
+            on_change=self.scheduler.request,
         )
         self.K_slider.resize(height=side)
         return [
@@ -206,6 +467,10 @@ class CompareTimeStamps:
         self.child_display.configure_gizmo()
         self.gizmo.css({"background-color": "#ddd"})
 
+    def shutdown(self):
+        "Cancel pending renders (the display pool is shared and stays up)."
+        self.scheduler.cancel()
+
     def set_parent_timestamp(self, ordinal):
         ts = self.forest.ordinal_to_timestamp.get(ordinal)
         if ts is None:
@@ -222,7 +487,11 @@ class CompareTimeStamps:
         self.reset_slider_maxes()
         return ts
 
-    def project_and_display(self, *ignored):
+    def preview_and_display(self):
+        "Project and display coarser levels for a fast preview.  Return True if that was full quality."
+        return self.project_and_display(preview=True)
+
+    def project_and_display(self, *ignored, preview=False):
         self.theta = self.theta_slider.value
         self.phi = self.phi_slider.value
         s = [
@@ -231,20 +500,48 @@ class CompareTimeStamps:
             self.K_slider.values,
         ]
         self.slicing = np.array(s, dtype=np.int)
-        self.project2d()
+        full_quality = self.project2d(preview=preview)
         self.display_images()
-
-    def project2d(self):
-        self.parent_display.project2d(self)
-        self.child_display.project2d(self)
+        return full_quality
+
+    def project2d(self, preview=False):
+        "Project both displays (PREVIEW_LEVELS coarser for a preview).  Return True if at full display level."
+        level = self.display_level()
+        self.level = level
+        if preview:
+            self.level = min(level + PREVIEW_LEVELS, max(self.levels() - 1, 0))
+        self.in_parallel(lambda display: display.project2d(self))
+        return self.level == level
+
+    def in_parallel(self, function):
+        "[function(parent_display), function(child_display)] computed at the same time."
+        parent_future = get_display_pool().submit(function, self.parent_display)
+        child_result = function(self.child_display)
+        return [parent_future.result(), child_result]
+
+    def levels(self):
+        "Pyramid levels available in both displays (0 without volumes)."
+        displays = [d for d in (self.parent_display, self.child_display) if d.levels()]
+        if not displays:
+            return 0
+        return min(d.levels() for d in displays)
+
+    def display_level(self):
+        "Coarsest pyramid level shared by both displays whose sliced volumes still fill side pixels."
+        displays = [d for d in (self.parent_display, self.child_display) if d.levels()]
+        if not displays:
+            return 0
+        shapes = [d.shape() for d in displays]
+        return pyramids.display_level(shapes, self.levels(), self.side, self.slicing)
 
     def display_images(self):
-        self.parent_display.create_mask()
-        self.child_display.create_mask()
+        self.in_parallel(lambda display: display.create_mask())
         self.parent_display.load_mask(self.child_display)
         self.child_display.load_mask(self.parent_display)
-        self.parent_display.display_images()
-        self.child_display.display_images()
+        # colorize both in parallel, then push the images from this thread.
+        [parent_images, child_images] = self.in_parallel(lambda display: display.compose_images())
+        self.parent_display.show_images(*parent_images)
+        self.child_display.show_images(*child_images)
 
     def clear_images(self):
         self.parent_display.clear_images()
@@ -253,7 +550,8 @@ class CompareTimeStamps:
         self.child_display.reset()
 
     def rotate_image(self, img):
-        sl = self.slicing
+        "Slice and rotate img, a volume at pyramid level self.level."
+        sl = pyramids.level_slicing(self.slicing, self.level)
         simg = img
         if sl is not None:
             simg = operations3d.slice3(img, sl)
@@ -303,6 +601,8 @@ class ImageAndLabels2d:
         self.volume_shape = None
         self.label_volume = None
         self.image_volume = None
+        self.label_levels = None
+        self.image_levels = None
         self.volume_shape = None
         # flag set when the projection is derived from real data
         self.valid_projection = False
@@ -311,20 +611,21 @@ class ImageAndLabels2d:
         self.comparison = comparison
         if forest is not None and timestamp is not None:
             ordinal = timestamp.ordinal
-            label_volume = forest.load_labels_for_timestamp(ordinal)
-            if label_volume is None:
+            enhanced = None
+            if comparison is not None:
+                enhanced = comparison.enhanced
+            (label_levels, image_levels, unenhanced_image_volume) = load_prepared_volumes(forest, ordinal, enhanced)
+            if label_levels is None:
                 msg = "Timestamp %s has no label data" % ordinal
                 #print(msg)
                 self.info(msg)
+            elif image_levels is None:
+                msg = "Timestamp %s has no image data" % ordinal
+                print(msg)
+                self.info(msg)
             else:
-                image_volume = forest.load_image_for_timestamp(ordinal)
-                if image_volume is None:
-                    msg = "Timestamp %s has no image data" % ordinal
-                    print(msg)
-                    self.info(msg)
-                else:
-                    self.info("Loaded timestamp " + repr(ordinal))
-                    self.load_volumes(label_volume, image_volume)
+                self.info("Loaded timestamp " + repr(ordinal))
+                self.set_volumes(label_levels, image_levels, unenhanced_image_volume)
 
     def focus_node(self):
         timestamp = self.timestamp
@@ -343,31 +644,32 @@ class ImageAndLabels2d:
         return a.shape
 
     def load_volumes(self, label_volume, image_volume):
-        l_s = label_volume.shape
-        i_s = image_volume.shape
-        assert l_s == i_s, "volume shapes don't match: " + repr([l_s, i_s])
-        # need to fix this so slicing is unified across timestamps! xxxxx
-        slicing = operations3d.positive_slicing(label_volume)
-        self.label_volume = operations3d.slice3(label_volume, slicing)
-        self.image_volume = operations3d.slice3(image_volume, slicing)
-        # image enhancement
-        if ENHANCE_CONTRAST:
-            im = self.unenhanced_image_volume = self.image_volume
-            im = im.astype(np.float)
-            im = gaussian_filter(im, sigma=1)
-            im = colorizers.scaleN(im, to_max=10000)
-            #im = colorizers.enhance_contrast(im,cutoff=0.01)
-            self.image_volume = im
+        self.set_volumes(*prepare_volumes(label_volume, image_volume))
+
+    def set_volumes(self, label_levels, image_levels, unenhanced_image_volume):
+        "Use volume pyramids prepared by prepare_volumes."
+        self.label_levels = label_levels
+        self.image_levels = image_levels
+        self.label_volume = label_levels[0]
+        self.image_volume = image_levels[0]
+        self.unenhanced_image_volume = unenhanced_image_volume
         self.volume_shape = self.label_volume.shape
 
+    def levels(self):
+        "Number of pyramid levels available (0 without volumes)."
+        if self.label_levels is None or self.image_levels is None:
+            return 0
+        return min(len(self.label_levels), len(self.image_levels))
+
     def project2d(self, comparison):
         self.valid_projection = False # defaul
         image2d = labels2d = None
+        level = comparison.level
         if self.label_volume is not None:
-            rlabels = comparison.rotate_image(self.label_volume)
+            rlabels = comparison.rotate_image(self.label_levels[level])
             labels2d = operations3d.extrude0(rlabels)
         if self.image_volume is not None:
-            rimage = comparison.rotate_image(self.image_volume)
+            rimage = comparison.rotate_image(self.image_levels[level])
             image2d = rimage.max(axis=0)  # maximum value projection.
             if ENHANCE_CONTRAST:
                 image2d = colorizers.enhance_contrast(image2d, cutoff=0.05)
@@ -446,6 +748,10 @@ class ImageAndLabels2d:
         self.compare_color = other.focus_color
 
     def display_images(self):
+        self.show_images(*self.compose_images())
+
+    def compose_images(self):
+        "Padded (image, labels) rgb arrays with the masks overlaid, ready for show_images."
         #label = self.focus_label
         labels = self.labels
         maxlabel = labels.max()
@@ -470,6 +776,9 @@ class ImageAndLabels2d:
                     img = colorizers.overlay_color(img, mask, color, center=True)
         img = self.pad_image(img)
         labels = self.pad_image(labels)
+        return (img, labels)
+
+    def show_images(self, img, labels):
         self.image_display.change_array(img)
         self.labels_display.change_array(labels)
 
@@ -1,50 +1,144 @@
 
 """
 OO structure for cell lineage tracking.
+
+Node, TimeStamp, Lineage and Track are lightweight views over the
+structure of arrays storage in forest_arrays.NodeArrays held by the Forest.
 """
 
 
 from array_gizmos import color_list
+from bisect import bisect_left
+from collections.abc import Mapping
 import os
+import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
+from . import forest_arrays
+from . import volume_cache
+from . import block_store
+from .streaming_json import JsonStream
+from .forest_arrays import NodeArrays, NO_INDEX, NO_LABEL, INDEX_TYPE
+
+NO_MEMBERS = np.zeros((0,), dtype=INDEX_TYPE)
+
+
+def offset_value(value):
+    "Python number for a stored offset (None if not assigned)."
+    if np.isnan(value):
+        return None
+    if value == int(value):
+        return int(value)
+    return float(value)
 
 
 class Node:
 
-    "A cell in a timestamp."
+    "A cell in a timestamp (a view of one entry in the forest arrays)."
 
-    def __init__(self, node_id, timestamp_ordinal, label=None):
-        self.node_id = node_id
-        self.timestamp_ordinal = timestamp_ordinal
-        self.label = label
-        self.parent = None
-        self.id_to_child = {}
-        self.reset()
+    __slots__ = ("forest", "index")
+
+    def __init__(self, forest, index):
+        self.forest = forest
+        self.index = int(index)
+
+    def __eq__(self, other):
+        return type(other) is Node and other.forest is self.forest and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.forest), self.index))
+
+    def view(self, index):
+        if index == NO_INDEX:
+            return None
+        return Node(self.forest, index)
+
+    @property
+    def node_id(self):
+        return self.forest.arrays.ids[self.index]
+
+    @property
+    def timestamp_ordinal(self):
+        return int(self.forest.arrays.ordinal[self.index])
+
+    @property
+    def label(self):
+        label = self.forest.arrays.label[self.index]
+        if label == NO_LABEL:
+            return None
+        return int(label)
+
+    @property
+    def parent(self):
+        return self.view(self.forest.arrays.parent[self.index])
+
+    @property
+    def id_to_child(self):
+        arrays = self.forest.arrays
+        ids = arrays.ids
+        return {ids[c]: Node(self.forest, c) for c in arrays.children(self.index)}
+
+    # derived layout state
+    @property
+    def _track(self):
+        return self.view(self.forest.arrays.track[self.index])
+
+    @_track.setter
+    def _track(self, node):
+        self.forest.arrays.track[self.index] = NO_INDEX if node is None else node.index
+
+    @property
+    def _lineage_root(self):
+        return self.view(self.forest.arrays.lineage[self.index])
+
+    @_lineage_root.setter
+    def _lineage_root(self, node):
+        self.forest.arrays.lineage[self.index] = NO_INDEX if node is None else node.index
+
+    @property
+    def _lineage_index(self):
+        index = self.forest.arrays.lineage_index[self.index]
+        if index < 0:
+            return None
+        return int(index)
+
+    @_lineage_index.setter
+    def _lineage_index(self, index):
+        self.forest.arrays.lineage_index[self.index] = -1 if index is None else index
+
+    @property
+    def _offset(self):
+        return offset_value(self.forest.arrays.offset[self.index])
+
+    @_offset.setter
+    def _offset(self, offset):
+        self.forest.arrays.offset[self.index] = np.nan if offset is None else offset
+
+    @property
+    def _is_isolated(self):
+        isolated = self.forest.arrays.isolated[self.index]
+        if isolated < 0:
+            return None
+        return bool(isolated)
+
+    @_is_isolated.setter
+    def _is_isolated(self, isolated):
+        self.forest.arrays.isolated[self.index] = -1 if isolated is None else int(isolated)
+
+    @property
+    def color(self):
+        return self.forest.indexed_color(self.forest.arrays.color_index[self.index])[0]
+
+    @property
+    def color_array(self):
+        return self.forest.indexed_color(self.forest.arrays.color_index[self.index])[1]
 
     def reset(self):
-        self._track = None
-        self._lineage_root = None
-        self._lineage_index = None
-        self._width = None
-        self._offset = None
-        self._is_isolated = None  # not determined
-        self.color = None
-        self.color_array = None
+        self.forest.arrays.reset_derived([self.index])
 
     def json_object(self):
-        parent_id = None
-        if self.parent is not None:
-            parent_id = self.parent.node_id
-        isolated = (self.parent is None) and (len(self.id_to_child) < 1)
-        return dict(
-            identity=self.node_id,
-            timestamp_ordinal=self.timestamp_ordinal,
-            label=self.label,
-            color=self.color,
-            offset=self._offset,
-            parent_id=parent_id,
-            isolated=isolated,
-        )
+        return self.forest.node_json_objects([self.index])[0]
 
     def same(self, other):
         return (
@@ -54,155 +148,152 @@ class Node:
         )
 
     def track_ancestor(self):
-        if self._track is not None:
-            return self._track
-        parent = self.parent
-        if parent is None:
-            result = self
-        elif len(parent.id_to_child) > 1:
-            result = self
-        else:
-            result = self.parent.track_ancestor()
-        self._track = result
-        return result
+        return Node(self.forest, forest_arrays.track_root(self.forest.arrays, self.index))
 
     def lineage_ancestor(self):
-        if self._lineage_root is not None:
-            return self._lineage_root
-        if self.parent is not None:
-            result = self.parent.track_ancestor().lineage_ancestor()
-        else:
-            result = self
-        self._lineage_root = result
-        return result
+        return Node(self.forest, forest_arrays.lineage_root(self.forest.arrays, self.index))
 
     def __repr__(self):
         pid = None
-        if self.parent is not None:
-            pid = self.parent.node_id
+        parent = self.parent
+        if parent is not None:
+            pid = parent.node_id
         t = None
-        if self._track:
-            t = self._track.node_id
+        track = self._track
+        if track:
+            t = track.node_id
         l = None
-        if self._lineage_root:
-            l = self._lineage_root.node_id
+        root = self._lineage_root
+        if root:
+            l = root.node_id
         return "Node" + repr((self.node_id, self.timestamp_ordinal, self.label, pid, t, l))
 
     def set_parent(self, parent):
         assert type(parent) is Node, "bad parent type: " + repr([parent, type(parent)])
+        assert parent.forest is self.forest, "parent in another forest: " + repr([self, parent])
         assert self.timestamp_ordinal > parent.timestamp_ordinal, (
             "Bad Node parent: " + repr([self, parent])
         )
-        self.parent = parent
+        self.forest.relink_indices(self.index, parent.index)
 
     def set_child(self, child):
         assert type(child) is Node, "bad child type: " + repr([child, type(child)])
-        i2c = self.id_to_child
         # should have no more than 2 children? xxxx
         child.set_parent(self)
-        i2c[child.node_id] = child
 
     def children_ids(self):
-        return sorted(self.id_to_child.keys())
-
-    '''def width(self):
-        if self._width is not None:
-            return self._width
-        result = 1
-        for c in self.id_to_child.values():
-            result += c.width()
-        self._width = result
-        return result'''
-
-    '''def offset(self, starting_from):
-        if self._offset is not None:
-            return self._offset
-        result = starting_from + 1
-        child_ids = self.children_ids()
-        if child_ids:
-            first = self.id_to_child[child_ids[0]]
-            result = starting_from + first.width + 1
-        self._offset = result
-        return result'''
+        arrays = self.forest.arrays
+        ids = arrays.ids
+        return sorted(ids[c] for c in arrays.children(self.index))
 
     def assign_offsets(self, starting_from=0, cursor_ref=None):
         assert starting_from is not None
         if cursor_ref is None:
             cursor_ref = [starting_from]
-        child_ids = self.children_ids()
-        i2c = self.id_to_child
-        nc = len(child_ids)
-        if nc < 1:
-            #result = starting_from # + 1
-            self._offset = cursor_ref[0]
-            # no increment
-        else:
-            first_id = child_ids[0]
-            first = i2c[first_id]
-            remainder = child_ids[1:]
-            if nc == 1:
-                first.assign_offsets(cursor_ref=cursor_ref)
-                self._offset = first._offset
-            else:
-                assert nc > 1
-                first.assign_offsets(cursor_ref=cursor_ref)
-                cursor_ref[0] += 1
-                #self._offset = cursor_ref[0]
-                #cursor_ref[0] += 1
-                for r_id in remainder:
-                    r = i2c[r_id]
-                    result = r.assign_offsets(cursor_ref=cursor_ref)
-                self._offset = 0.5 * (first._offset + r._offset)
+        cursor_ref[0] = forest_arrays.layout_offsets(self.forest.arrays, [self.index], cursor_ref[0])
+        self.forest.layout_changed()
         return cursor_ref[0]
 
-class NodeGroup:
 
-    "Superclass for node collection."
+class NodeMapping(Mapping):
+
+    """
+    Read only mapping to Node views for a set of node indices,
+    keyed by node id or by the values of key_array (for example labels).
+    indices=None means all nodes in the forest.
+    """
+
+    def __init__(self, forest, indices=None, key_array=None):
+        self.forest = forest
+        self.indices = indices
+        self.key_array = key_array
+        self._key_to_index = None
+
+    def key_to_index(self):
+        if self.indices is None:
+            return self.forest.arrays.id_to_index
+        if self._key_to_index is None:
+            indices = self.indices.tolist()
+            if self.key_array is None:
+                ids = self.forest.arrays.ids
+                self._key_to_index = {ids[i]: i for i in indices}
+            else:
+                self._key_to_index = dict(zip(self.key_array[self.indices].tolist(), indices))
+        return self._key_to_index
+
+    def __getitem__(self, key):
+        return Node(self.forest, self.key_to_index()[key])
+
+    def __contains__(self, key):
+        return key in self.key_to_index()
+
+    def __iter__(self):
+        return iter(self.key_to_index())
+
+    def __len__(self):
+        if self.indices is None:
+            return len(self.forest.arrays)
+        return len(self.indices)
 
-    id_to_node = None
+
+class NodeGroup:
+
+    "Superclass for node collection (membership is derived from the forest arrays)."
 
     def add_node(self, node):
         self.check_node(node)
-        if self.id_to_node is None:
-            self.id_to_node = {}
-        self.id_to_node[node.node_id] = node
+
+    def node_indices(self):
+        return NO_MEMBERS # by default no members; subclasses derive them from the forest arrays
+
+    @property
+    def id_to_node(self):
+        return NodeMapping(self.forest, self.node_indices())
 
     def reset(self):
         pass # by default do nothing
 
     def isolated(self):
-        return len(self.id_to_node) < 2
+        return len(self.node_indices()) < 2
 
     def mark_isolated(self):
         test = self.isolated()
-        for node in self.id_to_node.values():
-            node._is_isolated = test
+        self.forest.arrays.isolated[self.node_indices()] = int(test)
 
 class TimeStamp(NodeGroup):
 
     "A time reference point."
 
-    def __init__(self, ordinal):
+    def __init__(self, forest, ordinal):
+        self.forest = forest
         self.ordinal = ordinal
-        self.label_to_node = {}
+
+    def node_indices(self):
+        "Indices of nodes in the timestamp sorted by label."
+        return self.forest.arrays.ordinal_members(self.ordinal)
+
+    @property
+    def label_to_node(self):
+        return NodeMapping(self.forest, self.node_indices(), self.forest.arrays.label)
 
     def check_node(self, node):
         ord = self.ordinal
         assert ord == node.timestamp_ordinal, "node not in timestamp: " + repr([ord, node])
-        self.label_to_node[node.label] = node
 
     def farthest_parent_ordinal(self):
+        arrays = self.forest.arrays
+        parents = arrays.parent[self.node_indices()]
+        parents = parents[parents != NO_INDEX]
         result = self.ordinal
-        for node in self.id_to_node.values():
-            if node.parent is not None:
-                ordinal = node.parent.timestamp_ordinal
-                if (result is None) or (result > ordinal):
-                    result = ordinal
+        if len(parents):
+            result = min(result, int(arrays.ordinal[parents].min()))
         return result
 
     def color_mapping_array(self, maxlabel=None):
-        l2n = self.label_to_node
-        max_node_label = max(l2n.keys())
+        arrays = self.forest.arrays
+        indices = self.node_indices()
+        labels = arrays.label[indices]
+        max_node_label = int(labels.max())
         if maxlabel is None:
             maxlabel = max_node_label
         else:
@@ -210,8 +301,10 @@ class TimeStamp(NodeGroup):
         result = np.zeros((maxlabel + 1, 3), dtype=np.ubyte)
         # map any unassigned labels to grey
         result[1:] = 128
-        for (label, node) in l2n.items():
-            result[label] = node.color_array
+        for (label, color_index) in zip(labels.tolist(), arrays.color_index[indices].tolist()):
+            color_array = self.forest.indexed_color(color_index)[1]
+            if color_array is not None:
+                result[label] = color_array
         return result
 
     def json_object(self):
@@ -224,108 +317,377 @@ class Lineage(NodeGroup):
 
     "A group of tracks originating at a single ancestor cell."
 
+    # name of the forest array holding the group root index for each node.
+    group_array = "lineage"
+
+    index = None
+
     def __init__(self, root):
         self.root = root
-        self.index = None
+        self.forest = root.forest
+
+    def node_indices(self):
+        return self.forest.group_members(self.group_array).get(self.root.index, NO_MEMBERS)
 
     def check_node(self, node):
         node_root = node.lineage_ancestor()
-        assert node_root is self.root, "wrong lineage: " + repr([node, node_root, self.root])
+        assert node_root == self.root, "wrong lineage: " + repr([node, node_root, self.root])
 
     def set_index(self, index):
         self.index = index
-        for node in self.id_to_node.values():
-            node._lineage_index = index
+        self.forest.arrays.lineage_index[self.node_indices()] = index
 
 class Track(Lineage):
 
     "A collection of nodes representing the same cell over many time steps."
 
+    group_array = "track"
+
+    @property
+    def index(self):
+        index = self.forest.arrays.lineage_index[self.root.index]
+        if index < 0:
+            return None
+        return int(index)
+
+    def set_index(self, index):
+        self.forest.arrays.lineage_index[self.node_indices()] = index
+
     def check_node(self, node):
         node_root = node.track_ancestor()
-        assert node_root is self.root, "wrong track: " + repr([node, node_root, self.root])
+        assert node_root == self.root, "wrong track: " + repr([node, node_root, self.root])
 
 class Forest:
 
     "A collection of lineages"
 
+    # built on first use after Forest.load, so loading does not read the node ids (see __getattr__).
+    LAZY_ATTRIBUTES = ("id_to_lineage", "id_to_track", "track_order", "track_roots", "track_ids", "layout")
+
     def __init__(self):
-        self.id_to_node = {}
+        self.arrays = NodeArrays()
+        self.id_to_node = NodeMapping(self)
         self.ordinal_to_timestamp = {}
         self.label_volume_loader = None
         self.image_volume_loader = None
+        # shared VolumeCache for the loaders, if any (see use_volume_cache).
+        self.volume_cache = None
+        self.color_cache = {}
+        # ordinal -> (shape, labels, voxel counts) for label volumes (see label_inventories).
+        self.label_inventory_cache = {}
+        # ordinal -> (start, end) per axis bounding the nonzero labels, or None (see compute_label_bounds).
+        # The bounds describe the data, so they are kept when loaders change and are saved with the forest.
+        self.label_bounds = {}
+        # file last saved to or loaded from (see Forest.save).
+        self.saved_path = None
+        # signature of the file the forest was built from (see load_forest_from_haydens_json_file).
+        self.source = None
         self.reset()
 
     def reset(self):
-        for node in self.id_to_node.values():
-            node.reset()
+        self.pending_index = None
+        self.arrays.reset_derived()
         for ts in self.ordinal_to_timestamp.values():
             ts.reset()
         self.id_to_lineage = None
         self.id_to_track = {}
         self.track_order = None
+        self.group_cache = {}
+        # lineage layout order maintained by incremental edits (set by assign_offsets).
+        self.layout = None
+        # collection kind colored by assign_colors_to_tracks ("track" or "lineage").
+        self.colorize = None
+        self.last_changed_ids = []
+        self.layout_changed()
 
-    def load_image_for_timestamp(self, ts_ordinal):
+    def __getattr__(self, name):
+        # only called for missing attributes: the LAZY_ATTRIBUTES of a loaded forest before first use.
+        pending = self.__dict__.get("pending_index")
+        if pending is None or name not in Forest.LAZY_ATTRIBUTES:
+            raise AttributeError(name)
+        self.pending_index = None
+        (resolved, layout_arguments) = pending
+        self.id_to_lineage = None
+        self.id_to_track = {}
+        self.track_order = None
+        self.layout = None
+        if resolved:
+            self.index_tracks_and_lineages()
+        if layout_arguments is not None:
+            self.remember_layout(*layout_arguments)
+        return getattr(self, name)
+
+    def layout_changed(self):
+        "Discard the region index and memoized region JSON after offsets or colors change."
+        self._region_index = None
+
+    def group_members(self, group_array):
+        "Root index -> member indices for the 'track' or 'lineage' array."
+        key = (group_array, self.arrays.version)
+        result = self.group_cache.get(key)
+        if result is None:
+            result = self.group_cache[key] = self.arrays.group_members(getattr(self.arrays, group_array))
+        return result
+
+    def indexed_color(self, color_index):
+        "(html color, color array) for a node color index, or (None, None) if unassigned."
+        color_index = int(color_index)
+        result = self.color_cache.get(color_index)
+        if result is None:
+            if color_index < 0:
+                result = (None, None)
+            else:
+                color_array = color_list.indexed_color(color_index)
+                result = (color_list.rgbhtml(color_array), color_array)
+            self.color_cache[color_index] = result
+        return result
+
+    def save(self, path):
+        """
+        Save nodes, links and any derived tracks, lineages, offsets and colors
+        to a numpy .npz file (see Forest.load).
+        """
+        state = self.arrays.save_state()
+        layout = self.layout
+        info = dict(
+            source=self.source,
+            resolved=(self.id_to_lineage is not None),
+            colorize=self.colorize,
+            start_at=None,
+            label_bounds={str(o): (None if b is None else np.asarray(b).tolist()) for (o, b) in self.label_bounds.items()},
+        )
+        if layout is not None:
+            info["start_at"] = layout["start_at"]
+            state["layout_roots"] = np.array(layout["roots"], dtype=INDEX_TYPE)
+            state["layout_widths"] = np.array(layout["widths"], dtype=np.int64)
+        state["forest"] = np.array(json.dumps(info))
+        # write to a temporary file first so a crash never leaves a partial file.
+        temp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(temp_path, "wb") as f:
+            np.savez(f, **state)
+        os.replace(temp_path, path)
+        self.saved_path = path
+
+    @classmethod
+    def load(cls, path):
+        """
+        Forest saved by Forest.save.  Node ids, the id to track and lineage mappings
+        and the layout order are only built when first needed.
+        """
+        with np.load(path) as data:
+            state = {name: data[name] for name in data.files}
+        info = json.loads(str(state["forest"]))
+        result = cls()
+        result.arrays = NodeArrays.load_state(state)
+        result.source = info["source"]
+        for ordinal in np.unique(result.arrays.ordinal).tolist():
+            result.get_or_add_timestamp(ordinal)
+        layout_arguments = None
+        if info["start_at"] is not None:
+            layout_arguments = (state["layout_roots"], state["layout_widths"], info["start_at"])
+        if info["resolved"] or layout_arguments is not None:
+            for name in Forest.LAZY_ATTRIBUTES:
+                result.__dict__.pop(name, None)
+            result.pending_index = (info["resolved"], layout_arguments)
+        result.colorize = info["colorize"]
+        for (o, b) in info.get("label_bounds", {}).items():
+            result.label_bounds[int(o)] = None if b is None else np.array(b, dtype=np.int64)
+        result.saved_path = path
+        return result
+
+    def load_image_for_timestamp(self, ts_ordinal, region=None):
+        """
+        Image volume for ts_ordinal, or only region ((start, end) per axis).
+        Loaders without region support (see volume_cache.supports_region) load the whole volume.
+        """
         loader = self.image_volume_loader
         assert loader is not None, "No loader for images defined."
-        return loader(ts_ordinal)
+        return volume_cache.load_volume(loader, ts_ordinal, region)
 
-    def load_labels_for_timestamp(self, ts_ordinal):
+    def load_labels_for_timestamp(self, ts_ordinal, region=None):
+        "Label volume for ts_ordinal, or only region ((start, end) per axis) like load_image_for_timestamp."
         loader = self.label_volume_loader
         assert loader is not None, "No loader for labels defined."
-        return loader(ts_ordinal)
+        return volume_cache.load_volume(loader, ts_ordinal, region)
 
     def load_klb_using_file_patterns(
         self,
         image_pattern="klbOut_Cam_Long_%(ordinal)05d.crop.klb",  # eg
         label_pattern="klbOut_Cam_Long_%(ordinal)05d.crop_cp_masks.klb", # eg
     ):
-        def img_loader(ordinal, pattern=image_pattern):
-            import pyklb
-            #subs = {"ordinal": ordinal}
-            subs = {"ordinal": ordinal}  # files are zero based?
-            path = pattern % subs
-            if os.path.exists(path):
-                return pyklb.readfull(path)
-            else:
-                return None  # no data for this timeslice.
-        def label_loader(ordinal):
-            return img_loader(ordinal, label_pattern)
-        self.image_volume_loader = img_loader
-        self.label_volume_loader = label_loader
+        # module level loader objects can be sent to worker processes.
+        self.image_volume_loader = KlbPatternLoader(image_pattern)
+        self.label_volume_loader = KlbPatternLoader(label_pattern)
+        self.image_pattern = image_pattern
+        self.label_pattern = label_pattern
+        self.loaders_changed()
+
+    def load_tiff_using_file_patterns(self, image_pattern, label_pattern):
+        self.image_volume_loader = TiffPatternLoader(image_pattern)
+        self.label_volume_loader = TiffPatternLoader(label_pattern)
         self.image_pattern = image_pattern
         self.label_pattern = label_pattern
+        self.loaders_changed()
+
+    def convert_volumes_to_block_stores(self, image_store_dir, label_store_dir, chunk_shape=block_store.DEFAULT_CHUNK_SHAPE, level=1):
+        """
+        Rewrite the volumes from the installed loaders (for example KLB or TIFF files)
+        for all timestamps into chunked block stores and read from the stores from now on.
+        """
+        assert self.image_volume_loader is not None and self.label_volume_loader is not None, (
+            "Install volume loaders to convert.")
+        ordinals = sorted(self.ordinal_to_timestamp.keys())
+        block_store.convert_series(volume_cache.uncached(self.image_volume_loader), ordinals, image_store_dir, chunk_shape, level)
+        block_store.convert_series(volume_cache.uncached(self.label_volume_loader), ordinals, label_store_dir, chunk_shape, level)
+        self.load_block_stores(image_store_dir, label_store_dir)
+
+    def load_block_stores(self, image_store_dir, label_store_dir):
+        "Read volumes from block stores written by convert_volumes_to_block_stores (supports region reads)."
+        self.image_volume_loader = block_store.BlockStoreLoader(image_store_dir)
+        self.label_volume_loader = block_store.BlockStoreLoader(label_store_dir)
+        self.loaders_changed()
 
     def use_trivial_null_loaders(self):
-        def null_loader(ordinal):
-            return None
         self.image_volume_loader = null_loader
         self.label_volume_loader = null_loader
-        
+        self.loaders_changed()
+
+    def loaders_changed(self):
+        "Call after installing new volume loaders."
+        self.label_inventory_cache = {}
+        if self.volume_cache is not None:
+            self.use_volume_cache(cache=self.volume_cache)
+
+    def use_volume_cache(self, budget_bytes=volume_cache.DEFAULT_BUDGET, cache=None):
+        """
+        Keep volumes from the installed image and label loaders in a shared LRU volume_cache.VolumeCache
+        (a new cache limited to budget_bytes unless cache is given).  Returns the cache.
+        """
+        assert self.image_volume_loader is not None and self.label_volume_loader is not None, (
+            "Install volume loaders before caching them.")
+        if cache is None:
+            cache = volume_cache.VolumeCache(budget_bytes)
+        self.volume_cache = cache
+        self.image_volume_loader = volume_cache.CachedLoader(volume_cache.uncached(self.image_volume_loader), cache)
+        self.label_volume_loader = volume_cache.CachedLoader(volume_cache.uncached(self.label_volume_loader), cache)
+        return cache
 
-    def check_labels(self, trivial=True):
+    def check_labels(self, trivial=True, workers=None, verbose=False):
         """
         Check for existence of label files for timestamps
         and whether the labels for the timestamps match the labels in the label volume.
+        Volumes are checked in parallel on a process pool (workers=1 checks in process).
+        Returns a report dictionary:
+
+        - ordinals: ordinal -> dict(ordinal, has_volume, and unless trivial: shape,
+          labels_missing_in_lineage, labels_missing_in_volume, voxel_counts {label: voxels}, match)
+        - missing_volumes: ordinals without a label volume
+        - mismatched: ordinals whose volume labels differ from the lineage labels
         """
         o2t = self.ordinal_to_timestamp
-        for ordinal in sorted(o2t.keys()):
-            volume = self.load_labels_for_timestamp(ordinal)
-            if volume is None:
-                print("No volume file for", ordinal)
-            elif not trivial:
-                ts = o2t[ordinal]
-                ts_labels = set(ts.label_to_node.keys())
-                volume_labels = set(np.unique(volume)) - set([0])
-                volume_missing = sorted(ts_labels - volume_labels)
-                ts_missing = sorted(volume_labels - ts_labels)
-                if volume_missing or ts_missing:
+        ordinals = sorted(o2t.keys())
+        inventories = self.label_inventories(ordinals, counts=not trivial, workers=workers)
+        report = dict(ordinals={}, missing_volumes=[], mismatched=[])
+        for ordinal in ordinals:
+            inventory = inventories[ordinal]
+            entry = report["ordinals"][ordinal] = dict(ordinal=ordinal, has_volume=inventory is not None)
+            if inventory is None:
+                report["missing_volumes"].append(ordinal)
+                if verbose:
+                    print("No volume file for", ordinal)
+                continue
+            if trivial:
+                continue
+            (shape, labels, counts) = inventory
+            ts_labels = self.arrays.label[o2t[ordinal].node_indices()]
+            volume_labels = labels[labels != 0]
+            ts_missing = np.setdiff1d(volume_labels, ts_labels).tolist()
+            volume_missing = np.setdiff1d(ts_labels, volume_labels).tolist()
+            entry.update(
+                shape=list(shape),
+                labels_missing_in_lineage=ts_missing,
+                labels_missing_in_volume=volume_missing,
+                voxel_counts=dict(zip(labels.tolist(), counts.tolist())),
+                match=not (ts_missing or volume_missing),
+            )
+            if not entry["match"]:
+                report["mismatched"].append(ordinal)
+                if verbose:
                     print("ts ordinal", ordinal)
                     print("     labels missing in lineage", ts_missing)
                     print("     labels missing in volume", volume_missing)
-                else:
-                    pass
-                    #print("    labels match.")
+        return report
+
+    def label_inventories(self, ordinals, counts=True, workers=None):
+        """
+        ordinal -> (shape, present labels, voxel counts) for the label volumes of ordinals,
+        or None where there is no volume (shape only if counts is false).
+        Inventories with counts are remembered for the session.
+        """
+        cache = self.label_inventory_cache
+        result = {}
+        todo = []
+        for ordinal in ordinals:
+            if ordinal in cache:
+                result[ordinal] = cache[ordinal]
+            else:
+                todo.append(ordinal)
+        inventories = self.map_label_volumes(label_inventory, todo, workers, counts)
+        for (ordinal, inventory) in zip(todo, inventories):
+            result[ordinal] = inventory
+            if counts:
+                cache[ordinal] = inventory
+        return result
+
+    def map_label_volumes(self, function, ordinals, workers=None, *args):
+        """
+        [function(label loader, ordinal, *args) for ordinal in ordinals] computed in parallel
+        on a process pool (a thread pool if the loader can't be pickled; in process if workers=1).
+        """
+        loader = self.label_volume_loader
+        assert loader is not None, "No loader for labels defined."
+        executor = None
+        if ordinals and (workers is None or workers > 1):
+            try:
+                pickle.dumps(loader)
+            except Exception:
+                # closures can't be sent to processes; numpy releases the GIL for much of the work.
+                executor = ThreadPoolExecutor(max_workers=workers)
+            else:
+                executor = ProcessPoolExecutor(max_workers=workers)
+        if executor is None:
+            return [function(loader, ordinal, *args) for ordinal in ordinals]
+        n = len(ordinals)
+        with executor:
+            return list(executor.map(function, [loader] * n, ordinals, *[[a] * n for a in args]))
+
+    def compute_label_bounds(self, ordinals=None, workers=None):
+        """
+        Scan label volumes (in parallel like check_labels) for the bounding box of their nonzero labels.
+        By default only timestamps without bounds are scanned.  Returns self.label_bounds.
+        """
+        if ordinals is None:
+            ordinals = self.missing_label_bounds()
+        for (ordinal, bounds) in zip(ordinals, self.map_label_volumes(label_bounds, ordinals, workers)):
+            self.label_bounds[ordinal] = bounds
+        return self.label_bounds
+
+    def missing_label_bounds(self):
+        "Ordinals of timestamps without computed label bounds."
+        return [o for o in sorted(self.ordinal_to_timestamp) if o not in self.label_bounds]
+
+    def crop_region(self):
+        """
+        Union of the label bounds of all timestamps as (start, end) per axis, a crop shared by every timestamp,
+        or None unless compute_label_bounds has covered every timestamp (a partial union could cut off labels).
+        """
+        if self.missing_label_bounds():
+            return None
+        bounds = [b for b in self.label_bounds.values() if b is not None]
+        if not bounds:
+            return None
+        bounds = np.array(bounds, dtype=np.int64)
+        return np.stack([bounds[:, :, 0].min(axis=0), bounds[:, :, 1].max(axis=0)], axis=1)
 
     def assign_colors_to_lineages(self):
         return self.assign_colors_to_tracks(id_to_collection=self.id_to_lineage)
@@ -333,66 +695,202 @@ class Forest:
     def assign_colors_to_tracks(self, id_to_collection=None):
         if id_to_collection is None:
             id_to_collection = self.id_to_track
-        for (index, identifier) in enumerate(sorted(id_to_collection.keys())):
-            collection = id_to_collection[identifier]
-            color_array = color_list.indexed_color(index + 1)
-            color = color_list.rgbhtml(color_array)
-            for node in collection.id_to_node.values():
-                node.color = color
-                node.color_array = color_array
+        arrays = self.arrays
+        collections = [id_to_collection[identifier] for identifier in sorted(id_to_collection.keys())]
+        if not collections:
+            return
+        roots = np.array([c.root.index for c in collections], dtype=INDEX_TYPE)
+        root_color = np.full((len(arrays),), -1, dtype=np.int32)
+        root_color[roots] = np.arange(1, len(roots) + 1)
+        self.colorize = collections[0].group_array
+        group = getattr(arrays, self.colorize)
+        grouped = (group != NO_INDEX)
+        arrays.color_index[grouped] = root_color[group[grouped]]
+        self.layout_changed()
 
     def find_tracks_and_lineages(self):
+        "Resolve track and lineage roots for all nodes at once."
         self.reset()
-        i2l = {}
-        i2t = {}
-        for node in self.id_to_node.values():
-            tr = node.track_ancestor()
-            ln = node.lineage_ancestor()
-            #print(node, tr, ln)
-            i2t[tr.node_id] = Track(tr)
-            i2l[ln.node_id] = Lineage(ln)
-        for node in self.id_to_node.values():
-            tr = node.track_ancestor()
-            ln = node.lineage_ancestor()
-            i2t[tr.node_id].add_node(node)
-            i2l[ln.node_id].add_node(node)
-        self.id_to_lineage = i2l
-        self.id_to_track = i2t
+        forest_arrays.resolve_roots(self.arrays)
+        self.index_tracks_and_lineages()
+
+    def index_tracks_and_lineages(self):
+        "Build the Track and Lineage views and track order from resolved track and lineage arrays."
+        arrays = self.arrays
+        ids = arrays.ids
+        self.id_to_lineage = {ids[r]: Lineage(Node(self, r)) for r in np.unique(arrays.lineage).tolist()}
+        track_roots = np.unique(arrays.track)
         # fix track ordering
-        s_ids = sorted(i2t.keys())
-        for (i, tid) in enumerate(s_ids):
-            tr = i2t[tid]
-            tr.set_index(i)
-        self.track_order = [i2t[tid] for tid in s_ids]
+        track_roots = track_roots[np.argsort(arrays.id_rank()[track_roots])]
+        track_position = np.zeros((len(arrays),), dtype=np.int32)
+        track_position[track_roots] = np.arange(len(track_roots))
+        arrays.lineage_index[:] = track_position[arrays.track]
+        self.track_roots = track_roots.tolist()
+        self.track_ids = [ids[r] for r in self.track_roots]
+        self.track_order = [Track(Node(self, r)) for r in self.track_roots]
+        self.id_to_track = dict(zip(self.track_ids, self.track_order))
 
     def assign_offsets(self, start_at=0):
         i2l = self.id_to_lineage
         assert i2l is not None, "lineages must be assigned first."
-        cursor = start_at
-        # assign isolated lineages after all non-isolated
-        for rootid in i2l.keys():
-            # mark isolated nodes for downstream testing
-            lineage = i2l[rootid]
-            lineage.mark_isolated()
-        isolated_roots = []
-        for rootid in sorted(i2l.keys()):
-            if lineage.isolated():
-                isolated_roots.append(rootid)
+        arrays = self.arrays
+        # mark isolated nodes for downstream testing
+        lineage_sizes = np.bincount(arrays.lineage, minlength=len(arrays))
+        isolated = lineage_sizes < 2
+        arrays.isolated[:] = isolated[arrays.lineage]
+        # assign isolated lineages after all non-isolated, each group in node id order.
+        # (the original loop tested the previous iteration's lineage for isolation, so some
+        # isolated lineages were placed among the others; they now always come last.)
+        roots = np.unique(arrays.lineage)
+        roots = roots[np.lexsort((arrays.id_rank()[roots], isolated[roots]))]
+        end = forest_arrays.layout_offsets(arrays, roots, start_at)
+        # remember the cursor span of each lineage for incremental edits.
+        starts = np.full((len(arrays),), np.inf)
+        np.minimum.at(starts, arrays.lineage, arrays.offset)
+        widths = np.diff(np.append(starts[roots], end + 1)).astype(np.int64)
+        self.remember_layout(roots, widths, start_at)
+
+    def remember_layout(self, roots, widths, start_at):
+        "Record the lineage layout order (roots) and the cursor width of each lineage."
+        arrays = self.arrays
+        ids = arrays.ids
+        isolated = arrays.isolated
+        roots = np.asarray(roots).tolist()
+        self.layout = dict(
+            start_at=start_at,
+            keys=[(bool(isolated[r] == 1), ids[r]) for r in roots],
+            roots=roots,
+            widths=np.asarray(widths).tolist(),
+        )
+        self.layout_changed()
+
+    def layout_starts(self):
+        layout = self.layout
+        widths = np.array(layout["widths"], dtype=np.int64)
+        return layout["start_at"] + np.cumsum(widths) - widths
+
+    def link(self, parent_id, child_id):
+        """
+        Make child_id a child of parent_id (detaching it from any previous parent).
+        Returns the sorted ids of nodes whose tracks, lineages, offsets or colors changed.
+        """
+        arrays = self.arrays
+        child = Node(self, arrays.index(child_id))
+        child.set_parent(Node(self, arrays.index(parent_id)))
+        return self.last_changed_ids
+
+    def unlink(self, child_id):
+        "Detach child_id from its parent.  Returns the sorted ids of changed nodes."
+        return self.relink_indices(self.arrays.index(child_id), NO_INDEX)
+
+    def relink_indices(self, child, parent):
+        "Set the parent of node index child (NO_INDEX to detach) and maintain the layout."
+        arrays = self.arrays
+        old_roots = set([arrays.lineage[child], arrays.lineage[parent] if parent != NO_INDEX else NO_INDEX])
+        if parent == NO_INDEX:
+            arrays.unlink(child)
+        else:
+            arrays.link(parent, child)
+        return self.update_layout(old_roots - set([NO_INDEX]))
+
+    def update_layout(self, old_roots, added=()):
+        """
+        Incrementally maintain tracks, lineages, offsets and colors after an edit touching
+        the lineages rooted at old_roots (and newly added node indices).
+        Only the affected lineages are resolved and laid out again; following lineages are shifted.
+        Returns (and remembers as last_changed_ids) the sorted ids of changed nodes.
+        """
+        self.layout_changed()
+        layout = self.layout
+        if layout is None:
+            if self.id_to_lineage is not None:
+                # tracks without a layout are simply recomputed on demand.
+                self.reset()
+            self.last_changed_ids = []
+            return []
+        arrays = self.arrays
+        ids = arrays.ids
+        n = len(arrays)
+        old_roots = np.array(sorted(old_roots), dtype=INDEX_TYPE)
+        members = np.nonzero(np.isin(arrays.lineage, old_roots))[0]
+        members = np.union1d(members, np.asarray(added, dtype=INDEX_TYPE)).astype(INDEX_TYPE)
+        changed = np.zeros((n,), dtype=bool)
+        changed[members] = True
+        old_tracks = np.unique(arrays.track[members])
+        old_tracks = old_tracks[old_tracks != NO_INDEX]
+        # remove the old lineages from the layout order.
+        old_starts = self.layout_starts()
+        shift = np.zeros((n,), dtype=np.float64)
+        shift[layout["roots"]] = -old_starts
+        for root in old_roots.tolist():
+            key = (bool(arrays.isolated[root] == 1), ids[root])
+            position = bisect_left(layout["keys"], key)
+            assert layout["roots"][position] == root, "layout out of order: " + repr(key)
+            for name in ("keys", "roots", "widths"):
+                del layout[name][position]
+            del self.id_to_lineage[ids[root]]
+        # resolve and lay out the new lineages from cursor 0 and insert them in order.
+        forest_arrays.resolve_roots(arrays, members)
+        lineages = arrays.lineage[members]
+        new_roots = np.unique(lineages)
+        for root in new_roots.tolist():
+            lineage_members = members[lineages == root]
+            end = forest_arrays.layout_offsets(arrays, [root], 0, lineage_members)
+            isolated = len(lineage_members) < 2
+            arrays.isolated[lineage_members] = isolated
+            key = (isolated, ids[root])
+            position = bisect_left(layout["keys"], key)
+            layout["keys"].insert(position, key)
+            layout["roots"].insert(position, root)
+            layout["widths"].insert(position, end + 1)
+            self.id_to_lineage[ids[root]] = Lineage(Node(self, root))
+        new_starts = self.layout_starts()
+        shift[layout["roots"]] += new_starts
+        # recomputed lineages were laid out from 0.
+        positions = [bisect_left(layout["keys"], (bool(arrays.isolated[r]), ids[r])) for r in new_roots.tolist()]
+        shift[new_roots] = new_starts[positions]
+        node_shift = shift[arrays.lineage]
+        arrays.offset[:] += node_shift
+        changed |= (node_shift != 0)
+        # track order and indices
+        (track_ids, track_roots) = (self.track_ids, self.track_roots)
+        for root in old_tracks.tolist():
+            position = bisect_left(track_ids, ids[root])
+            for collection in (track_ids, track_roots, self.track_order):
+                del collection[position]
+            del self.id_to_track[ids[root]]
+        for root in np.unique(arrays.track[members]).tolist():
+            position = bisect_left(track_ids, ids[root])
+            tr = Track(Node(self, root))
+            track_ids.insert(position, ids[root])
+            track_roots.insert(position, root)
+            self.track_order.insert(position, tr)
+            self.id_to_track[ids[root]] = tr
+        track_position = np.zeros((n,), dtype=np.int32)
+        track_position[track_roots] = np.arange(len(track_roots))
+        lineage_index = track_position[arrays.track]
+        changed |= (lineage_index != arrays.lineage_index)
+        arrays.lineage_index[:] = lineage_index
+        # colors
+        if self.colorize is not None:
+            old_colors = arrays.color_index.copy()
+            if self.colorize == "track":
+                # track colors follow the track order.
+                arrays.color_index[:] = arrays.lineage_index + 1
+                self.layout_changed()
             else:
-                lineage = i2l[rootid]
-                cursor = lineage.root.assign_offsets(cursor) + 1
-        # set isolated offsets higher...
-        for rootid in isolated_roots:
-            lineage = i2l[rootid]
-            cursor = lineage.root.assign_offsets(cursor) + 1
+                self.assign_colors_to_lineages()
+            changed |= (old_colors != arrays.color_index)
+        result = self.last_changed_ids = sorted(ids[i] for i in np.nonzero(changed)[0].tolist())
+        return result
 
     def add_node(self, node_id, ordinal, label=None):
-        i2n = self.id_to_node
-        assert node_id not in i2n, "duplicate node added: " + repr([node_id, ordinal, label])
         ts = self.get_or_add_timestamp(ordinal)
-        n = Node(node_id, ordinal, label)
-        i2n[node_id] = n 
+        n = Node(self, self.arrays.append(node_id, ordinal, label))
         ts.add_node(n)
+        if self.layout is not None:
+            # a new node is an isolated lineage of its own.
+            self.update_layout([], [n.index])
         return n
 
     def get_or_add_timestamp(self, ordinal):
@@ -400,30 +898,93 @@ class Forest:
         if ordinal in i2t:
             result = i2t[ordinal]
         else:
-            result = i2t[ordinal] = TimeStamp(ordinal)
+            result = i2t[ordinal] = TimeStamp(self, ordinal)
         return result
 
+    def node_json_objects(self, indices):
+        "Node.json_object() for each node index, computed column by column."
+        arrays = self.arrays
+        ids = arrays.ids
+        indices = np.asarray(indices, dtype=INDEX_TYPE)
+        parents = arrays.parent[indices]
+        isolated = (parents == NO_INDEX) & (arrays.n_children[indices] < 1)
+        colors = [self.indexed_color(c)[0] for c in arrays.color_index[indices].tolist()]
+        columns = zip(
+            indices.tolist(),
+            arrays.ordinal[indices].tolist(),
+            arrays.label[indices].tolist(),
+            colors,
+            arrays.offset[indices].tolist(),
+            parents.tolist(),
+            isolated.tolist(),
+        )
+        return [
+            dict(
+                identity=ids[index],
+                timestamp_ordinal=ordinal,
+                label=None if label == NO_LABEL else label,
+                color=color,
+                offset=offset_value(offset),
+                parent_id=None if parent == NO_INDEX else ids[parent],
+                isolated=isolate,
+            )
+            for (index, ordinal, label, color, offset, parent, isolate) in columns
+        ]
+
     def json_ob(self, exclude_isolated=True):
         (width, height) = self.dimensions()
-        id_to_node = self.id_to_node
+        indices = np.arange(len(self.arrays), dtype=INDEX_TYPE)
         if exclude_isolated:
-            id_to_node = {ident: node for (ident, node) in self.id_to_node.items() if not node._is_isolated}
-        id_to_node_json = {ident: node.json_object() for (ident, node) in id_to_node.items()}
+            indices = indices[self.arrays.isolated != 1]
+        id_to_node_json = {json_ob["identity"]: json_ob for json_ob in self.node_json_objects(indices)}
         return dict(
             width=width,
             height=height,
             id_to_node=id_to_node_json,
         )
 
+    def region_index(self):
+        """
+        Dense index used by timestamp_region_json, rebuilt when the forest or its layout changes:
+        nodes ordered by ordinal with the distinct ordinals and their run starts,
+        the farthest parent ordinal for each ordinal, the rank of each node offset,
+        and the memoized region JSON by ordinal.
+        """
+        arrays = self.arrays
+        index = self._region_index
+        if index is not None and index["version"] == arrays.version:
+            return index
+        (order, ordinals, starts) = arrays.ordinal_index()
+        ordinal = arrays.ordinal
+        node_position = np.searchsorted(ordinals, ordinal)
+        farthest = ordinals.copy()
+        linked = np.nonzero(arrays.parent != NO_INDEX)[0]
+        np.minimum.at(farthest, node_position[linked], ordinal[arrays.parent[linked]])
+        (offsets, offset_rank) = np.unique(arrays.offset, return_inverse=True)
+        index = self._region_index = dict(
+            version=arrays.version,
+            order=order,
+            ordinals=ordinals,
+            starts=starts,
+            ordinal_position={o: i for (i, o) in enumerate(ordinals.tolist())},
+            node_position=node_position,
+            farthest=farthest,
+            offset_rank=offset_rank.ravel(),
+            regions={},
+        )
+        return index
+
     def timestamp_region_json(self, ordinal):
         """
         Node info for nodes in timestamp, its predecessor and all directly connected ancestor timestamps.
         """
         # always include isolated nodes (?)
-        o2t = self.ordinal_to_timestamp
-        ordinals = set([ordinal])
-        all_ordinals = sorted(o2t.keys())
-        if ordinal not in all_ordinals:
+        index = self.region_index()
+        regions = index["regions"]
+        if ordinal in regions:
+            return regions[ordinal]
+        position = index["ordinal_position"].get(ordinal)
+        if position is None:
             # hack boundary case
             return dict(
                 id_to_node={},
@@ -431,46 +992,37 @@ class Forest:
                 height=1,
                 ordinals=[],
             )
-        index = all_ordinals.index(ordinal)
-        if index > 0:
-            pred = all_ordinals[index - 1]
-            # always add any pred timestamp
-            ordinals.add(pred)
-        ts = o2t[ordinal]
-        farthest = ts.farthest_parent_ordinal()
-        # also add directly connected older timestamps
-        for ord in all_ordinals:
-            if (ord <= ordinal) and (ord >= farthest):
-                ordinals.add(ord)
-        # dump nodes and adjust geometry
-        id_to_node = {}
-        for ord in ordinals:
-            this_ts = o2t[ord]
-            #print("updating", list(this_ts.id_to_node.keys()))
-            id_to_node.update(this_ts.id_to_node)
-        id_to_node_json = {}
-        offsets = sorted(set(node._offset for node in id_to_node.values()))
-        sordinals = sorted(ordinals)
+        ordinals = index["ordinals"]
+        # directly connected older timestamps and always any pred timestamp
+        first = int(np.searchsorted(ordinals, index["farthest"][position]))
+        if position > 0:
+            first = min(first, position - 1)
+        starts = index["starts"]
+        nodes = index["order"][starts[first]: starts[position + 1]]
+        sordinals = ordinals[first: position + 1].tolist()
         height = len(sordinals)
-        for (id, node) in id_to_node.items():
-            json_ob = node.json_object()
-            # patch in relative geometry
-            json_ob["x"] = offsets.index(node._offset)
-            json_ob["y"] = height - sordinals.index(node.timestamp_ordinal) - 1
+        # relative geometry
+        (ranks, xs) = np.unique(index["offset_rank"][nodes], return_inverse=True)
+        ys = height - 1 - (index["node_position"][nodes] - first)
+        id_to_node_json = {}
+        for (json_ob, x, y) in zip(self.node_json_objects(nodes), xs.ravel().tolist(), ys.tolist()):
+            json_ob["x"] = x
+            json_ob["y"] = y
             # child marker
             json_ob["is_child"] = (json_ob["timestamp_ordinal"] == ordinal)
-            id_to_node_json[id] = json_ob
-        return dict(
+            id_to_node_json[json_ob["identity"]] = json_ob
+        result = regions[ordinal] = dict(
             id_to_node=id_to_node_json,
-            width=len(offsets),
+            width=len(ranks),
             height=height,
             ordinals=sordinals,
         )
+        return result
 
     def dimensions(self):
         # assuming timestamps start at 0 or 1
         height = max(self.ordinal_to_timestamp.keys()) + 1
-        width = max(n._offset for n in self.id_to_node.values()) + 1
+        width = offset_value(np.nanmax(self.arrays.offset)) + 1
         return (width, height)
 
 def make_forest_from_haydens_json_graph(json_graph):
@@ -514,4 +1066,175 @@ def make_forest_from_haydens_json_graph(json_graph):
         parent.set_child(child)
     return result
 
+class KlbPatternLoader:
+
+    "Load the KLB volume for an ordinal from a file name pattern (None if there is no file)."
+
+    supports_region = True
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def path(self, ordinal):
+        subs = {"ordinal": ordinal}  # files are zero based?
+        return self.pattern % subs
+
+    def __call__(self, ordinal, region=None):
+        import pyklb
+        path = self.path(ordinal)
+        if os.path.exists(path):
+            if region is None:
+                return pyklb.readfull(path)
+            region = block_store.clip_region(region, pyklb.readheader(path)["imagesize_tczyx"][-3:])
+            # readroi bounds are inclusive.
+            return pyklb.readroi(path, region[:, 0], region[:, 1] - 1)
+        else:
+            return None  # no data for this timeslice.
+
+class TiffPatternLoader(KlbPatternLoader):
 
+    "Load the 3d TIFF stack for an ordinal from a file name pattern (None if there is no file)."
+
+    def __call__(self, ordinal, region=None):
+        import tifffile
+        path = self.path(ordinal)
+        if not os.path.exists(path):
+            return None
+        if region is None:
+            return tifffile.imread(path)
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            region = block_store.clip_region(region, series.shape)
+            ((im, iM), (jm, jM), (km, kM)) = region.tolist()
+            if series.dataoffset is not None:
+                # uncompressed and contiguous: only the pages of the region are touched.
+                mapped = tifffile.memmap(path, mode="r")
+                result = np.array(mapped[im:iM, jm:jM, km:kM])
+                del mapped
+                return result
+            result = np.zeros((iM - im, jM - jm, kM - km), dtype=series.dtype)
+            for i in range(im, iM):
+                result[i - im] = series.pages[i].asarray()[jm:jM, km:kM]
+            return result
+
+def null_loader(ordinal, region=None):
+    return None
+
+def label_bounds(loader, ordinal):
+    """
+    (start, end) per axis bounding the nonzero voxels of loader(ordinal), or None if it is missing or empty.
+    Like operations3d.positive_slicing the start is one voxel before the first nonzero voxel (if possible)
+    and the end just after the last, so the crop matches the one the viewer used before bounds existed.
+    """
+    volume = loader(ordinal)
+    if volume is None:
+        return None
+    jk = volume.any(axis=0)
+    bounds = np.zeros((3, 2), dtype=np.int64)
+    for (axis, present) in enumerate([volume.any(axis=(1, 2)), jk.any(axis=1), jk.any(axis=0)]):
+        (present,) = np.nonzero(present)
+        if not len(present):
+            return None
+        bounds[axis] = (max(present[0] - 1, 0), present[-1] + 1)
+    return bounds
+
+def label_inventory(loader, ordinal, counts=True):
+    """
+    (shape, labels, voxel counts) for the labels present in loader(ordinal) or None if there is no volume.
+    Counts use a bincount rather than sorting the volume.  With counts false labels and counts are None.
+    """
+    volume = loader(ordinal)
+    if volume is None:
+        return None
+    if not counts:
+        return (volume.shape, None, None)
+    flat = volume.ravel()
+    if flat.dtype.kind in "ui" and flat.size and flat.min() >= 0:
+        voxels = np.bincount(flat)
+        labels = np.nonzero(voxels)[0]
+        return (volume.shape, labels, voxels[labels])
+    # float or negative labels
+    (labels, voxels) = np.unique(flat, return_counts=True)
+    return (volume.shape, labels, voxels)
+
+def parse_node_ids(node_ids):
+    "Timestamp ordinals and labels for a batch of 'ts_label' node id strings."
+    values = np.array(",".join(node_ids).replace("_", ",").split(","), dtype=np.int64)
+    assert len(values) == 2 * len(node_ids), "bad node ids in batch: " + repr(node_ids[:10])
+    return (values[0::2], values[1::2])
+
+def stream_forest_from_haydens_json_file(json_path, batch_size=100000):
+    """
+    Read a MATLAB graph JSON file similar to "Gata6Nanog1.json" incrementally.
+    The Nodes and Edges arrays are parsed in batches straight into the forest arrays
+    without loading the whole document.  Like make_forest_from_haydens_json_graph
+    the last graph in the file is used.  Return a forest.
+    """
+    result = None
+
+    def add_missing(result, node_ids):
+        # add nodes not seen before (edges may precede nodes in the file).
+        arrays = result.arrays
+        i2i = arrays.id_to_index
+        missing = list(dict.fromkeys(node_id for node_id in node_ids if node_id not in i2i))
+        if missing:
+            (ordinals, labels) = parse_node_ids(missing)
+            arrays.extend(missing, ordinals, labels)
+            for ordinal in np.unique(ordinals).tolist():
+                result.get_or_add_timestamp(ordinal)
+
+    with open(json_path) as f:
+        stream = JsonStream(f)
+        for name in stream.object_keys():
+            if not (name.startswith("G") and stream.peek() == "{"):
+                stream.value()
+                continue
+            # a later graph replaces any earlier one.
+            result = Forest()
+            arrays = result.arrays
+            for part in stream.object_keys():
+                if part == "Nodes":
+                    for batch in stream.array_batches(batch_size):
+                        add_missing(result, [thing["Name"] for thing in batch])
+                elif part == "Edges":
+                    for batch in stream.array_batches(batch_size):
+                        parent_ids = [thing["EndNodes"][0] for thing in batch]
+                        child_ids = [thing["EndNodes"][1] for thing in batch]
+                        add_missing(result, parent_ids + child_ids)
+                        i2i = arrays.id_to_index
+                        parents = np.array([i2i[i] for i in parent_ids], dtype=INDEX_TYPE)
+                        children = np.array([i2i[i] for i in child_ids], dtype=INDEX_TYPE)
+                        assert np.all(arrays.ordinal[children] > arrays.ordinal[parents]), (
+                            "Bad Node parent in edges: " + repr(name))
+                        arrays.link_many(parents, children)
+                else:
+                    stream.value()
+    if result is None:
+        raise ValueError("Could not find graph in: " + repr(json_path))
+    return result
+
+def source_signature(path):
+    "Identify a source file version by absolute path, size and modification time."
+    stat = os.stat(path)
+    return dict(path=os.path.abspath(path), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+def load_forest_from_haydens_json_file(json_path, cache_path=None):
+    """
+    Forest for a MATLAB graph JSON file like "Combined.json" with tracks, lineages and offsets assigned.
+    The forest is cached in binary form at cache_path (default json_path + ".forest.npz")
+    and rebuilt automatically when the JSON file changes.
+    """
+    if cache_path is None:
+        cache_path = json_path + ".forest.npz"
+    source = source_signature(json_path)
+    if os.path.exists(cache_path):
+        forest = Forest.load(cache_path)
+        if forest.source == source:
+            return forest
+        print("Rebuilding", cache_path, "for changed", json_path)
+    forest = stream_forest_from_haydens_json_file(json_path)
+    forest.find_tracks_and_lineages()
+    forest.assign_offsets()
+    forest.source = source
+    forest.save(cache_path)
+    return forest
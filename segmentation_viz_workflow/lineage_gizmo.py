@@ -53,13 +53,19 @@ class LineageDisplay(TimeSliceDetail):
 
     def load_forest(self, forest):
         F = forest
-        F.find_tracks_and_lineages()
-        F.assign_offsets()
+        if F.layout is None:
+            # saved forests may already have a layout.
+            F.find_tracks_and_lineages()
+            F.assign_offsets()
         if self.colorize == "tracks":
             F.assign_colors_to_tracks()
         else:
             F.assign_colors_to_lineages()
-        fjson = F.json_ob()
+        self.refresh_forest(F)
+
+    def refresh_forest(self, forest):
+        "Redisplay the forest after incremental edits (Forest.link/unlink) without a full layout."
+        fjson = forest.json_ob()
         self.load_json(fjson)
 
 async def test_task():
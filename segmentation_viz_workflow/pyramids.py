@@ -0,0 +1,91 @@
+"""
+Multiscale pyramids for label and image volumes.
+
+Level 0 is the volume itself and each following level halves every axis:
+labels by the most common label of each 2x2x2 block and intensities by the block maximum or mean.
+Interactive views rotate and project the coarsest level that still fills the display.
+"""
+
+import numpy as np
+
+MIN_PYRAMID_SIDE = 64
+SLAB = 16  # block rows reduced at once by mode_downsample, bounding temporary memory
+
+
+def even_padded(volume):
+    "volume padded (repeating the last plane) to even length on every axis."
+    pad = [(0, n % 2) for n in volume.shape]
+    if any(p for (unused, p) in pad):
+        volume = np.pad(volume, pad, mode="edge")
+    return volume
+
+
+def mode_downsample(labels):
+    "labels halved on every axis keeping the most common label of each 2x2x2 block (labels win ties with 0)."
+    padded = even_padded(labels)
+    (I, J, K) = [n // 2 for n in padded.shape]
+    result = np.empty((I, J, K), dtype=labels.dtype)
+    for start in range(0, I, SLAB):
+        slab = padded[2 * start: 2 * (start + SLAB)]
+        n = slab.shape[0] // 2
+        blocks = slab.reshape((n, 2, J, 2, K, 2)).transpose((0, 2, 4, 1, 3, 5)).reshape((n, J, K, 8))
+        counts = np.ones(blocks.shape, dtype=np.uint8)
+        for i in range(8):
+            for j in range(i + 1, 8):
+                same = blocks[..., i] == blocks[..., j]
+                counts[..., i] += same
+                counts[..., j] += same
+        score = counts * 2 + (blocks != 0)
+        choice = score.argmax(axis=-1)
+        result[start: start + n] = np.take_along_axis(blocks, choice[..., None], axis=-1)[..., 0]
+    return result
+
+
+def reduce_downsample(image, method="max"):
+    "image halved on every axis by the maximum or mean of each 2x2x2 block."
+    padded = even_padded(image)
+    (I, J, K) = [n // 2 for n in padded.shape]
+    blocks = padded.reshape((I, 2, J, 2, K, 2))
+    if method == "max":
+        return blocks.max(axis=(1, 3, 5))
+    assert method == "mean", "unknown downsampling method: " + repr(method)
+    mean = blocks.mean(axis=(1, 3, 5), dtype=np.float32)
+    if image.dtype.kind in "ui":
+        mean = np.round(mean)
+    return mean.astype(image.dtype)
+
+
+def build_pyramid(volume, downsample, min_side=MIN_PYRAMID_SIDE):
+    "[volume, downsample(volume), ...] halving until the largest axis would drop below min_side."
+    levels = [volume]
+    while max(volume.shape) // 2 >= min_side and min(volume.shape) >= 2:
+        volume = downsample(volume)
+        levels.append(volume)
+    return levels
+
+
+def level_slicing(slicing, level):
+    "Slicing (start, end per axis) of level 0 coordinates in the coordinates of pyramid level."
+    if slicing is None or level == 0:
+        return slicing
+    factor = 2 ** level
+    slicing = np.array(slicing, dtype=np.int64)
+    return np.stack([slicing[:, 0] // factor, -(-slicing[:, 1] // factor)], axis=1)
+
+
+def display_level(shapes, levels, side, slicing=None):
+    """
+    Coarsest pyramid level (below levels) at which the largest sliced extent of the level 0 shapes
+    is still at least side pixels.
+    """
+    extent = 0
+    for shape in shapes:
+        shape = np.array(shape, dtype=np.int64)
+        if slicing is not None:
+            s = np.array(slicing, dtype=np.int64)
+            shape = np.minimum(s[:, 1], shape) - np.clip(s[:, 0], 0, shape)
+        extent = max(extent, int(shape.max()))
+    level = 0
+    while level + 1 < levels and extent // 2 ** (level + 1) >= side:
+        level += 1
+    return level
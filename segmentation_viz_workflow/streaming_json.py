@@ -0,0 +1,131 @@
+"""
+Incremental reading of large JSON documents.
+
+JsonStream reads a file in chunks and decodes one value at a time,
+so arrays with millions of entries can be consumed in batches
+without holding the parsed document in memory.
+"""
+
+import json
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARACTERS = "0123456789.eE+-"
+
+
+class JsonStream:
+
+    def __init__(self, file, chunk_size=1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        "Read another chunk, discarding consumed text.  Return False at end of file."
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        "Next non whitespace character (without consuming it), or None at end of file."
+        while True:
+            buffer = self.buffer
+            position = self.position
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            self.position = position
+            if position < len(buffer):
+                return buffer[position]
+            if not self.fill():
+                return None
+
+    def expect(self, characters):
+        "Consume the next non whitespace character which must be in characters, and return it."
+        c = self.peek()
+        assert c is not None and c in characters, "expected %s at %s, found %s" % (
+            repr(characters), self.position, repr(c))
+        self.position += 1
+        return c
+
+    def value(self):
+        "Decode and consume the next complete JSON value."
+        self.peek()
+        while True:
+            try:
+                (result, end) = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # the value may continue in the next chunk.
+                if not self.fill():
+                    raise
+            else:
+                # a number cut off at the end of the buffer may continue in the next chunk.
+                complete = end < len(self.buffer) and not (
+                    isinstance(result, (int, float)) and self.buffer[end] in NUMBER_CHARACTERS)
+                if complete or not self.fill():
+                    self.position = end
+                    return result
+
+    def object_keys(self):
+        "Iterate over the keys of an object.  The caller must consume each value before the next key."
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def leading_objects(self, limit):
+        """
+        Decode up to about limit complete leading objects of an array in the buffer with one json.loads,
+        consuming them and the comma after the last.  Return [] if none can be decoded this way.
+        """
+        text = self.buffer[self.position:]
+        # an object followed by a comma at depth 0 ends where "}," occurs; other "}," cuts never parse.
+        end = min(len(text), 200 * limit)
+        for attempt in range(3):
+            cut = text.rfind("},", 0, end)
+            if cut < 0:
+                return []
+            try:
+                items = json.loads("[" + text[:cut + 1] + "]")
+            except json.JSONDecodeError as e:
+                # for example the cut was past the end of the array; retry before the error.
+                end = min(cut, e.pos)
+            else:
+                self.position += cut + 2
+                return items
+        return []
+
+    def array_batches(self, batch_size=100000):
+        "Iterate over the items of an array in lists of up to batch_size items."
+        self.expect("[")
+        batch = []
+        if self.peek() == "]":
+            self.position += 1
+        else:
+            while True:
+                items = self.leading_objects(batch_size - len(batch))
+                if items:
+                    batch.extend(items)
+                else:
+                    batch.append(self.value())
+                    if self.expect(",]") == "]":
+                        break
+                # leading_objects may decode a few more items than asked for.
+                while len(batch) >= batch_size:
+                    yield batch[:batch_size]
+                    batch = batch[batch_size:]
+        if batch:
+            yield batch
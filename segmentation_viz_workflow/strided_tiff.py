@@ -0,0 +1,49 @@
+"""
+Read subsampled 3d TIFF stacks without decoding the skipped voxels.
+
+Requires the optional tifffile package.  Callers should fall back to a full read
+when load_strided_tiff_array returns None.
+"""
+
+import numpy as np
+
+
+def load_strided_tiff_array(file_path, stride, counts=None):
+    """
+    Return the 3d stack in file_path subsampled as A[::stride, ::stride, ::stride],
+    or None if tifffile is not available or the file is not a simple 3d stack.
+    Uncompressed contiguous stacks are memory mapped so only the touched pages are read;
+    otherwise only every stride-th page is decoded.
+    If counts (a dictionary) is given counts["bytes_read"] is set to the file bytes of the planes read.
+    """
+    try:
+        import tifffile
+    except ImportError:
+        return None
+    s = stride
+    with tifffile.TiffFile(file_path) as tif:
+        series = tif.series[0]
+        if len(series.shape) != 3:
+            return None
+        if series.dataoffset is not None:
+            # uncompressed and contiguous: copy the strided view out of a memory map.
+            mapped = tifffile.memmap(file_path, mode="r")
+            result = np.array(mapped[::s, ::s, ::s])
+            if counts is not None:
+                counts["bytes_read"] = result.shape[0] * mapped[0].nbytes
+            del mapped
+            return result
+        pages = series.pages
+        (I, J, K) = series.shape
+        if len(pages) != I:
+            return None
+        selected = range(0, I, s)
+        result = np.zeros((len(selected), len(range(0, J, s)), len(range(0, K, s))), dtype=series.dtype)
+        bytes_read = 0
+        for (index, page_index) in enumerate(selected):
+            page = pages[page_index]
+            result[index] = page.asarray()[::s, ::s]
+            bytes_read += int(sum(page.databytecounts))
+        if counts is not None:
+            counts["bytes_read"] = bytes_read
+        return result
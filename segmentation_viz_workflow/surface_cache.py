@@ -0,0 +1,82 @@
+"""
+On disk checkpoint cache for per timestamp surface JSON.
+
+Entries are keyed by the content hash of the label file together with the
+capture parameters (stride, blur, engine, crop padding and output multiplier)
+and the selected labels with their colors, so an entry is reused only if the
+surfaces it holds would be recomputed identically.
+"""
+
+import hashlib
+import json
+import os
+
+
+class SurfaceCache:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.hash_index_path = os.path.join(cache_dir, "file_hashes.json")
+        self.hash_index = {}
+        if os.path.isfile(self.hash_index_path):
+            with open(self.hash_index_path) as f:
+                self.hash_index = json.load(f)
+
+    def file_hash(self, file_path):
+        "sha256 of file content, remembered by (path, size, mtime) to avoid rereading unchanged files."
+        stat = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        signature = [stat.st_size, stat.st_mtime]
+        remembered = self.hash_index.get(path)
+        if remembered is not None and remembered[0] == signature:
+            return remembered[1]
+        h = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        self.hash_index[path] = [signature, digest]
+        self.write_json(self.hash_index_path, self.hash_index)
+        return digest
+
+    def key(self, file_path, stride, blur, engine, label_dict, color_dict, crop_pad=None, multiplier=None):
+        """
+        Cache key for surfaces of the labels in label_dict extracted from file_path.
+        crop_pad is the padding around the labels if the array is cropped (None if not cropped)
+        and multiplier the quantization of the output (None if the engine decides).
+        """
+        description = dict(
+            file_hash=self.file_hash(file_path),
+            stride=stride,
+            blur=blur,
+            engine=engine,
+            crop_pad=crop_pad,
+            multiplier=multiplier,
+            labels=sorted([int(label), str(name)] for (label, name) in label_dict.items()),
+            colors=sorted([int(label), [float(c) for c in color]] for (label, color) in color_dict.items()),
+        )
+        text = json.dumps(description, sort_keys=True)
+        return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        "Cached timestamp JSON for key or None."
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def put(self, key, timestamp_json):
+        self.write_json(self.path(key), timestamp_json)
+
+    def write_json(self, path, json_ob):
+        # write to a temporary file first so a crash never leaves a partial entry.
+        temp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(temp_path, "w") as f:
+            json.dump(json_ob, f)
+        os.replace(temp_path, path)
@@ -0,0 +1,225 @@
+"""
+Writers for surface sequences produced one timestamp at a time.
+
+All writers share the add(timestamp_json) / close() interface:
+
+- JsonSequenceWriter collects the sequence in memory and writes it with one json.dump.
+- StreamingSequenceWriter appends each timestamp to the JSON file as it arrives.
+- BinarySequenceWriter appends quantized typed arrays to a binary file and writes a small JSON manifest.
+
+The streaming writers keep only running extrema in memory.
+"""
+
+import json
+import os
+import numpy as np
+from . import cpu_surfaces
+
+BINARY_FORMAT = "segmentation_viz_workflow.surfaces.v1"
+
+
+class SequenceExtrema:
+
+    "Running sequence level extrema and geometry summary."
+
+    def __init__(self, multiplier=cpu_surfaces.MULTIPLIER):
+        self.multiplier = multiplier
+        self.max_position = None
+        self.min_position = None
+
+    def add(self, timestamp_json):
+        M = timestamp_json.get("max_position")
+        m = timestamp_json.get("min_positions")
+        if M is None or m is None:
+            return
+        if self.max_position is None:
+            self.max_position = np.array(M)
+            self.min_position = np.array(m)
+        else:
+            self.max_position = np.maximum(self.max_position, M)
+            self.min_position = np.minimum(self.min_position, m)
+
+    def json_fields(self):
+        "Sequence level fields matching cpu_surfaces.sequence_json."
+        M = self.max_position
+        m = self.min_position
+        if M is None:
+            return dict(diameter=0.0, center=None, multiplier=self.multiplier, max_position=None, min_position=None)
+        return dict(
+            diameter=float(np.linalg.norm(M - m)) / self.multiplier,
+            center=((M + m) // 2).tolist(),
+            multiplier=self.multiplier,
+            max_position=M.tolist(),
+            min_position=m.tolist(),
+        )
+
+
+class JsonSequenceWriter:
+
+    "Collect timestamps in memory and write the whole sequence JSON at close."
+
+    def __init__(self, to_json_path, multiplier=cpu_surfaces.MULTIPLIER):
+        self.to_json_path = to_json_path
+        self.sequence = cpu_surfaces.SurfaceSequence(multiplier)
+
+    def add(self, timestamp_json):
+        self.sequence.add(timestamp_json)
+
+    def close(self):
+        with open(self.to_json_path, "w") as f:
+            json.dump(self.sequence.json_repr(), f)
+
+
+class StreamingSequenceWriter:
+
+    """
+    Append each timestamp to a JSON file as soon as it is produced.
+    The finished file has the same content as JsonSequenceWriter output.
+    """
+
+    def __init__(self, to_json_path, multiplier=cpu_surfaces.MULTIPLIER):
+        self.to_json_path = to_json_path
+        self.extrema = SequenceExtrema(multiplier)
+        self.file = open(to_json_path, "w")
+        self.file.write('{"sequence": [')
+        self.count = 0
+
+    def add(self, timestamp_json):
+        if self.count:
+            self.file.write(", ")
+        json.dump(timestamp_json, self.file)
+        self.file.flush()
+        self.extrema.add(timestamp_json)
+        self.count += 1
+
+    def close(self):
+        f = self.file
+        f.write("]")
+        for (name, value) in self.extrema.json_fields().items():
+            f.write(", %s: %s" % (json.dumps(name), json.dumps(value)))
+        f.write("}")
+        f.close()
+
+
+def smallest_unsigned(maximum):
+    "Smallest unsigned integer dtype holding values up to maximum."
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if maximum <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+class BinarySequenceWriter:
+
+    """
+    Write surfaces as quantized typed arrays appended to to_path + ".bin"
+    described by a JSON manifest written to to_path at close.
+
+    Positions are stored relative to each surface's min_positions in the smallest unsigned type,
+    normals as int8 (rescaled from the multiplier to 127, so they are slightly lossy),
+    and indices in the smallest unsigned type for the vertex count.
+    """
+
+    def __init__(self, to_path, multiplier=cpu_surfaces.MULTIPLIER):
+        self.to_path = to_path
+        self.data_path = to_path + ".bin"
+        self.extrema = SequenceExtrema(multiplier)
+        self.data_file = open(self.data_path, "wb")
+        self.offset = 0
+        self.timestamps = []
+
+    def write_array(self, array):
+        "Append array to the data file and return its manifest description."
+        array = np.ascontiguousarray(array)
+        # align every array on 8 bytes for typed array views in javascript.
+        padding = (-self.offset) % 8
+        if padding:
+            self.data_file.write(b"\0" * padding)
+            self.offset += padding
+        description = dict(offset=self.offset, dtype=array.dtype.str, count=int(array.size))
+        self.data_file.write(array.tobytes())
+        self.offset += array.nbytes
+        return description
+
+    def add(self, timestamp_json):
+        surfaces = {}
+        for (name, surface) in timestamp_json["surfaces"].items():
+            multiplier = surface["multiplier"]
+            positions = np.array(surface["positions"], dtype=np.int64).reshape((-1, 3))
+            origin = np.array(surface["min_positions"], dtype=np.int64)
+            relative = positions - origin
+            qpositions = relative.astype(smallest_unsigned(relative.max() if relative.size else 0))
+            normals = np.array(surface["normals"], dtype=np.float64)
+            qnormals = np.round(normals * (127.0 / multiplier)).clip(-127, 127).astype(np.int8)
+            indices = np.array(surface["indices"], dtype=np.int64)
+            qindices = indices.astype(smallest_unsigned(max(len(positions) - 1, 0)))
+            description = {k: v for (k, v) in surface.items() if k not in ("positions", "normals", "indices")}
+            description["positions"] = self.write_array(qpositions)
+            description["normals"] = self.write_array(qnormals)
+            description["normals"]["scale"] = multiplier / 127.0
+            description["indices"] = self.write_array(qindices)
+            surfaces[name] = description
+        entry = {k: v for (k, v) in timestamp_json.items() if k != "surfaces"}
+        entry["surfaces"] = surfaces
+        self.timestamps.append(entry)
+        self.extrema.add(timestamp_json)
+        self.data_file.flush()
+
+    def close(self):
+        self.data_file.close()
+        manifest = self.extrema.json_fields()
+        manifest["format"] = BINARY_FORMAT
+        manifest["data_file"] = os.path.basename(self.data_path)
+        manifest["sequence"] = self.timestamps
+        with open(self.to_path, "w") as f:
+            json.dump(manifest, f)
+
+
+def read_binary_sequence(manifest_path):
+    "Read a BinarySequenceWriter container back into the sequence JSON format."
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    assert manifest.get("format") == BINARY_FORMAT, "not a binary surface sequence: " + repr(manifest_path)
+    data_path = os.path.join(os.path.dirname(manifest_path), manifest["data_file"])
+    data = np.memmap(data_path, dtype=np.uint8, mode="r")
+    def array(description):
+        dtype = np.dtype(description["dtype"])
+        start = description["offset"]
+        return np.frombuffer(data[start: start + dtype.itemsize * description["count"]], dtype=dtype)
+    sequence = []
+    for entry in manifest["sequence"]:
+        surfaces = {}
+        for (name, description) in entry["surfaces"].items():
+            surface = {k: v for (k, v) in description.items() if k not in ("positions", "normals", "indices")}
+            origin = np.array(description["min_positions"], dtype=np.int64)
+            positions = array(description["positions"]).astype(np.int64).reshape((-1, 3)) + origin
+            normals = np.round(array(description["normals"]) * description["normals"]["scale"]).astype(np.int64)
+            surface["positions"] = positions.ravel().tolist()
+            surface["normals"] = normals.tolist()
+            surface["indices"] = array(description["indices"]).astype(np.int64).tolist()
+            surfaces[name] = surface
+        timestamp_json = {k: v for (k, v) in entry.items() if k != "surfaces"}
+        timestamp_json["surfaces"] = surfaces
+        sequence.append(timestamp_json)
+    result = {k: v for (k, v) in manifest.items() if k not in ("format", "data_file", "sequence")}
+    result["sequence"] = sequence
+    return result
+
+
+def binary_to_json(manifest_path, to_json_path):
+    "Convert a binary container to sequence JSON (for example for surfaces_sequence.test_gizmo)."
+    with open(to_json_path, "w") as f:
+        json.dump(read_binary_sequence(manifest_path), f)
+
+
+WRITERS = {
+    "json": JsonSequenceWriter,
+    "stream": StreamingSequenceWriter,
+    "binary": BinarySequenceWriter,
+}
+
+
+def sequence_writer(output_format, to_path, multiplier=cpu_surfaces.MULTIPLIER):
+    "Writer for output_format, one of 'json', 'stream' or 'binary'."
+    assert output_format in WRITERS, "unknown output format: " + repr(output_format)
+    return WRITERS[output_format](to_path, multiplier)
@@ -0,0 +1,231 @@
+"""
+Memory budgeted least recently used cache for timestamp volumes.
+
+VolumeCache is thread safe and shared by the CachedLoader wrappers installed on a forest
+(see Forest.use_volume_cache), so revisiting a timestamp costs no disk I/O
+while the volumes fit in the byte budget.
+"""
+
+import inspect
+import itertools
+import threading
+import numpy as np
+from collections import OrderedDict
+
+DEFAULT_BUDGET = 4 * 1024 ** 3
+
+wrapper_tokens = itertools.count()
+
+
+def volume_roots(value, roots=None):
+    """
+    id -> array owning the memory for the arrays in a cached value (arrays or tuples of arrays; None is free).
+    Views resolve to the array they view.
+    """
+    if roots is None:
+        roots = {}
+    if value is None:
+        return roots
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            volume_roots(item, roots)
+        return roots
+    while isinstance(getattr(value, "base", None), np.ndarray):
+        value = value.base
+    if hasattr(value, "nbytes"):
+        roots[id(value)] = value
+    return roots
+
+
+def volume_bytes(value):
+    "Bytes kept alive by a cached value, counting each array once however many views of it the value holds."
+    return sum(root.nbytes for root in volume_roots(value).values())
+
+
+def supports_region(loader):
+    """
+    True if loader accepts a region= keyword.  A supports_region attribute on the loader
+    overrides the signature check; plain loader(ordinal) callables do not support regions.
+    """
+    flag = getattr(loader, "supports_region", None)
+    if flag is not None:
+        return bool(flag)
+    try:
+        parameters = inspect.signature(loader).parameters
+    except (TypeError, ValueError):
+        return False
+    return "region" in parameters or any(p.kind == p.VAR_KEYWORD for p in parameters.values())
+
+
+def crop_volume(volume, region):
+    "volume cut to region, (start, end) per axis as from operations3d.positive_slicing (None stays None)."
+    if volume is None:
+        return None
+    ((im, iM), (jm, jM), (km, kM)) = np.asarray(region).tolist()
+    return volume[max(im, 0):iM, max(jm, 0):jM, max(km, 0):kM]
+
+
+def load_volume(loader, ordinal, region=None):
+    """
+    loader(ordinal), or only region of that volume.  Loaders that do not support regions
+    load the whole volume, which is then cut to the region.
+    """
+    if region is None:
+        return loader(ordinal)
+    if supports_region(loader):
+        return loader(ordinal, region=region)
+    return crop_volume(loader(ordinal), region)
+
+
+class VolumeCache:
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()  # key -> (value, ids of its root arrays), least recently used first
+        # id -> [root array, number of entries using it]: arrays shared by entries
+        # (for example a raw volume and the views of it in a prepared entry) are counted once.
+        self.roots = {}
+        self.loading = {}  # key -> threading.Event for loads in progress
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        """
+        Cached value for key, or compute() stored under key.
+        Threads asking for a key that is already loading wait for that load.
+        """
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key][0]
+                event = self.loading.get(key)
+                if event is None:
+                    self.misses += 1
+                    event = self.loading[key] = threading.Event()
+                    break
+            # another thread is loading key; use its result (or retry if it failed or was not kept).
+            event.wait()
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key][0]
+            return compute()
+        try:
+            value = compute()
+            self.put(key, value)
+        finally:
+            with self.lock:
+                del self.loading[key]
+            event.set()
+        return value
+
+    def put(self, key, value):
+        roots = volume_roots(value)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            if sum(root.nbytes for root in roots.values()) > self.budget_bytes:
+                # too large to keep.
+                return
+            for (root_id, root) in roots.items():
+                use = self.roots.get(root_id)
+                if use is None:
+                    self.roots[root_id] = [root, 1]
+                    self.bytes += root.nbytes
+                else:
+                    use[1] += 1
+            self.entries[key] = (value, list(roots))
+            while self.bytes > self.budget_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        "Drop the entry for key, releasing root arrays no other entry uses (call holding the lock)."
+        (unused, root_ids) = self.entries.pop(key)
+        for root_id in root_ids:
+            use = self.roots[root_id]
+            use[1] -= 1
+            if use[1] == 0:
+                del self.roots[root_id]
+                self.bytes -= use[0].nbytes
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.roots.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=(self.hits / requests) if requests else 0.0,
+                evictions=self.evictions,
+                entries=len(self.entries),
+                bytes=self.bytes,
+                budget_bytes=self.budget_bytes,
+            )
+
+
+class CachedLoader:
+
+    """
+    Wrap a volume loader (ordinal -> array or None) so results are kept in a VolumeCache.
+    Regions are read with the wrapped loader if it supports them and cut from the whole volume otherwise.
+    Pickled copies (for example for worker processes) call the wrapped loader directly.
+    """
+
+    supports_region = True
+
+    def __init__(self, loader, cache):
+        self.loader = loader
+        self.cache = cache
+        self.token = next(wrapper_tokens)
+
+    def __call__(self, ordinal, region=None):
+        if region is None:
+            if self.cache is None:
+                return self.loader(ordinal)
+            return self.cache.get((self.token, ordinal), lambda: self.loader(ordinal))
+        if self.cache is None:
+            return load_volume(self.loader, ordinal, region)
+        region = np.asarray(region)
+        if self.cached(ordinal) or not supports_region(self.loader):
+            # cut the region out of the (cached) whole volume.
+            return crop_volume(self(ordinal), region)
+        # regions are cached separately from whole volumes.
+        key = (self.token, ordinal, tuple(map(tuple, region.tolist())))
+        return self.cache.get(key, lambda: self.loader(ordinal, region=region))
+
+    def cached(self, ordinal):
+        "True if the volume for ordinal is in the cache."
+        return self.cache is not None and (self.token, ordinal) in self.cache
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["cache"] = None
+        return state
+
+
+def uncached(loader):
+    "The loader wrapped by CachedLoader wrappers (or loader itself)."
+    while isinstance(loader, CachedLoader):
+        loader = loader.loader
+    return loader
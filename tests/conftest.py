@@ -0,0 +1,66 @@
+import os
+import random
+import numpy as np
+import pytest
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+def make_random_graph(n, seed, timestamps=40, labels=500):
+    """
+    MATLAB graph JSON like examples/Combined.json with up to n random nodes,
+    each linked to an earlier parent with probability 0.8 (so parents can have many children).
+    """
+    rng = random.Random(seed)
+    ordinals = {}
+    for i in range(n):
+        ordinal = rng.randint(1, timestamps)
+        ordinals.setdefault("%03d_%03d" % (ordinal, rng.randint(1, labels)), ordinal)
+    ids = list(ordinals)
+    edges = []
+    for child in ids:
+        parents = [p for p in rng.sample(ids, min(5, len(ids))) if ordinals[p] < ordinals[child]]
+        if parents and rng.random() < 0.8:
+            edges.append({"EndNodes": [parents[0], child]})
+    nodes = [{"Name": node_id} for node_id in ids]
+    return {"G_random": {"Nodes": nodes, "Edges": edges}}
+
+
+def write_segmentation(folder, timestamps):
+    """
+    Label TIFF volumes and cell CSV for two lineages of moving balls.
+    Lineage 1 has labels 3 and 4 on branches a and b, lineage 2 has label 7.
+    Returns (csv path, label file template).
+    """
+    import tifffile
+    (I, J, K) = np.indices((24, 28, 26))
+    rows = ["Time,Lineage,Branch,Cell_Label"]
+    template = os.path.join(str(folder), "%05d.tif")
+    for ts in timestamps:
+        labels = np.zeros(I.shape, dtype=np.uint16)
+        labels[(I - 8 - ts) ** 2 + (J - 9) ** 2 + (K - 10) ** 2 <= 16] = 3
+        labels[(I - 16) ** 2 + (J - 18 - ts) ** 2 + (K - 14) ** 2 <= 9] = 4
+        labels[(I - 6) ** 2 + (J - 20) ** 2 + (K - 5) ** 2 <= 4] = 7
+        tifffile.imwrite(template % ts, labels)
+        rows += ["%d,1,a,3" % ts, "%d,1,b,4" % ts, "%d,2,a,7" % ts]
+    csv_path = os.path.join(str(folder), "cells.csv")
+    with open(csv_path, "w") as f:
+        f.write("\n".join(rows) + "\n")
+    return (csv_path, template)
+
+
+@pytest.fixture
+def segmentation_files(tmp_path):
+    "(csv path, label file template) for synthetic label volumes at timestamps 1 to 5."
+    pytest.importorskip("tifffile")
+    return write_segmentation(tmp_path, [1, 2, 3, 4, 5])
+
+
+@pytest.fixture
+def random_graph():
+    return make_random_graph
+
+
+@pytest.fixture
+def combined_json_path():
+    return os.path.join(EXAMPLES, "Combined.json")
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from segmentation_viz_workflow import block_store
+
+
+def labels(shape=(37, 50, 23), seed=0):
+    "Mostly zero label volume so some chunks are empty."
+    rng = np.random.default_rng(seed)
+    result = np.zeros(shape, dtype=np.uint16)
+    result[5:20, 10:40, 3:15] = rng.integers(1, 100, size=(15, 30, 12))
+    return result
+
+
+@pytest.mark.parametrize("chunk_shape", [(8, 8, 8), (16, 7, 32), (64, 64, 64)])
+def test_regions_match_slicing(tmp_path, chunk_shape):
+    volume = labels()
+    store = block_store.BlockStore(str(tmp_path / "store"), chunk_shape=chunk_shape)
+    store.write(3, volume)
+    assert np.array_equal(store.read(3), volume)
+    rng = np.random.default_rng(1)
+    for trial in range(50):
+        start = [int(rng.integers(0, n)) for n in volume.shape]
+        end = [int(rng.integers(s + 1, n + 1)) for (s, n) in zip(start, volume.shape)]
+        region = np.array([start, end]).T
+        result = store.read(3, region)
+        assert result.dtype == volume.dtype
+        assert np.array_equal(result, volume[start[0]:end[0], start[1]:end[1], start[2]:end[2]])
+
+
+def test_regions_are_clipped_to_the_volume(tmp_path):
+    volume = labels()
+    store = block_store.BlockStore(str(tmp_path / "store"), chunk_shape=(8, 8, 8))
+    store.write(1, volume)
+    assert np.array_equal(store.read(1, [[-3, 10], [40, 100], [0, 23]]), volume[0:10, 40:, :])
+    assert store.read(1, [[50, 60], [0, 5], [0, 5]]).shape == (0, 5, 5)
+    assert store.read(2) is None
+
+
+def test_zero_chunks_are_not_stored(tmp_path):
+    store = block_store.BlockStore(str(tmp_path / "store"), chunk_shape=(8, 8, 8))
+    store.write(1, np.zeros((32, 32, 32), dtype=np.uint8))
+    assert np.array_equal(store.read(1), np.zeros((32, 32, 32), dtype=np.uint8))
+    assert store.entry(1)["table_offset"] == 0
+
+
+def test_reopened_store_and_loader(tmp_path):
+    import pickle
+    store_dir = str(tmp_path / "store")
+    volumes = {o: labels(seed=o) for o in [1, 2]}
+    block_store.convert_series(volumes.get, [1, 2, 4], store_dir, chunk_shape=(16, 16, 16), verbose=False)
+    reopened = block_store.BlockStore(store_dir)
+    assert reopened.ordinals() == [1, 2] and reopened.chunk_shape == (16, 16, 16)
+    loader = pickle.loads(pickle.dumps(block_store.BlockStoreLoader(store_dir)))
+    region = np.array([[2, 30], [5, 45], [0, 10]])
+    for (ordinal, volume) in volumes.items():
+        assert np.array_equal(loader(ordinal), volume)
+        assert np.array_equal(loader(ordinal, region=region), volume[2:30, 5:45, 0:10])
+    assert loader(4) is None
+
+
+def test_convert_series_resumes(tmp_path):
+    store_dir = str(tmp_path / "store")
+    calls = []
+
+    def loader(ordinal):
+        calls.append(ordinal)
+        return labels(seed=ordinal)
+
+    block_store.convert_series(loader, [1, 2], store_dir, verbose=False)
+    block_store.convert_series(loader, [1, 2, 3], store_dir, verbose=False)
+    assert calls == [1, 2, 3]
+    block_store.convert_series(loader, [1], store_dir, overwrite=True, verbose=False)
+    assert calls == [1, 2, 3, 1]
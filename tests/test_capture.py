@@ -0,0 +1,43 @@
+import asyncio
+import json
+import os
+import pytest
+
+pytest.importorskip("mouse_embryo_labeller")
+from segmentation_viz_workflow.csv_segmentation import Segmentation
+
+LINEAGE_TO_COLOR = {1: None, 2: [1, 0, 0]}
+
+
+def serial_capture(segmentation, path):
+    asyncio.run(segmentation.capture_lineages_as_json(
+        LINEAGE_TO_COLOR, path, engine="cpu", workers=1, prefetch=0))
+    with open(path) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("shards", [2, 3])
+def test_sharded_capture_matches_serial(tmp_path, segmentation_files, shards):
+    segmentation = Segmentation(*segmentation_files, stride=1)
+    expected = serial_capture(segmentation, str(tmp_path / "serial.json"))
+    assert len(expected["sequence"]) == len(segmentation.timestamps)
+    path = str(tmp_path / "sharded.json")
+    count = segmentation.capture_lineages_sharded(LINEAGE_TO_COLOR, path, shards=shards, engine="cpu")
+    assert count == len(segmentation.timestamps)
+    with open(path) as f:
+        # same timestamps in the same order.
+        assert json.load(f) == expected
+    assert [name for name in os.listdir(str(tmp_path)) if ".shard" in name] == []
+
+
+def test_sharded_capture_stops_at_missing_file(tmp_path, segmentation_files):
+    segmentation = Segmentation(*segmentation_files, stride=1)
+    os.remove(segmentation.label_array_path_template % 3)
+    expected = serial_capture(segmentation, str(tmp_path / "serial.json"))
+    assert len(expected["sequence"]) == 2
+    # shards [1, 2, 3] and [4, 5]: the second shard's timestamps follow the gap and are dropped.
+    path = str(tmp_path / "sharded.json")
+    count = segmentation.capture_lineages_sharded(LINEAGE_TO_COLOR, path, shards=2, engine="cpu")
+    assert count == 2
+    with open(path) as f:
+        assert json.load(f) == expected
@@ -0,0 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+from segmentation_viz_workflow.capture_stats import CaptureStats, record_when_done
+
+
+def test_record_when_done_times_futures_until_completion():
+    stats = CaptureStats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(time.sleep, 0.1)
+        record_when_done(stats, future, 3, "surfaces", start, voxels=10, labels=2)
+    [record] = stats.records
+    assert record["stage"] == "surfaces" and record["timestamp"] == 3
+    assert record["seconds"] >= 0.1 and (record["voxels"], record["labels"]) == (10, 2)
+    record_when_done(stats, {"surfaces": {}}, 4, "surfaces", time.perf_counter())
+    assert [r["timestamp"] for r in stats.records] == [3, 4]
+    record_when_done(None, future, 5, "surfaces", start)
+    assert stats.per_timestamp()[0]["surfaces_seconds"] >= 0.1
@@ -0,0 +1,95 @@
+import numpy as np
+from collections import Counter
+from segmentation_viz_workflow import cpu_surfaces
+
+
+def ball(shape, center, radius, label=1, labels=None):
+    if labels is None:
+        labels = np.zeros(shape, dtype=np.int32)
+    distance = np.sqrt(sum((g - c) ** 2 for (g, c) in zip(np.indices(shape), center)))
+    labels[distance <= radius] = label
+    return labels
+
+
+def edge_counts(triangles):
+    return Counter(tuple(sorted(e)) for t in triangles.tolist() for e in [t[:2], t[1:], [t[0], t[2]]])
+
+
+def test_sphere_isosurface_is_closed_and_round():
+    (I, J, K) = np.indices((21, 21, 21))
+    field = 6.0 - np.sqrt((I - 10) ** 2 + (J - 10) ** 2 + (K - 10) ** 2)
+    (positions, normals, triangles) = cpu_surfaces.isosurface(field, level=0)
+    assert len(triangles) > 0
+    # every edge is shared by exactly two triangles.
+    assert set(edge_counts(triangles).values()) == {2}
+    radii = np.sqrt(((positions - 10) ** 2).sum(axis=1))
+    assert np.abs(radii - 6).max() < 0.1
+    # normals point out of the ball (toward decreasing field values).
+    assert ((positions - 10) * normals).sum(axis=1).min() > 0
+    assert np.allclose(np.sqrt((normals ** 2).sum(axis=1)), 1)
+
+
+def test_empty_and_flat_fields_have_no_surface():
+    for field in [np.zeros((5, 5, 5)), np.ones((5, 5, 5)), np.ones((1, 5, 5))]:
+        (positions, normals, triangles) = cpu_surfaces.isosurface(field)
+        assert positions.shape == (0, 3) and triangles.shape == (0, 3)
+
+
+def test_label_surface_encloses_the_label():
+    labels = ball((30, 30, 30), (10, 12, 20), 4, label=3)
+    (positions, normals, triangles) = cpu_surfaces.label_surface(labels, 3)
+    assert set(edge_counts(triangles).values()) == {2}
+    center = positions.mean(axis=0)
+    assert np.abs(center - [10, 12, 20]).max() < 0.25
+    assert cpu_surfaces.label_surface(labels, 4) is None
+
+
+def test_label_touching_the_boundary_is_closed():
+    labels = np.zeros((6, 6, 6), dtype=np.int32)
+    labels[:3, :3, :3] = 1
+    (positions, normals, triangles) = cpu_surfaces.label_surface(labels, 1)
+    assert set(edge_counts(triangles).values()) == {2}
+
+
+def test_timestamp_json_offset_matches_uncropped_volume():
+    labels = ball((40, 40, 40), (12, 15, 20), 5, label=1)
+    ball((40, 40, 40), (25, 22, 18), 4, label=2, labels=labels)
+    label_dict = {1: "a", 2: "b"}
+    color_dict = {1: (1, 0, 0), 2: (0, 0.5, 1)}
+    full = cpu_surfaces.timestamp_json(labels, label_dict, color_dict)
+    start = np.array([3, 5, 7])
+    cropped = cpu_surfaces.timestamp_json(labels[3:, 5:, 7:], label_dict, color_dict, offset=start)
+    shifted = cpu_surfaces.shift_timestamp_json(
+        cpu_surfaces.timestamp_json(labels[3:, 5:, 7:], label_dict, color_dict), start)
+    assert sorted(full["surfaces"]) == ["a", "b"]
+    for other in (cropped, shifted):
+        for (name, surface) in full["surfaces"].items():
+            surface2 = other["surfaces"][name]
+            assert surface2["indices"] == surface["indices"]
+            difference = np.array(surface2["positions"]) - np.array(surface["positions"])
+            # equal up to rounding of the quantized positions.
+            assert np.abs(difference).max() <= 1
+
+
+def test_sequence_json_extrema():
+    labels = ball((20, 20, 20), (8, 8, 8), 3)
+    first = cpu_surfaces.timestamp_json(labels, {1: "a"}, {1: (1, 1, 1)})
+    second = cpu_surfaces.shift_timestamp_json(first, [5, 0, 0])
+    sequence = cpu_surfaces.SurfaceSequence()
+    sequence.add(first)
+    sequence.add(second)
+    result = sequence.json_repr()
+    assert result["sequence"] == [first, second]
+    assert result["max_position"] == second["max_position"]
+    assert result["min_position"] == first["min_positions"]
+    assert sequence.take_last() == second
+    assert sequence.json_repr()["sequence"] == [first]
+
+
+def test_cpu_surface_maker_in_process():
+    import asyncio
+    labels = ball((20, 20, 20), (8, 8, 8), 3)
+    maker = cpu_surfaces.CPUSurfaceMaker(workers=1)
+    asyncio.run(maker.add_surfaces(labels, {1: "a"}, {1: (1, 0, 0)}))
+    [result] = maker.sequence.json_repr()["sequence"]
+    assert result == cpu_surfaces.timestamp_json(labels, {1: "a"}, {1: (1, 0, 0)})
@@ -0,0 +1,47 @@
+import os
+import pytest
+
+pytest.importorskip("mouse_embryo_labeller")
+from segmentation_viz_workflow.csv_segmentation import Segmentation
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+NEGATIVE_LINEAGES = """Time,Lineage,Branch,Cell_Label
+1,-1,a,5
+1,2,b,6
+1,-1,b,7
+2,0,a,8
+1,3,a,9
+2,-2,b,10
+1,-3,a,11
+"""
+
+
+def both_modes(csv_path):
+    return [Segmentation(csv_path, "missing_%05d.tif", columnar=columnar) for columnar in (False, True)]
+
+
+def check_same_cells(rows, columns, timestamps, lineages):
+    assert rows.timestamps == columns.timestamps
+    assert rows.branches == columns.branches
+    for ts in timestamps:
+        for lineage in lineages:
+            assert sorted(columns.lineage_cells(ts, lineage)) == sorted(rows.lineage_cells(ts, lineage))
+            assert columns.label_dict(ts, lineage) == rows.label_dict(ts, lineage)
+            assert columns.color_dict(ts, lineage, (1, 0, 0)) == rows.color_dict(ts, lineage, (1, 0, 0))
+
+
+def test_columnar_mode_matches_rows_on_example():
+    (rows, columns) = both_modes(os.path.join(EXAMPLES, "stack_2_tree_cell_association.csv"))
+    lineages = sorted(set(columns.lineage.tolist()))
+    check_same_cells(rows, columns, [0] + rows.timestamps + [max(rows.timestamps) + 1], lineages + [max(lineages) + 1])
+
+
+def test_negative_lineages(tmp_path):
+    path = str(tmp_path / "cells.csv")
+    with open(path, "w") as f:
+        f.write(NEGATIVE_LINEAGES)
+    (rows, columns) = both_modes(path)
+    check_same_cells(rows, columns, [0, 1, 2, 3], [-4, -3, -2, -1, 0, 1, 2, 3, 4])
+    assert sorted(columns.lineage_cells(1, -1)) == [(5, "a"), (7, "b")]
+    assert columns.labels_at(1, [-3, 3]).tolist() == [11, 9]
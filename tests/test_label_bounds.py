@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from segmentation_viz_workflow import lineage_forest
+
+
+def random_labels(seed, shape=(12, 15, 9)):
+    rng = np.random.default_rng(seed)
+    result = np.zeros(shape, dtype=np.int32)
+    start = [int(rng.integers(0, n)) for n in shape]
+    end = [int(rng.integers(s + 1, n + 1)) for (s, n) in zip(start, shape)]
+    result[start[0]:end[0], start[1]:end[1], start[2]:end[2]] = rng.integers(0, 4, size=np.subtract(end, start))
+    return result
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_label_bounds_match_positive_slicing(seed):
+    operations3d = pytest.importorskip("array_gizmos.operations3d")
+    volume = random_labels(seed)
+    bounds = lineage_forest.label_bounds(lambda ordinal: volume, 1)
+    if not volume.any():
+        assert bounds is None
+    else:
+        assert bounds.tolist() == np.asarray(operations3d.positive_slicing(volume)).tolist()
+
+
+def test_crop_region_needs_every_timestamp():
+    volumes = {1: random_labels(1), 2: random_labels(2), 3: None}
+    forest = lineage_forest.Forest()
+    for ordinal in volumes:
+        forest.add_node("%03d_001" % ordinal, ordinal, 1)
+    forest.label_volume_loader = volumes.get
+    forest.compute_label_bounds(ordinals=[1], workers=1)
+    assert forest.missing_label_bounds() == [2, 3]
+    assert forest.crop_region() is None
+    forest.compute_label_bounds(workers=1)
+    assert forest.label_bounds[3] is None
+    bounds = np.array([forest.label_bounds[1], forest.label_bounds[2]])
+    expected = np.stack([bounds[:, :, 0].min(axis=0), bounds[:, :, 1].max(axis=0)], axis=1)
+    assert forest.crop_region().tolist() == expected.tolist()
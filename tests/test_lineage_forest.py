@@ -0,0 +1,196 @@
+import json
+import sys
+import pytest
+from segmentation_viz_workflow import lineage_forest
+
+
+def resolved_forest(graph, start_at=0, colorize="tracks"):
+    forest = lineage_forest.make_forest_from_haydens_json_graph(graph)
+    forest.find_tracks_and_lineages()
+    forest.assign_offsets(start_at)
+    if colorize == "tracks":
+        forest.assign_colors_to_tracks()
+    else:
+        forest.assign_colors_to_lineages()
+    return forest
+
+
+def reference_offsets(graph, start_at=0):
+    """
+    Node offsets computed like the original recursive Node.assign_offsets over dictionaries,
+    with lineages in node id order and isolated (single node) lineages after all others.
+    """
+    [graph] = graph.values()
+    parent = {}
+    children = {}
+    ids = set(thing["Name"] for thing in graph["Nodes"])
+    for thing in graph["Edges"]:
+        (p, c) = thing["EndNodes"]
+        ids.update((p, c))
+        # like the original reader, the last edge to a child wins.
+        parent[c] = p
+    for (c, p) in parent.items():
+        children.setdefault(p, []).append(c)
+    offsets = {}
+
+    def assign(node_id, cursor):
+        child_ids = sorted(children.get(node_id, []))
+        if not child_ids:
+            offsets[node_id] = cursor[0]
+        elif len(child_ids) == 1:
+            assign(child_ids[0], cursor)
+            offsets[node_id] = offsets[child_ids[0]]
+        else:
+            assign(child_ids[0], cursor)
+            cursor[0] += 1
+            for child_id in child_ids[1:]:
+                assign(child_id, cursor)
+            offsets[node_id] = 0.5 * (offsets[child_ids[0]] + offsets[child_ids[-1]])
+        return cursor[0]
+
+    roots = sorted(i for i in ids if i not in parent)
+    cursor = start_at
+    for isolated in (False, True):
+        for root in roots:
+            if (root not in children) == isolated:
+                cursor = assign(root, [cursor]) + 1
+    return offsets
+
+
+def offsets(forest):
+    return {i: n["offset"] for (i, n) in forest.json_ob(False)["id_to_node"].items()}
+
+
+def rebuilt(forest, start_at, colorize):
+    "A forest with the same nodes and links as forest, laid out from scratch."
+    nodes = forest.json_ob(False)["id_to_node"]
+    result = lineage_forest.Forest()
+    for (i, n) in nodes.items():
+        result.add_node(i, n["timestamp_ordinal"], n["label"])
+    for (i, n) in nodes.items():
+        if n["parent_id"] is not None:
+            result.id_to_node[n["parent_id"]].set_child(result.id_to_node[i])
+    result.find_tracks_and_lineages()
+    result.assign_offsets(start_at)
+    if colorize == "tracks":
+        result.assign_colors_to_tracks()
+    else:
+        result.assign_colors_to_lineages()
+    return result
+
+
+def state(forest):
+    return dict(
+        nodes=forest.json_ob(False)["id_to_node"],
+        tracks=[t.root.node_id for t in forest.track_order],
+        track_indices=[t.index for t in forest.track_order],
+        lineages=sorted(forest.id_to_lineage),
+        dimensions=forest.dimensions(),
+    )
+
+
+def test_offsets_match_reference_on_example(combined_json_path):
+    with open(combined_json_path) as f:
+        graph = json.load(f)
+    assert offsets(resolved_forest(graph)) == reference_offsets(graph)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_offsets_match_reference_on_random_graphs(random_graph, seed):
+    graph = random_graph(300 + 100 * seed, seed)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    assert offsets(resolved_forest(graph, start_at=seed)) == reference_offsets(graph, start_at=seed)
+
+
+def test_node_group_membership(random_graph):
+    forest = resolved_forest(random_graph(500, 3))
+    nodes = forest.json_ob(False)["id_to_node"]
+    for (ordinal, ts) in forest.ordinal_to_timestamp.items():
+        assert sorted(ts.id_to_node) == sorted(i for (i, n) in nodes.items() if n["timestamp_ordinal"] == ordinal)
+    members = [i for lineage in forest.id_to_lineage.values() for i in lineage.id_to_node]
+    assert sorted(members) == sorted(nodes)
+    assert len(lineage_forest.NodeGroup().node_indices()) == 0
+
+
+@pytest.mark.parametrize("colorize", ["tracks", "lineages"])
+def test_incremental_edits_match_full_layout(random_graph, colorize):
+    import random
+    rng = random.Random(colorize)
+    forest = resolved_forest(random_graph(400, 7), start_at=3, colorize=colorize)
+    ids = list(forest.id_to_node)
+    for step in range(30):
+        before = forest.json_ob(False)["id_to_node"]
+        choice = rng.random()
+        if choice < 0.4:
+            changed = forest.unlink(rng.choice(ids))
+        elif choice < 0.55:
+            node_id = "new_%d" % step
+            forest.add_node(node_id, rng.choice(list(forest.ordinal_to_timestamp)), 5000 + step)
+            changed = forest.last_changed_ids
+            ids.append(node_id)
+        else:
+            child = rng.choice(ids)
+            ordinal = forest.id_to_node[child].timestamp_ordinal
+            parents = [i for i in rng.sample(ids, 30) if forest.id_to_node[i].timestamp_ordinal < ordinal]
+            if not parents:
+                continue
+            changed = forest.link(parents[0], child)
+        assert state(forest) == state(rebuilt(forest, 3, colorize))
+        after = forest.json_ob(False)["id_to_node"]
+        assert set(i for i in after if before.get(i) != after[i]) <= set(changed)
+
+
+def test_save_and_load_round_trip(tmp_path, random_graph):
+    forest = resolved_forest(random_graph(800, 11))
+    forest.label_bounds[1] = [[0, 5], [1, 6], [2, 7]]
+    path = str(tmp_path / "forest.npz")
+    forest.save(path)
+    loaded = lineage_forest.Forest.load(path)
+    # ids and derived mappings are built on first use and the file is no longer needed.
+    assert loaded.arrays._ids is None and "id_to_lineage" not in loaded.__dict__
+    assert loaded.saved_path == path
+    (tmp_path / "forest.npz").unlink()
+    assert state(loaded) == state(forest)
+    assert loaded.json_ob() == forest.json_ob()
+    for ordinal in forest.ordinal_to_timestamp:
+        assert loaded.timestamp_region_json(ordinal) == forest.timestamp_region_json(ordinal)
+    assert loaded.label_bounds[1].tolist() == [[0, 5], [1, 6], [2, 7]]
+    # incremental edits continue from the saved layout.
+    ids = sorted(forest.id_to_node)
+    child = ids[-1]
+    parent = min(ids, key=lambda i: forest.id_to_node[i].timestamp_ordinal)
+    if forest.id_to_node[parent].timestamp_ordinal < forest.id_to_node[child].timestamp_ordinal:
+        assert loaded.link(parent, child) == forest.link(parent, child)
+        assert state(loaded) == state(forest)
+
+
+def test_save_and_load_unresolved(tmp_path, random_graph):
+    graph = random_graph(300, 12)
+    forest = lineage_forest.make_forest_from_haydens_json_graph(graph)
+    path = str(tmp_path / "raw.npz")
+    forest.save(path)
+    loaded = lineage_forest.Forest.load(path)
+    assert loaded.id_to_lineage is None and loaded.layout is None
+    loaded.find_tracks_and_lineages()
+    loaded.assign_offsets()
+    loaded.assign_colors_to_tracks()
+    assert loaded.json_ob() == resolved_forest(graph).json_ob()
+
+
+def test_cached_forest_is_rebuilt_when_the_source_changes(tmp_path, combined_json_path):
+    import os
+    import shutil
+    path = str(tmp_path / "Combined.json")
+    shutil.copy(combined_json_path, path)
+    first = lineage_forest.load_forest_from_haydens_json_file(path)
+    assert os.path.exists(path + ".forest.npz")
+    second = lineage_forest.load_forest_from_haydens_json_file(path)
+    assert second.json_ob() == first.json_ob()
+    with open(path) as f:
+        graph = json.load(f)
+    [graph_name] = graph
+    graph[graph_name]["Edges"] = graph[graph_name]["Edges"][1:]
+    with open(path, "w") as f:
+        json.dump(graph, f)
+    third = lineage_forest.load_forest_from_haydens_json_file(path)
+    assert offsets(third) == reference_offsets(graph)
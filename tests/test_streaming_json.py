@@ -0,0 +1,97 @@
+import io
+import json
+import pytest
+from segmentation_viz_workflow import lineage_forest
+from segmentation_viz_workflow.streaming_json import JsonStream
+
+DOCUMENT = {
+    "G": {
+        "Nodes": [{"Name": "%03d_%03d" % (i % 7, i), "Weight": i * 1.25e-3, "Tag": "x},{y"} for i in range(50)],
+        "Edges": [{"EndNodes": ["%d" % i, "%d" % (i + 1)], "Nested": [[i, -i], {"a": None}]} for i in range(30)],
+    },
+    "Numbers": [123456789, -0.5, 1e10, True, False, None, "s"],
+    "Empty": [],
+}
+
+
+def items(stream, batch_size):
+    batches = list(stream.array_batches(batch_size))
+    assert all(0 < len(batch) <= batch_size for batch in batches)
+    return [item for batch in batches for item in batch]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 1 << 20])
+@pytest.mark.parametrize("batch_size", [1, 4, 1000])
+def test_array_batches_match_json_load(chunk_size, batch_size):
+    text = json.dumps(DOCUMENT, indent=1)
+    stream = JsonStream(io.StringIO(text), chunk_size=chunk_size)
+    result = {}
+    for key in stream.object_keys():
+        if key == "G":
+            result[key] = {part: items(stream, batch_size) for part in stream.object_keys()}
+        else:
+            result[key] = items(stream, batch_size)
+    assert result == json.loads(text)
+    assert stream.peek() is None
+
+
+def test_numbers_split_across_chunks():
+    text = "[1234567, 2.5e-7, 89]"
+    for chunk_size in range(1, len(text) + 1):
+        stream = JsonStream(io.StringIO(text), chunk_size=chunk_size)
+        assert [item for batch in stream.array_batches() for item in batch] == [1234567, 2.5e-7, 89]
+
+
+def test_bad_document_raises():
+    stream = JsonStream(io.StringIO('{"a": [1, 2'), chunk_size=2)
+    with pytest.raises((AssertionError, json.JSONDecodeError)):
+        for key in stream.object_keys():
+            list(stream.array_batches())
+
+
+def resolved(forest):
+    forest.find_tracks_and_lineages()
+    forest.assign_offsets()
+    forest.assign_colors_to_tracks()
+    return forest.json_ob()
+
+
+def test_stream_forest_matches_json_load(combined_json_path):
+    with open(combined_json_path) as f:
+        expected = lineage_forest.make_forest_from_haydens_json_graph(json.load(f))
+    streamed = lineage_forest.stream_forest_from_haydens_json_file(combined_json_path, batch_size=97)
+    assert resolved(streamed) == resolved(expected)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_stream_forest_with_edges_before_nodes(tmp_path, random_graph, seed):
+    graph = random_graph(2000, seed)
+    (name,) = graph
+    reordered = {"Other": {"skipped": [1, 2]}, name: {"Edges": graph[name]["Edges"], "Nodes": graph[name]["Nodes"]}}
+    path = str(tmp_path / "graph.json")
+    with open(path, "w") as f:
+        json.dump(reordered, f)
+    expected = lineage_forest.make_forest_from_haydens_json_graph(graph)
+    streamed = lineage_forest.stream_forest_from_haydens_json_file(path, batch_size=50)
+    assert resolved(streamed) == resolved(expected)
+
+
+def test_stream_forest_uses_the_last_graph(tmp_path, random_graph):
+    first = random_graph(300, 4)
+    last = random_graph(500, 5)
+    graphs = {"G_first": first["G_random"], "Notes": "x", "G_last": last["G_random"]}
+    path = str(tmp_path / "graphs.json")
+    with open(path, "w") as f:
+        json.dump(graphs, f)
+    expected = lineage_forest.make_forest_from_haydens_json_graph(graphs)
+    streamed = lineage_forest.stream_forest_from_haydens_json_file(path, batch_size=64)
+    assert resolved(streamed) == resolved(expected)
+    assert resolved(streamed) == resolved(lineage_forest.make_forest_from_haydens_json_graph(last))
+
+
+def test_stream_forest_without_graph(tmp_path):
+    path = str(tmp_path / "empty.json")
+    with open(path, "w") as f:
+        json.dump({"Notes": {"Nodes": []}}, f)
+    with pytest.raises(ValueError):
+        lineage_forest.stream_forest_from_haydens_json_file(path)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from segmentation_viz_workflow.strided_tiff import load_strided_tiff_array
+
+tifffile = pytest.importorskip("tifffile")
+
+
+def volume(shape=(7, 10, 13), dtype=np.uint16):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 1000, size=shape).astype(dtype)
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+@pytest.mark.parametrize("stride", [1, 2, 3])
+def test_strided_read_matches_full_read(tmp_path, compression, stride):
+    path = str(tmp_path / "labels.tif")
+    tifffile.imwrite(path, volume(), compression=compression)
+    expected = tifffile.imread(path)[::stride, ::stride, ::stride]
+    result = load_strided_tiff_array(path, stride)
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+def test_single_page_stack(tmp_path):
+    path = str(tmp_path / "labels.tif")
+    tifffile.imwrite(path, volume((1, 5, 6), np.int32), compression="zlib")
+    expected = tifffile.imread(path).reshape((1, 5, 6))[::2, ::2, ::2]
+    assert np.array_equal(load_strided_tiff_array(path, 2), expected)
+
+
+def test_not_a_3d_stack(tmp_path):
+    path = str(tmp_path / "image.tif")
+    tifffile.imwrite(path, volume((5, 6)))
+    assert load_strided_tiff_array(path, 2) is None
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_bytes_read_counts_only_the_planes_read(tmp_path, compression):
+    import os
+    path = str(tmp_path / "labels.tif")
+    tifffile.imwrite(path, volume((8, 10, 13)), compression=compression)
+    counts = {}
+    load_strided_tiff_array(path, 3, counts)
+    with tifffile.TiffFile(path) as tif:
+        plane_bytes = [int(sum(page.databytecounts)) for page in tif.pages]
+    assert counts["bytes_read"] == sum(plane_bytes[::3])
+    assert counts["bytes_read"] < os.path.getsize(path)
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import pytest
+from segmentation_viz_workflow.surface_cache import SurfaceCache
+
+LABELS = {3: 3, 4: 4}
+COLORS = {3: [1, 0, 0], 4: [0, 0.5, 1]}
+
+
+def write_file(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_key_covers_file_and_parameters(tmp_path):
+    path = str(tmp_path / "labels.tif")
+    write_file(path, b"first")
+    cache = SurfaceCache(str(tmp_path / "cache"))
+    base = (path, 2, 0.7, "cpu", LABELS, COLORS, 5, 999)
+    key = cache.key(*base)
+    assert cache.key(*base) == key
+    # same labels and colors in another order.
+    assert cache.key(path, 2, 0.7, "cpu", {4: 4, 3: 3}, {4: [0, 0.5, 1], 3: [1, 0, 0]}, 5, 999) == key
+    changed = [
+        (path, 1, 0.7, "cpu", LABELS, COLORS, 5, 999),
+        (path, 2, 0.5, "cpu", LABELS, COLORS, 5, 999),
+        (path, 2, 0.7, "browser", LABELS, COLORS, 5, 999),
+        (path, 2, 0.7, "cpu", {3: 3}, COLORS, 5, 999),
+        (path, 2, 0.7, "cpu", LABELS, {3: [1, 0, 0], 4: [0, 0, 1]}, 5, 999),
+        (path, 2, 0.7, "cpu", LABELS, COLORS, None, 999),
+        (path, 2, 0.7, "cpu", LABELS, COLORS, 6, 999),
+        (path, 2, 0.7, "cpu", LABELS, COLORS, 5, 1000),
+    ]
+    keys = [cache.key(*args) for args in changed]
+    assert key not in keys and len(set(keys)) == len(keys)
+    # new content (size and mtime change) invalidates the remembered file hash.
+    write_file(path, b"second")
+    os.utime(path, (1, 1))
+    assert cache.key(*base) != key
+
+
+def test_get_and_put(tmp_path):
+    cache = SurfaceCache(str(tmp_path / "cache"))
+    assert cache.get("missing") is None
+    cache.put("k", {"surfaces": {}})
+    assert cache.get("k") == {"surfaces": {}}
+    # file hashes are remembered across cache instances.
+    path = str(tmp_path / "labels.tif")
+    write_file(path, b"labels")
+    digest = cache.file_hash(path)
+    assert SurfaceCache(str(tmp_path / "cache")).hash_index[os.path.abspath(path)][1] == digest
+
+
+def test_capture_reuses_and_invalidates_entries(tmp_path, segmentation_files):
+    pytest.importorskip("mouse_embryo_labeller")
+    from segmentation_viz_workflow.csv_segmentation import Segmentation
+    segmentation = Segmentation(*segmentation_files, stride=1)
+    timestamps = segmentation.timestamps
+    cache_dir = str(tmp_path / "cache")
+
+    def capture(name, **options):
+        path = str(tmp_path / name)
+        SM = asyncio.run(segmentation.capture_lineages_as_json(
+            {1: None, 2: [1, 0, 0]}, path, engine="cpu", workers=1, prefetch=0, cache_dir=cache_dir, **options))
+        with open(path) as f:
+            return (SM, json.load(f))
+
+    def entries():
+        return len([name for name in os.listdir(cache_dir) if name != "file_hashes.json"])
+
+    (SM, first) = capture("first.json")
+    assert SM is not None and entries() == len(timestamps)
+    # every timestamp is a hit, so no surface maker is made.
+    (SM, second) = capture("second.json")
+    assert SM is None and second == first
+    # cropping and blur change the surfaces, so they miss.
+    (SM, uncropped) = capture("uncropped.json", crop=False)
+    assert SM is not None and entries() == 2 * len(timestamps)
+    capture("blurred.json", blur=0.5)
+    assert entries() == 3 * len(timestamps)
+    # a rewritten label file misses only for its timestamp.
+    path = segmentation.label_array_path_template % timestamps[0]
+    with open(path, "rb") as f:
+        content = f.read()
+    write_file(path, content + b"\0")
+    capture("third.json")
+    assert entries() == 3 * len(timestamps) + 1
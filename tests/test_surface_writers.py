@@ -0,0 +1,74 @@
+import json
+import numpy as np
+import pytest
+from segmentation_viz_workflow import cpu_surfaces, surface_writers
+
+
+def synthetic_timestamps():
+    "Surface JSON for 3 timestamps of two growing and moving balls."
+    result = []
+    (I, J, K) = np.indices((30, 30, 30))
+    for t in range(3):
+        labels = np.zeros((30, 30, 30), dtype=np.int32)
+        labels[(I - 10 - t) ** 2 + (J - 12) ** 2 + (K - 14) ** 2 <= (4 + t) ** 2] = 1
+        labels[(I - 20) ** 2 + (J - 18 - t) ** 2 + (K - 15) ** 2 <= 9] = 2
+        result.append(cpu_surfaces.timestamp_json(labels, {1: "a", 2: "b"}, {1: (1, 0, 0), 2: (0, 0.5, 1)}))
+    # a timestamp without surfaces.
+    result.append(cpu_surfaces.timestamp_json_from_surfaces({}))
+    return result
+
+
+def expected_sequence(timestamps):
+    sequence = cpu_surfaces.SurfaceSequence()
+    for timestamp_json in timestamps:
+        sequence.add(timestamp_json)
+    return json.loads(json.dumps(sequence.json_repr()))
+
+
+@pytest.mark.parametrize("output_format", ["json", "stream"])
+def test_json_outputs_match_json_repr(tmp_path, output_format):
+    timestamps = synthetic_timestamps()
+    path = str(tmp_path / "sequence.json")
+    writer = surface_writers.sequence_writer(output_format, path)
+    for timestamp_json in timestamps:
+        writer.add(timestamp_json)
+    writer.close()
+    with open(path) as f:
+        assert json.load(f) == expected_sequence(timestamps)
+
+
+def test_empty_stream(tmp_path):
+    path = str(tmp_path / "sequence.json")
+    writer = surface_writers.StreamingSequenceWriter(path)
+    writer.close()
+    with open(path) as f:
+        assert json.load(f) == expected_sequence([])
+
+
+def test_binary_round_trip(tmp_path):
+    timestamps = synthetic_timestamps()
+    path = str(tmp_path / "sequence.manifest.json")
+    writer = surface_writers.sequence_writer("binary", path)
+    for timestamp_json in timestamps:
+        writer.add(timestamp_json)
+    writer.close()
+    result = surface_writers.read_binary_sequence(path)
+    expected = expected_sequence(timestamps)
+    assert {k: v for (k, v) in result.items() if k != "sequence"} == {
+        k: v for (k, v) in expected.items() if k != "sequence"}
+    assert len(result["sequence"]) == len(expected["sequence"])
+    for (read, original) in zip(result["sequence"], expected["sequence"]):
+        assert sorted(read["surfaces"]) == sorted(original["surfaces"])
+        for (name, surface) in original["surfaces"].items():
+            copy = read["surfaces"][name]
+            # positions and indices are exact; normals are rescaled to int8.
+            assert copy["positions"] == surface["positions"]
+            assert copy["indices"] == surface["indices"]
+            error = np.abs(np.array(copy["normals"]) - np.array(surface["normals"]))
+            assert error.max() <= surface["multiplier"] / 127.0
+            for key in ("name", "color", "multiplier", "max_position", "min_positions"):
+                assert copy[key] == surface[key]
+    converted = str(tmp_path / "converted.json")
+    surface_writers.binary_to_json(path, converted)
+    with open(converted) as f:
+        assert json.load(f) == json.loads(json.dumps(result))
@@ -0,0 +1,144 @@
+import pickle
+import threading
+import time
+import numpy as np
+from segmentation_viz_workflow import lineage_forest, volume_cache
+from segmentation_viz_workflow.volume_cache import VolumeCache, CachedLoader
+
+
+def volume(ordinal, shape=(10, 10, 10)):
+    return np.arange(np.prod(shape), dtype=np.uint8).reshape(shape) + np.uint8(ordinal)
+
+
+class CountingLoader:
+
+    def __init__(self, delay=0):
+        self.calls = []
+        self.delay = delay
+
+    def __call__(self, ordinal):
+        self.calls.append(ordinal)
+        time.sleep(self.delay)
+        if ordinal < 0:
+            return None
+        return volume(ordinal)
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = VolumeCache(budget_bytes=3500)
+    loader = CountingLoader()
+    cached = CachedLoader(loader, cache)
+    for ordinal in [1, 2, 3, 1, 4]:
+        assert np.array_equal(cached(ordinal), volume(ordinal))
+    # 3 volumes of 1000 bytes fit; 2 was least recently used when 4 arrived.
+    assert loader.calls == [1, 2, 3, 4]
+    assert [cached.cached(o) for o in [1, 2, 3, 4]] == [True, False, True, True]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 4, 1)
+    assert stats["bytes"] == 3000 <= stats["budget_bytes"]
+    cached(2)
+    assert loader.calls == [1, 2, 3, 4, 2]
+
+
+def test_missing_and_oversized_volumes():
+    cache = VolumeCache(budget_bytes=500)
+    loader = CountingLoader()
+    cached = CachedLoader(loader, cache)
+    assert cached(-1) is None and cached(-1) is None
+    # None costs nothing and is remembered.
+    assert loader.calls == [-1]
+    cached(1)
+    cached(1)
+    assert loader.calls == [-1, 1, 1]
+    assert cache.stats()["bytes"] == 0
+
+
+def test_views_and_shared_arrays_count_once():
+    base = np.zeros((10, 10, 10), dtype=np.uint8)
+    assert volume_cache.volume_bytes((base, base[2:5], [base[::2]])) == base.nbytes
+    assert volume_cache.volume_bytes(base[:1]) == base.nbytes
+    assert volume_cache.volume_bytes((None, np.zeros(3), np.zeros(3))) == 48
+
+
+def test_arrays_shared_between_entries_count_once():
+    cache = VolumeCache(budget_bytes=2500)
+    raw = volume(1)
+    cache.put("raw", raw)
+    # a prepared entry holding a crop of the raw volume and a new 500 byte array.
+    enhanced = np.zeros(500, dtype=np.uint8)
+    cache.put("prepared", ([raw[2:8]], [enhanced], raw[2:8]))
+    assert cache.stats()["bytes"] == raw.nbytes + enhanced.nbytes == 1500
+    # the raw volume stays counted while the prepared entry uses it.
+    cache.discard("raw")
+    assert cache.stats()["bytes"] == 1500
+    cache.put("other", volume(2))
+    assert cache.stats()["bytes"] == 2500 and cache.stats()["evictions"] == 0
+    cache.put("third", volume(3))
+    # evicting the prepared entry releases the raw volume and the enhanced array.
+    assert "prepared" not in cache and cache.stats()["bytes"] == 2000
+    cache.discard("other")
+    cache.discard("third")
+    assert cache.stats()["bytes"] == 0 and cache.roots == {}
+
+
+def test_concurrent_requests_load_once():
+    loader = CountingLoader(delay=0.05)
+    cached = CachedLoader(loader, VolumeCache())
+    threads = [threading.Thread(target=cached, args=(2,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == [2]
+
+
+def test_regions_for_loaders_without_region_support():
+    region = np.array([[1, 4], [0, 10], [2, 3]])
+    expected = volume(3)[1:4, :, 2:3]
+
+    def plain(ordinal):
+        return volume(ordinal)
+
+    assert not volume_cache.supports_region(plain)
+    assert not volume_cache.supports_region(lambda ordinal: None)
+    assert np.array_equal(volume_cache.load_volume(plain, 3, region), expected)
+    cache = VolumeCache()
+    cached = CachedLoader(plain, cache)
+    assert volume_cache.supports_region(cached)
+    assert np.array_equal(cached(3, region=region), expected)
+    # the whole volume is cached and later regions are cut from it.
+    assert cached.cached(3)
+    assert np.array_equal(cached(3, region=[[0, 2], [0, 2], [0, 2]]), volume(3)[:2, :2, :2])
+
+
+def test_regions_for_loaders_with_region_support():
+    calls = []
+
+    def regional(ordinal, region=None):
+        calls.append(None if region is None else np.asarray(region).tolist())
+        return volume_cache.crop_volume(volume(ordinal), region) if region is not None else volume(ordinal)
+
+    assert volume_cache.supports_region(regional)
+    cached = CachedLoader(regional, VolumeCache())
+    region = [[1, 4], [0, 10], [2, 3]]
+    for i in range(2):
+        assert np.array_equal(cached(5, region=region), volume(5)[1:4, :, 2:3])
+    assert calls == [region]
+    assert not cached.cached(5)
+
+
+def test_forest_volume_cache_with_plain_loaders():
+    forest = lineage_forest.Forest()
+    forest.add_node("001_001", 1, 1)
+    loader = CountingLoader()
+    forest.image_volume_loader = loader
+    forest.label_volume_loader = lambda ordinal: volume(ordinal)
+    forest.use_volume_cache(10000)
+    region = np.array([[0, 3], [0, 3], [0, 3]])
+    assert np.array_equal(forest.load_image_for_timestamp(1, region=region), volume(1)[:3, :3, :3])
+    assert np.array_equal(forest.load_labels_for_timestamp(1, region=region), volume(1)[:3, :3, :3])
+    forest.load_image_for_timestamp(1)
+    assert loader.calls == [1]
+    # pickled loaders (for worker processes) do not share the cache.
+    copy = pickle.loads(pickle.dumps(forest.image_volume_loader))
+    assert copy.cache is None and np.array_equal(copy(2), volume(2))